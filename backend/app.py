@@ -3,19 +3,44 @@
 from flask import Flask, send_from_directory
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
+from sqlalchemy import inspect
+from database import engine_options, install_sqlite_pragmas, is_sqlite
 import os
 
+try:
+    from flask_migrate import Migrate # Alembic migrations (`flask db ...`), see migrations/README
+except ImportError:
+    Migrate = None
+
 app = Flask(__name__)
 CORS(app)
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///transactions_db.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///transactions_db.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Pooling and, on SQLite, WAL and friends; tunable through the environment (see database.py)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+# create_all() and a stamp at head when the database is empty at startup: the default
+# for SQLite only, where a fresh file must just work; server databases are set up with
+# `flask db upgrade`. Existing databases are only ever changed by migrations.
+app.config['SCHEMA_AUTO_CREATE'] = os.environ.get(
+    'SCHEMA_AUTO_CREATE', '1' if is_sqlite(app.config['SQLALCHEMY_DATABASE_URI']) else '0'
+).lower() not in ('0', 'false', 'no')
 app.config['JSON_SORT_KEYS'] = False
-app.config['DEBUG'] = True
-app.config['UPLOAD_FOLDER'] = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'uploads/documents')
+# Off unless asked for: the debugger runs arbitrary code for whoever reaches it
+app.config['DEBUG'] = os.environ.get('FLASK_DEBUG', '0').lower() not in ('0', 'false', 'no', '')
+app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', os.path.join(os.path.abspath(os.path.dirname(__file__)), 'uploads/documents'))
+app.config['MAX_DOCUMENT_SIZE'] = int(os.environ.get('MAX_DOCUMENT_SIZE', 100 * 1024 * 1024)) # Bytes, for chunked uploads
+app.config['PREVIEW_FOLDER'] = os.environ.get('PREVIEW_FOLDER', os.path.join(app.config['UPLOAD_FOLDER'], '.previews'))
+app.config['JOB_FOLDER'] = os.environ.get('JOB_FOLDER', os.path.join(app.config['UPLOAD_FOLDER'], '.jobs')) # Inputs and results of background jobs
 
 
 db = SQLAlchemy(app)
+with app.app_context():
+    install_sqlite_pragmas(db.engine)
+if Migrate is not None:
+    # Batch mode lets ALTERs run on SQLite, which rebuilds the table instead
+    Migrate(app, db, directory=os.path.join(os.path.abspath(os.path.dirname(__file__)), 'migrations'),
+            render_as_batch=True)
 
 # NEW CODE INSERTED FOR DEPLOYMENT
 frontend_folder = os.path.join(os.getcwd(), "..", "frontend")
@@ -34,14 +59,38 @@ def index(filename):
 
 # api routes
 import routes
+# CLI maintenance commands
+import commands
 
 # Create database and upload folder
 with app.app_context():
     # print("Dropping existing tables (if any) and creating new ones...")
     # db.drop_all() # Use with caution in production!
-    db.create_all()
+    if app.config['SCHEMA_AUTO_CREATE'] and not inspect(db.engine).get_table_names():
+        # A fresh database only: build the current schema and stamp it as migrated to
+        # head, so later `flask db upgrade`s apply from there. Existing databases are
+        # never altered here; their schema changes come from migrations/versions.
+        db.create_all()
+        if Migrate is not None:
+            from flask_migrate import stamp
+            stamp(directory=app.extensions['migrate'].directory, revision='head')
+        else:
+            app.logger.warning("Flask-Migrate is not installed: the new database is not stamped, "
+                               "run `flask db stamp head` before the next `flask db upgrade`.")
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+    # Databases created before the daily balance table existed need one full build
+    # (skipped until `flask db upgrade` has created the schema)
+    from balances import ensure_daily_balances
+    schema_ready = inspect(db.engine).has_table('daily_balance')
+    if schema_ready:
+        ensure_daily_balances()
+
+    # SQLite gets a full-text search index (see search.py), built once from the ledger
+    from search import ensure_search_index
+    if schema_ready:
+        ensure_search_index()
+
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=app.config['DEBUG'])
\ No newline at end of file
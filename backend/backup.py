@@ -0,0 +1,520 @@
+# File path: backend/backup.py
+
+from app import db
+from flask import current_app
+from models import Transaction, Document, TagGroup, Setting, Backup, Counter, CHANGE_EPOCH_COUNTER, transaction_tags
+from serializers import serialize_transactions
+from filters import apply_keyset_order, encode_cursor
+from storage import document_storage_name
+from database import begin_snapshot
+from sqlalchemy import select, update, func
+from sqlalchemy.orm import selectinload
+from datetime import datetime, timezone
+import hashlib
+import json
+import os
+import uuid
+import zipfile
+
+
+# Streaming, incremental backup archives.
+#
+# The ZIP is written to a small in-memory buffer that is drained after every
+# entry piece, so the archive goes out to the client while it is being built
+# and memory use does not depend on the ledger or upload folder size. zipfile
+# supports unseekable outputs by writing a data descriptor after each entry.
+#
+# Every archive holds:
+#   transactions.json   transactions with tags and documents (same format as the
+#                       original backup); only the changed ones in an incremental
+#   tags.json           tag groups with their tags
+#   settings.json       settings
+#   Documents/          document files whose content is not already in the chain
+#   manifest.json       backup id, base backup id, the ids of every transaction
+#                       that exists (as ranges), and every document with its
+#                       sha256 and the archive/path holding its content
+#
+# A full backup has no base. An incremental backup is taken against a base
+# (full or incremental) recorded in the Backup table: it packs the transactions
+# written after the base's snapshot, and the document files whose content hash
+# is not in the base manifest. Deletions show up as ids missing from the newer
+# manifest. Restoring replays the full archive and then each incremental of the
+# chain in order (see read_backup_chain()).
+#
+# "Written after the snapshot" is told by change epochs, not clocks: every write
+# stamps the transaction with the epoch open at the time (models.py). A backup
+# first closes the open epoch, which waits for the writers of that epoch to
+# commit, and then reads everything from one snapshot. Every row of the closed
+# epoch or earlier is in that snapshot, so the next incremental packs the rows
+# of later epochs only. A timestamp would miss a row written before a backup
+# started and committed after its snapshot (a long atomic import, say).
+
+
+MANIFEST_FORMAT_VERSION = 3
+BACKUP_BATCH_SIZE = 500
+FILE_CHUNK_SIZE = 1024 * 1024
+DOCUMENTS_FOLDER_IN_ZIP = "Documents/"
+
+# Deflating these again costs CPU and saves next to nothing
+ALREADY_COMPRESSED_EXTENSIONS = {'pdf', 'jpg', 'jpeg', 'png', 'gif', 'zip', 'docx', 'xlsx', 'gz', 'webp', 'heic'}
+
+
+
+class ZipStreamBuffer:
+    """Write-only file object collecting what zipfile writes until it is drained."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+
+# --- Helpers ---
+
+
+
+def utc_now():
+    """Naive UTC now, comparable with the server_default timestamps of the models."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def backup_filename(document_id, original_filename):
+    """Name of a document inside the archive's Documents/ folder (id-prefixed, so unique)."""
+    return f"{document_id}_{original_filename.replace('/', '_').replace(' ', '_')}"
+
+
+def compress_type_for(filename, store_compressed=True):
+    """ZIP_STORED for already-compressed formats when `store_compressed`, else ZIP_DEFLATED."""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if store_compressed and extension in ALREADY_COMPRESSED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def id_ranges(ids):
+    """Compresses sorted ids to [[first, last], ...] runs of consecutive ids."""
+    ranges = []
+    for tx_id in ids:
+        if ranges and tx_id == ranges[-1][1] + 1:
+            ranges[-1][1] = tx_id
+        else:
+            ranges.append([tx_id, tx_id])
+    return ranges
+
+
+def expand_id_ranges(ranges):
+    """Inverse of id_ranges()."""
+    return {tx_id for first, last in ranges for tx_id in range(first, last + 1)}
+
+
+def iter_file_chunks(path, digest=None):
+    """Yields the content of a file FILE_CHUNK_SIZE bytes at a time, feeding `digest` if given."""
+    with open(path, 'rb') as source:
+        while True:
+            chunk = source.read(FILE_CHUNK_SIZE)
+            if not chunk:
+                return
+            if digest is not None:
+                digest.update(chunk)
+            yield chunk
+
+
+def file_sha256(path):
+    """Hex sha256 of a file's content."""
+    digest = hashlib.sha256()
+    for _ in iter_file_chunks(path, digest):
+        pass
+    return digest.hexdigest()
+
+
+def close_change_epoch():
+    """
+    Closes the open change epoch and commits. The bump waits for the writers
+    that stamped rows with the epoch, so all of them are committed by then.
+    Returns the closed epoch.
+    """
+    Counter.bump(CHANGE_EPOCH_COUNTER, start=1)
+    epoch = db.session.execute(select(Counter.value).where(Counter.name == CHANGE_EPOCH_COUNTER)).scalar() - 1
+    db.session.commit()
+    return epoch
+
+
+def touch_tagged_transactions(tag_ids):
+    """
+    Bumps updated_at of the transactions linked to any of `tag_ids` (a list or
+    a select of tag ids). Tag links live in an association table, so without
+    this an incremental backup would not see a transaction whose tags changed.
+    """
+    db.session.execute(
+        update(Transaction)
+        .where(Transaction.id.in_(
+            select(transaction_tags.c.transaction_id).where(transaction_tags.c.tag_id.in_(tag_ids))
+        ))
+        .values(updated_at=func.now())
+        .execution_options(synchronize_session=False)
+    )
+
+
+
+# --- Writing Archives ---
+
+
+
+def iter_transactions_json(after_epoch=None):
+    """
+    Yields transactions.json as text pieces: the same list of transactions
+    (with tags and documents, documents carrying 'backup_filename') as the old
+    json.dumps(..., indent=4) output, serialized BACKUP_BATCH_SIZE rows at a time
+    with keyset pagination. With `after_epoch`, only transactions written in a
+    later change epoch.
+    """
+    base_query = Transaction.query
+    if after_epoch is not None:
+        base_query = base_query.filter(Transaction.change_epoch > after_epoch)
+
+    yield '['
+    first = True
+    cursor = None
+    while True:
+        query = apply_keyset_order(base_query, 'asc', cursor).limit(BACKUP_BATCH_SIZE)
+        batch = serialize_transactions(query)
+        if not batch:
+            break
+        for tx_json in batch:
+            for doc_json in tx_json['documents']:
+                doc_json['backup_filename'] = backup_filename(doc_json['id'], doc_json['original_filename'])
+            text = json.dumps(tx_json, indent=4, default=str)
+            yield ('\n' if first else ',\n') + '    ' + text.replace('\n', '\n    ')
+            first = False
+        last = batch[-1]
+        cursor = encode_cursor(last['date'], last['id'])
+    yield ']' if first else '\n]'
+
+
+def write_entry_from_iterable(zip_archive, buffer, name, pieces, compress_type=zipfile.ZIP_DEFLATED):
+    """Writes one archive entry from an iterable of bytes, yielding output as it is produced."""
+    info = zipfile.ZipInfo(name, date_time=datetime.now().timetuple()[:6])
+    info.compress_type = compress_type
+    with zip_archive.open(info, 'w', force_zip64=True) as entry:
+        for piece in pieces:
+            entry.write(piece)
+            data = buffer.drain()
+            if data:
+                yield data
+    data = buffer.drain()
+    if data:
+        yield data
+
+
+def write_json_entry(zip_archive, buffer, name, value):
+    """Writes a small JSON document as one archive entry."""
+    return write_entry_from_iterable(zip_archive, buffer, name, [json.dumps(value, indent=4, default=str).encode('utf-8')])
+
+
+def document_metadata(doc):
+    """The Document fields a restore needs, as stored in the manifest."""
+    return {
+        'transaction_id': doc.transaction_id,
+        'original_filename': doc.original_filename,
+        'mimetype': doc.mimetype,
+        'created_at': doc.created_at.isoformat() if doc.created_at else None,
+    }
+
+
+def iter_backup_archive(store_compressed=True, base=None):
+    """
+    Yields a backup ZIP as a stream of bytes: a full backup, or an incremental
+    one against `base` (a Backup record). Once the whole archive has been
+    produced the run is recorded in the Backup table, so it can serve as the base
+    of the next incremental. Must run inside an app context.
+    """
+    started_at = utc_now()
+    backup_id = str(uuid.uuid4())
+    base_manifest = json.loads(base.manifest) if base is not None else None
+    # A base taken before change epochs existed has none: every row is packed again
+    since_epoch = base_manifest.get('change_epoch') if base_manifest is not None else None
+    change_epoch = close_change_epoch()
+    begin_snapshot(db.session)
+
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_archive:
+        yield from write_entry_from_iterable(
+            zip_archive, buffer, 'transactions.json',
+            (text.encode('utf-8') for text in iter_transactions_json(since_epoch)),
+        )
+        tag_groups = TagGroup.query.options(selectinload(TagGroup.tags)).order_by(TagGroup.id.asc()).all()
+        yield from write_json_entry(zip_archive, buffer, 'tags.json', [group.to_json(include_tags=True) for group in tag_groups])
+        yield from write_json_entry(zip_archive, buffer, 'settings.json', [setting.to_json() for setting in Setting.query.order_by(Setting.id.asc())])
+
+        known_documents = base_manifest['documents'] if base_manifest else {}
+        known_by_hash = {entry['sha256']: entry for entry in known_documents.values()}
+        documents = {}
+        upload_folder = current_app.config['UPLOAD_FOLDER']
+        if not os.path.isdir(upload_folder):
+            current_app.logger.error(f"Upload folder {upload_folder} not found or is not a directory during backup.")
+        else:
+            for doc in Document.query.order_by(Document.id.asc()).yield_per(BACKUP_BATCH_SIZE):
+                metadata = document_metadata(doc)
+                known = known_documents.get(str(doc.id))
+                # Uploaded files never change, so a document already in the chain is carried over
+                if known is not None and known['created_at'] == metadata['created_at']:
+                    documents[str(doc.id)] = dict(known, **metadata)
+                    continue
+
+                doc_file_path = os.path.join(upload_folder, document_storage_name(doc))
+                if not os.path.isfile(doc_file_path):
+                    current_app.logger.warning(f"Document file not found or is not a file: {doc_file_path} for document ID {doc.id} (original: {doc.original_filename}). Skipping.")
+                    continue
+
+                # Blob-backed documents carry their hash; legacy files are hashed only for incrementals
+                digest_hex = doc.blob_sha256
+                if digest_hex is None and base is not None:
+                    digest_hex = file_sha256(doc_file_path)
+                if digest_hex is not None:
+                    same_content = known_by_hash.get(digest_hex)
+                    if same_content is not None:
+                        documents[str(doc.id)] = dict(metadata, sha256=digest_hex, size=same_content['size'],
+                                                      archive=same_content['archive'], path=same_content['path'])
+                        continue
+
+                path_in_zip = f"{DOCUMENTS_FOLDER_IN_ZIP}{backup_filename(doc.id, doc.original_filename)}"
+                digest = hashlib.sha256()
+                yield from write_entry_from_iterable(
+                    zip_archive, buffer, path_in_zip,
+                    iter_file_chunks(doc_file_path, digest),
+                    compress_type_for(doc.original_filename, store_compressed),
+                )
+                entry = dict(metadata, sha256=digest.hexdigest(), size=os.path.getsize(doc_file_path),
+                             archive=backup_id, path=path_in_zip)
+                documents[str(doc.id)] = entry
+                known_by_hash.setdefault(entry['sha256'], entry)
+
+        transaction_ids = db.session.execute(select(Transaction.id).order_by(Transaction.id.asc())).scalars()
+        manifest = {
+            'format_version': MANIFEST_FORMAT_VERSION,
+            'backup_id': backup_id,
+            'kind': 'incremental' if base is not None else 'full',
+            'base_backup_id': base.id if base is not None else None,
+            'created_at': started_at.isoformat(),
+            'change_epoch': change_epoch,
+            'since_epoch': since_epoch,
+            'transaction_ids': id_ranges(transaction_ids),
+            'documents': documents,
+        }
+        yield from write_json_entry(zip_archive, buffer, 'manifest.json', manifest)
+
+    # Central directory, written when the archive is closed
+    yield buffer.drain()
+
+    db.session.commit() # Ends the snapshot; SQLite cannot write from a snapshot older than the last commit
+    db.session.add(Backup(
+        id=backup_id,
+        kind=manifest['kind'],
+        base_id=manifest['base_backup_id'],
+        created_at=started_at,
+        manifest=json.dumps(manifest),
+    ))
+    db.session.commit()
+
+
+
+# --- Reading and Replaying Archives ---
+
+
+
+def read_json_entry(zip_archive, name, default=None):
+    if name not in zip_archive.namelist():
+        return default
+    with zip_archive.open(name) as entry:
+        return json.load(entry)
+
+
+def read_manifest(zip_archive):
+    """
+    Returns the manifest of an archive. Archives made before manifests existed
+    are described as a standalone full backup built from transactions.json.
+    """
+    manifest = read_json_entry(zip_archive, 'manifest.json')
+    if manifest is not None:
+        return manifest
+
+    documents = {}
+    transaction_ids = []
+    for tx in read_json_entry(zip_archive, 'transactions.json', default=[]):
+        transaction_ids.append(tx['id'])
+        for doc in tx.get('documents', []):
+            documents[str(doc['id'])] = {
+                'transaction_id': tx['id'],
+                'original_filename': doc['original_filename'],
+                'mimetype': doc['mimetype'],
+                'created_at': doc.get('created_at'),
+                'sha256': None,
+                'size': None,
+                'archive': None,
+                'path': f"{DOCUMENTS_FOLDER_IN_ZIP}{doc['backup_filename']}",
+            }
+    return {
+        'format_version': 1,
+        'backup_id': None,
+        'kind': 'full',
+        'base_backup_id': None,
+        'created_at': None,
+        'change_epoch': None,
+        'since_epoch': None,
+        'transaction_ids': id_ranges(sorted(transaction_ids)),
+        'documents': documents,
+    }
+
+
+def order_backup_chain(zip_archives):
+    """
+    Orders open archives from the full backup to the newest incremental,
+    checking that they form one unbroken chain. Returns [(zip_archive, manifest)].
+    Raises ValueError when they do not.
+    """
+    entries = [(zip_archive, read_manifest(zip_archive)) for zip_archive in zip_archives]
+    if not entries:
+        raise ValueError("No backup archives given.")
+    by_id = {manifest['backup_id']: (zip_archive, manifest) for zip_archive, manifest in entries}
+    if len(by_id) != len(entries):
+        raise ValueError("The same backup was given more than once.")
+
+    bases = {manifest['base_backup_id'] for _, manifest in entries}
+    tips = [manifest for _, manifest in entries if manifest['backup_id'] not in bases]
+    if len(tips) != 1:
+        raise ValueError("The archives do not form a single backup chain.")
+
+    chain = []
+    current = tips[0]['backup_id']
+    while current is not None:
+        if current not in by_id:
+            raise ValueError(f"Backup {current} is missing from the chain.")
+        chain.append(by_id.pop(current))
+        current = chain[-1][1]['base_backup_id']
+    if by_id:
+        raise ValueError("Some archives are not part of the backup chain.")
+    if chain[-1][1]['kind'] != 'full':
+        raise ValueError("The backup chain does not start with a full backup.")
+    chain.reverse()
+    return chain
+
+
+def read_backup_chain(zip_archives):
+    """
+    Replays a full backup and its incrementals (in any order). Returns a dict:
+        manifest        the newest manifest
+        transactions    the latest version of every transaction still present,
+                        ordered by (date, id)
+        tag_groups      tag groups with their tags, as of the newest archive
+        settings        settings, as of the newest archive
+        documents       {document_id: manifest entry}, each with a 'source'
+                        archive to read its content from (None if missing)
+    Raises ValueError when the archives are not one chain, or when a
+    transaction the newest manifest lists is in none of them.
+    """
+    chain = order_backup_chain(zip_archives)
+    tip_archive, tip_manifest = chain[-1]
+
+    transactions = {}
+    for zip_archive, _ in chain:
+        for tx in read_json_entry(zip_archive, 'transactions.json', default=[]):
+            transactions[tx['id']] = tx
+    present_ids = expand_id_ranges(tip_manifest['transaction_ids'])
+    missing = sorted(present_ids - transactions.keys())
+    if missing:
+        raise ValueError(f"{len(missing)} transaction(s) listed in the newest manifest are in none of the archives "
+                         f"(ids {', '.join(map(str, missing[:20]))}). The chain is incomplete or damaged.")
+    ordered = sorted((tx for tx_id, tx in transactions.items() if tx_id in present_ids),
+                     key=lambda tx: (tx['date'], tx['id']))
+
+    archives_by_id = {manifest['backup_id']: zip_archive for zip_archive, manifest in chain}
+    documents = {}
+    for doc_id, entry in tip_manifest['documents'].items():
+        source = archives_by_id.get(entry['archive'])
+        if source is None and entry['archive'] is None:
+            source = tip_archive
+        if source is not None and entry['path'] not in source.namelist():
+            source = None
+        documents[int(doc_id)] = dict(entry, source=source)
+
+    return {
+        'manifest': tip_manifest,
+        'transactions': ordered,
+        'tag_groups': read_json_entry(tip_archive, 'tags.json', default=None),
+        'settings': read_json_entry(tip_archive, 'settings.json', default=None),
+        'documents': documents,
+    }
+
+
+def iter_merged_archive(zip_archives, store_compressed=True):
+    """
+    Yields one full archive equivalent to a backup chain (full + incrementals),
+    keeping the newest backup id so later incrementals still chain onto it.
+    """
+    state = read_backup_chain(zip_archives)
+    tip = state['manifest']
+
+    documents_by_tx = {}
+    for doc_id, entry in sorted(state['documents'].items()):
+        if entry['source'] is not None:
+            documents_by_tx.setdefault(entry['transaction_id'], []).append((doc_id, entry))
+
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_archive:
+        def transaction_pieces():
+            yield b'['
+            for position, tx in enumerate(state['transactions']):
+                tx = dict(tx, documents=[
+                    {
+                        'id': doc_id,
+                        'original_filename': entry['original_filename'],
+                        'mimetype': entry['mimetype'],
+                        'transaction_id': entry['transaction_id'],
+                        'created_at': entry['created_at'],
+                        'backup_filename': backup_filename(doc_id, entry['original_filename']),
+                    }
+                    for doc_id, entry in documents_by_tx.get(tx['id'], [])
+                ])
+                text = json.dumps(tx, indent=4, default=str)
+                yield (('\n' if position == 0 else ',\n') + '    ' + text.replace('\n', '\n    ')).encode('utf-8')
+            yield b'\n]' if state['transactions'] else b']'
+
+        yield from write_entry_from_iterable(zip_archive, buffer, 'transactions.json', transaction_pieces())
+        yield from write_json_entry(zip_archive, buffer, 'tags.json', state['tag_groups'] or [])
+        yield from write_json_entry(zip_archive, buffer, 'settings.json', state['settings'] or [])
+
+        documents = {}
+        for doc_id, entry in sorted(state['documents'].items()):
+            source = entry.pop('source')
+            if source is None:
+                continue
+            path_in_zip = f"{DOCUMENTS_FOLDER_IN_ZIP}{backup_filename(doc_id, entry['original_filename'])}"
+
+            def source_chunks(source=source, path=entry['path']):
+                with source.open(path) as content:
+                    while True:
+                        chunk = content.read(FILE_CHUNK_SIZE)
+                        if not chunk:
+                            return
+                        yield chunk
+
+            yield from write_entry_from_iterable(
+                zip_archive, buffer, path_in_zip, source_chunks(),
+                compress_type_for(entry['original_filename'], store_compressed),
+            )
+            documents[str(doc_id)] = dict(entry, archive=tip['backup_id'], path=path_in_zip)
+
+        manifest = dict(tip, kind='full', base_backup_id=None, documents=documents)
+        yield from write_json_entry(zip_archive, buffer, 'manifest.json', manifest)
+    yield buffer.drain()
@@ -0,0 +1,344 @@
+# File path: backend/balances.py
+
+from app import db
+from models import Transaction, Setting, DailyBalance
+from filters import apply_transaction_filters
+from sqlalchemy import select, func, union_all, and_, or_, case, insert, update, delete
+from sqlalchemy.orm import aliased
+import decimal
+
+
+# Balance rules (same as the transaction grid has always used):
+#   - a regular transaction or a child counts with its own amount;
+#   - a split parent counts with its amount minus the sum of its children,
+#     so a parent and its children together count exactly the parent amount.
+#
+# Per-date totals are materialized in the DailyBalance table. The write routes
+# snapshot the contributions of the "family" they touch (a top-level transaction
+# and its children) before and after the change and apply only the difference,
+# so a write costs O(log n) plus one UPDATE of the running totals after the
+# changed date, and reading the balance of any date is a single index lookup.
+
+
+CENTS = decimal.Decimal('0.01')
+
+
+def to_decimal(value):
+    """Normalizes a SQL sum (Decimal, float or None) to a 2-place Decimal."""
+    if value is None:
+        return decimal.Decimal('0.00')
+    return decimal.Decimal(str(value)).quantize(CENTS, rounding=decimal.ROUND_HALF_UP)
+
+
+def get_initial_balance():
+    """Returns the 'initial_balance' setting as a Decimal (0.00 if unset)."""
+    setting = Setting.query.filter_by(key='initial_balance').first()
+    if setting is None or setting.value is None:
+        return decimal.Decimal('0.00')
+    return to_decimal(setting.value)
+
+
+def ledger_contributions():
+    """
+    Subquery of (date, amount) rows whose per-date sum is the effective daily
+    total of the whole ledger: every transaction with its own amount, plus a
+    negative row per child on its parent's date.
+    """
+    parent = aliased(Transaction)
+    child = aliased(Transaction)
+    own_amounts = select(
+        Transaction.date.label('date'),
+        Transaction.amount.label('amount'),
+    )
+    children_offsets = (
+        select(
+            parent.date.label('date'),
+            (-child.amount).label('amount'),
+        )
+        .join(parent, child.parent_id == parent.id)
+        .where(parent.children_flag.is_(True), parent.parent_id.is_(None))
+    )
+    return union_all(own_amounts, children_offsets).subquery('contributions')
+
+
+def effective_amount_column():
+    """
+    Returns (effective_amount, children_sums): a column expression for a
+    transaction's effective amount, and the children-sums subquery that the
+    caller must outer-join on children_sums.c.parent_id == Transaction.id.
+    """
+    children_sums = (
+        select(
+            Transaction.parent_id.label('parent_id'),
+            func.sum(Transaction.amount).label('children_total'),
+        )
+        .where(Transaction.parent_id.isnot(None))
+        .group_by(Transaction.parent_id)
+        .subquery('children_sums')
+    )
+    is_parent = and_(Transaction.children_flag.is_(True), Transaction.parent_id.is_(None))
+    effective = Transaction.amount - case(
+        (is_parent, func.coalesce(children_sums.c.children_total, 0)),
+        else_=0,
+    )
+    return effective, children_sums
+
+
+def running_total_before(date):
+    """Running total at the end of the last day before `date` (0.00 if none)."""
+    value = db.session.execute(
+        select(DailyBalance.running_total)
+        .where(DailyBalance.date < date)
+        .order_by(DailyBalance.date.desc())
+        .limit(1)
+    ).scalar()
+    return to_decimal(value)
+
+
+def running_total_at(date):
+    """Running total at the end of `date` (0.00 if nothing happened up to then)."""
+    value = db.session.execute(
+        select(DailyBalance.running_total)
+        .where(DailyBalance.date <= date)
+        .order_by(DailyBalance.date.desc())
+        .limit(1)
+    ).scalar()
+    return to_decimal(value)
+
+
+def balance_before(date, initial_balance=None):
+    """Ledger balance at the end of the day before `date` (or initial balance if None)."""
+    if initial_balance is None:
+        initial_balance = get_initial_balance()
+    if date is None:
+        return initial_balance
+    return initial_balance + running_total_before(date)
+
+
+def balance_at(date, initial_balance=None):
+    """Ledger balance at the end of `date`."""
+    if initial_balance is None:
+        initial_balance = get_initial_balance()
+    return initial_balance + running_total_at(date)
+
+
+def ledger_total():
+    """Sum of the effective amounts of the whole ledger."""
+    value = db.session.execute(
+        select(DailyBalance.running_total).order_by(DailyBalance.date.desc()).limit(1)
+    ).scalar()
+    return to_decimal(value)
+
+
+def final_running_balance():
+    """Balance after the last transaction of the ledger (initial_balance + all effective amounts)."""
+    return get_initial_balance() + ledger_total()
+
+
+def ledger_daily_balances(start_date=None, end_date=None, initial_balance=None):
+    """
+    Returns {date: (day_sum, end_of_day_balance)} for every date in the range
+    that has at least one transaction, read from the DailyBalance table.
+    """
+    if initial_balance is None:
+        initial_balance = get_initial_balance()
+    query = select(DailyBalance.date, DailyBalance.total, DailyBalance.running_total)
+    if start_date is not None:
+        query = query.where(DailyBalance.date >= start_date)
+    if end_date is not None:
+        query = query.where(DailyBalance.date <= end_date)
+    query = query.order_by(DailyBalance.date.asc())
+
+    return {
+        row.date: (to_decimal(row.total), initial_balance + to_decimal(row.running_total))
+        for row in db.session.execute(query)
+    }
+
+
+def filtered_daily_sums(args):
+    """
+    Returns [(date, sum, count)] of the effective amounts of the transactions
+    matching the request filters (see filters.apply_transaction_filters).
+    """
+    effective, children_sums = effective_amount_column()
+    query = (
+        apply_transaction_filters(Transaction.query, args)
+        .outerjoin(children_sums, children_sums.c.parent_id == Transaction.id)
+        .with_entities(
+            Transaction.date,
+            func.sum(effective).label('day_sum'),
+            func.count(Transaction.id).label('day_count'),
+        )
+        .group_by(Transaction.date)
+        .order_by(Transaction.date.asc())
+    )
+    return [(row.date, to_decimal(row.day_sum), row.day_count) for row in query]
+
+
+
+# --- Incremental Maintenance ---
+
+
+
+def family_root_id(transaction):
+    """Id of the top-level transaction whose family `transaction` belongs to."""
+    return transaction.parent_id if transaction.parent_id is not None else transaction.id
+
+
+def family_contributions(root_id):
+    """
+    Returns {date: [sum, count]} of what the family rooted at `root_id` (the
+    transaction and its children) currently contributes to the ledger. Pending
+    ORM changes are flushed first, so call it once before and once after a change.
+    """
+    db.session.flush()
+    rows = db.session.execute(
+        select(
+            Transaction.id,
+            Transaction.parent_id,
+            Transaction.date,
+            Transaction.amount,
+            Transaction.children_flag,
+        ).where(or_(Transaction.id == root_id, Transaction.parent_id == root_id))
+    ).all()
+
+    root = next((row for row in rows if row.id == root_id), None)
+    root_is_split_parent = root is not None and root.children_flag and root.parent_id is None
+
+    totals = {}
+    for row in rows:
+        amount = to_decimal(row.amount)
+        day = totals.setdefault(row.date, [decimal.Decimal('0.00'), 0])
+        day[0] += amount
+        day[1] += 1
+        if row.parent_id == root_id and root_is_split_parent:
+            parent_day = totals.setdefault(root.date, [decimal.Decimal('0.00'), 0])
+            parent_day[0] -= amount
+    return totals
+
+
+def apply_contribution_deltas(before, after):
+    """
+    Applies the difference between two family_contributions() snapshots to the
+    DailyBalance table. Must run inside the same DB transaction as the change.
+    """
+    zero = (decimal.Decimal('0.00'), 0)
+    for day in sorted(set(before) | set(after)):
+        delta_sum = after.get(day, zero)[0] - before.get(day, zero)[0]
+        delta_count = after.get(day, zero)[1] - before.get(day, zero)[1]
+        if delta_sum == 0 and delta_count == 0:
+            continue
+
+        row = db.session.get(DailyBalance, day)
+        if row is None:
+            row = DailyBalance(
+                date=day,
+                total=decimal.Decimal('0.00'),
+                count=0,
+                running_total=running_total_before(day),
+            )
+            db.session.add(row)
+            db.session.flush()
+
+        row.total = to_decimal(row.total) + delta_sum
+        row.count = row.count + delta_count
+        if delta_sum != 0:
+            # Shift this day and every later day; one set-based UPDATE
+            db.session.execute(
+                update(DailyBalance)
+                .where(DailyBalance.date >= day)
+                .values(running_total=DailyBalance.running_total + delta_sum)
+                .execution_options(synchronize_session='fetch')
+            )
+        if row.count <= 0:
+            db.session.delete(row)
+    db.session.flush()
+
+
+def rebuild_daily_balances(start_date=None):
+    """
+    Recomputes the DailyBalance rows from `start_date` on (the whole table if
+    None) from the transaction table. Used by the CLI and by bulk write paths,
+    where re-aggregating the affected range beats per-family deltas.
+    Returns the number of rows written.
+    """
+    db.session.flush()
+    base_running_total = running_total_before(start_date) if start_date is not None else decimal.Decimal('0.00')
+
+    contributions = ledger_contributions()
+    sums_query = select(contributions.c.date, func.sum(contributions.c.amount)).group_by(contributions.c.date)
+    counts_query = select(Transaction.date, func.count(Transaction.id)).group_by(Transaction.date)
+    clear_query = delete(DailyBalance)
+    if start_date is not None:
+        sums_query = sums_query.where(contributions.c.date >= start_date)
+        counts_query = counts_query.where(Transaction.date >= start_date)
+        clear_query = clear_query.where(DailyBalance.date >= start_date)
+
+    sums = {row[0]: to_decimal(row[1]) for row in db.session.execute(sums_query)}
+    counts = {row[0]: row[1] for row in db.session.execute(counts_query)}
+
+    rows = []
+    running_total = base_running_total
+    for day in sorted(counts):
+        running_total += sums.get(day, decimal.Decimal('0.00'))
+        rows.append({
+            'date': day,
+            'total': sums.get(day, decimal.Decimal('0.00')),
+            'count': counts[day],
+            'running_total': running_total,
+        })
+
+    db.session.execute(clear_query.execution_options(synchronize_session=False))
+    if rows:
+        db.session.execute(insert(DailyBalance), rows)
+    db.session.expire_all()
+    return len(rows)
+
+
+def verify_daily_balances():
+    """
+    Compares the DailyBalance table with a fresh aggregation of the ledger.
+    Returns a list of {date, expected, actual} mismatches (empty if consistent).
+    """
+    contributions = ledger_contributions()
+    sums = {
+        row[0]: to_decimal(row[1])
+        for row in db.session.execute(select(contributions.c.date, func.sum(contributions.c.amount)).group_by(contributions.c.date))
+    }
+    counts = {
+        row[0]: row[1]
+        for row in db.session.execute(select(Transaction.date, func.count(Transaction.id)).group_by(Transaction.date))
+    }
+    stored = {row.date: row for row in DailyBalance.query.order_by(DailyBalance.date.asc()).all()}
+
+    mismatches = []
+    running_total = decimal.Decimal('0.00')
+    for day in sorted(set(counts) | set(stored)):
+        expected = None
+        if day in counts:
+            running_total += sums.get(day, decimal.Decimal('0.00'))
+            expected = {
+                'total': str(sums.get(day, decimal.Decimal('0.00'))),
+                'count': counts[day],
+                'running_total': str(running_total),
+            }
+        actual = None
+        if day in stored:
+            row = stored[day]
+            actual = {
+                'total': str(to_decimal(row.total)),
+                'count': row.count,
+                'running_total': str(to_decimal(row.running_total)),
+            }
+        if expected != actual:
+            mismatches.append({'date': day.isoformat(), 'expected': expected, 'actual': actual})
+    return mismatches
+
+
+def ensure_daily_balances():
+    """Builds the DailyBalance table on first start of a database that predates it."""
+    has_transactions = db.session.execute(select(Transaction.id).limit(1)).first() is not None
+    has_balances = db.session.execute(select(DailyBalance.date).limit(1)).first() is not None
+    if has_transactions and not has_balances:
+        rebuild_daily_balances()
+        db.session.commit()
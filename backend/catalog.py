@@ -0,0 +1,66 @@
+# File path: backend/catalog.py
+
+from app import app, db
+from models import Counter
+from flask import request, Response
+from sqlalchemy import select
+import threading
+import time
+
+
+# In-process cache of the tag catalog (tag groups and tags).
+#
+# The catalog changes rarely but is fetched often, so its serialized JSON is
+# kept in memory, keyed by the catalog version. The version lives in the
+# database (the 'catalog' Counter row): every route that creates or deletes
+# tags or tag groups (and restores) calls bump_catalog_version() before
+# committing, so the new version is committed with the change and every
+# process sees both at once. Each request reads the version with one primary
+# key lookup, the way rules.get_matcher() checks rules_fingerprint().
+#
+# Responses carry the version as their ETag with 'no-cache', so browsers
+# revalidate every time and usually get a 304 that costs neither a catalog
+# query nor JSON encoding.
+
+
+CATALOG_COUNTER = 'catalog'
+
+catalog_cache = {'version': None, 'bodies': {}}
+catalog_lock = threading.Lock()
+
+
+def catalog_version():
+    """The committed catalog version (0 before the first catalog change)."""
+    return db.session.execute(select(Counter.value).where(Counter.name == CATALOG_COUNTER)).scalar() or 0
+
+
+def bump_catalog_version():
+    """Moves the catalog version on in the current transaction. Call before committing a catalog change."""
+    # A schema from create_all() has no row yet: start from the clock, as the migration does
+    Counter.bump(CATALOG_COUNTER, start=time.time_ns() // 1000)
+
+
+def catalog_response(key, build):
+    """
+    A JSON response for one view of the catalog: 304 if the client has the
+    current version, else the cached body, built with `build()` on a miss.
+    """
+    version = catalog_version()
+    etag = f'catalog-{version}'
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        with catalog_lock:
+            if catalog_cache['version'] != version:
+                catalog_cache.update(version=version, bodies={})
+            body = catalog_cache['bodies'].get(key)
+        if body is None:
+            # Read after the version: a change committed meanwhile is ahead of it, never behind
+            body = app.json.dumps(build()).encode()
+            with catalog_lock:
+                if catalog_cache['version'] == version:
+                    catalog_cache['bodies'][key] = body
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
@@ -0,0 +1,323 @@
+# File path: backend/commands.py
+# Maintenance commands, run with the Flask CLI from the backend folder:
+#   flask --app app daily-balances rebuild
+#   flask --app app daily-balances verify
+#   flask --app app backup create --output full.zip
+#   flask --app app backup create --base latest --output incremental.zip
+#   flask --app app backup merge full.zip incremental.zip --output merged.zip
+#   flask --app app backup restore full.zip [incremental.zip ...] [--replace]
+#   flask --app app documents migrate-layout
+#   flask --app app documents evict-previews
+#   flask --app app search rebuild
+#   flask --app app rules apply [--from-date 2024-01-01] [--to-date 2024-12-31] [--dry-run]
+#   flask --app app database settings
+#   flask --app app database benchmark [--rows 100000] [--readers 4] [--compare]
+
+from app import app, db
+from models import Backup, Transaction
+from balances import rebuild_daily_balances, verify_daily_balances
+from backup import iter_backup_archive, iter_merged_archive
+from restore import restore_backup, DEFAULT_EXTRACT_WORKERS
+from previews import evict_previews
+from search import rebuild_search_index, search_index_enabled
+from rules import apply_rules
+from database import sqlite_pragmas, engine_options, install_sqlite_pragmas, current_sqlite_settings
+from storage import migrate_layout, layout_migration_remaining, LAYOUT_BATCH_SIZE, LAYOUT_GRACE_SECONDS
+from sqlalchemy import create_engine, insert, select, func
+from sqlalchemy.exc import OperationalError
+from datetime import date, timedelta
+import click
+import contextlib
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+
+
+@app.cli.group('daily-balances')
+def daily_balances_cli():
+    """Maintain the materialized daily balance table."""
+
+
+@daily_balances_cli.command('rebuild')
+@click.option('--from-date', 'from_date', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help="Only recompute days from this date on (YYYY-MM-DD).")
+def rebuild_daily_balances_command(from_date):
+    """Recomputes the daily balance table from the transactions."""
+    start_date = from_date.date() if from_date else None
+    written = rebuild_daily_balances(start_date)
+    db.session.commit()
+    click.echo(f"Rebuilt {written} daily balance row(s).")
+
+
+@daily_balances_cli.command('verify')
+def verify_daily_balances_command():
+    """Checks the daily balance table against the transactions."""
+    mismatches = verify_daily_balances()
+    if not mismatches:
+        click.echo("Daily balances are consistent.")
+        return
+    for mismatch in mismatches:
+        click.echo(f"{mismatch['date']}: expected {mismatch['expected']}, found {mismatch['actual']}")
+    raise click.ClickException(f"{len(mismatches)} daily balance row(s) out of date. Run 'flask daily-balances rebuild'.")
+
+
+
+@app.cli.group('backup')
+def backup_cli():
+    """Create and combine backup archives."""
+
+
+@backup_cli.command('create')
+@click.option('--output', '-o', required=True, type=click.Path(dir_okay=False, writable=True),
+              help="Where to write the ZIP archive.")
+@click.option('--base', default=None,
+              help="Take an incremental backup against this backup id ('latest' for the newest one).")
+@click.option('--deflate-all', is_flag=True, help="Also deflate already-compressed documents.")
+def create_backup_command(output, base, deflate_all):
+    """Writes a full or incremental backup archive."""
+    base_backup = None
+    if base == 'latest':
+        base_backup = Backup.query.order_by(Backup.created_at.desc()).first()
+    elif base:
+        base_backup = db.session.get(Backup, base)
+    if base and base_backup is None:
+        raise click.ClickException("Base backup not found. Take a full backup first.")
+
+    with open(output, 'wb') as archive:
+        for data in iter_backup_archive(store_compressed=not deflate_all, base=base_backup):
+            archive.write(data)
+    latest = Backup.query.order_by(Backup.created_at.desc()).first()
+    click.echo(f"Wrote {latest.kind} backup {latest.id} to {output}.")
+
+
+@backup_cli.command('merge')
+@click.argument('archives', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--output', '-o', required=True, type=click.Path(dir_okay=False, writable=True),
+              help="Where to write the merged full archive.")
+def merge_backups_command(archives, output):
+    """Replays a full backup and its incrementals into one full archive."""
+    with contextlib.ExitStack() as stack:
+        zip_archives = [stack.enter_context(zipfile.ZipFile(path)) for path in archives]
+        try:
+            pieces = iter_merged_archive(zip_archives)
+            with open(output, 'wb') as archive:
+                for data in pieces:
+                    archive.write(data)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    click.echo(f"Merged {len(archives)} archive(s) into {output}.")
+
+
+@backup_cli.command('restore')
+@click.argument('archives', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--replace', is_flag=True, help="Overwrite a database that already has data.")
+@click.option('--workers', default=DEFAULT_EXTRACT_WORKERS, show_default=True,
+              help="Threads extracting document files.")
+def restore_backup_command(archives, replace, workers):
+    """Loads a full backup (and its incrementals) into the database."""
+    with contextlib.ExitStack() as stack:
+        zip_archives = [stack.enter_context(zipfile.ZipFile(path)) for path in archives]
+        try:
+            report = restore_backup(zip_archives, app.config['UPLOAD_FOLDER'], replace=replace, workers=workers)
+        except ValueError as e:
+            db.session.rollback()
+            raise click.ClickException(str(e))
+    click.echo(
+        f"Restored {report['transactions']} transaction(s), {report['tags']} tag(s), "
+        f"{report['tag_groups']} tag group(s) and {report['documents']} document(s) "
+        f"in {report['seconds']}s ({report['transactions_per_second']} transactions/s)."
+    )
+    if report['missing_documents']:
+        click.echo(f"Missing document files for ids: {report['missing_documents']}")
+
+
+
+@app.cli.group('documents')
+def documents_cli():
+    """Maintain the stored document files."""
+
+
+@documents_cli.command('migrate-layout')
+@click.option('--batch-size', default=LAYOUT_BATCH_SIZE, show_default=True,
+              help="Files moved per committed batch.")
+@click.option('--grace-seconds', default=LAYOUT_GRACE_SECONDS, show_default=True,
+              help="How long old paths stay after the last batch.")
+def migrate_layout_command(batch_size, grace_seconds):
+    """Moves flat document files into the fan-out layout (resumable, safe while the app runs)."""
+    click.echo(f"{layout_migration_remaining()} file(s) to migrate.")
+    totals = migrate_layout(
+        batch_size, grace_seconds,
+        progress=lambda totals: click.echo(f"  {totals['blobs']} blob(s) moved, {totals['documents']} document(s) converted"),
+    )
+    click.echo(
+        f"Moved {totals['blobs']} blob(s) and converted {totals['documents']} document(s) to content-addressed storage."
+    )
+    if totals['missing']:
+        click.echo(f"{totals['missing']} file(s) were missing on disk; see the log.")
+
+
+@documents_cli.command('evict-previews')
+@click.option('--max-mb', type=int, default=None, help="Cache budget in MB (default PREVIEW_CACHE_BYTES).")
+def evict_previews_command(max_mb):
+    """Removes stale and least recently served document previews."""
+    removed, kept = evict_previews(max_mb * 1024 * 1024 if max_mb is not None else None)
+    click.echo(f"Removed {removed} preview(s); {kept // 1024} KB kept.")
+
+
+
+@app.cli.group('search')
+def search_cli():
+    """Maintain the full-text search index."""
+
+
+@search_cli.command('rebuild')
+def rebuild_search_index_command():
+    """Re-creates the search index from the transactions and documents."""
+    if not search_index_enabled():
+        raise click.ClickException("This database has no full-text index (SQLite with FTS5 only); search uses substring matching.")
+    indexed = rebuild_search_index()
+    db.session.commit()
+    click.echo(f"Indexed {indexed} transaction(s).")
+
+
+
+@app.cli.group('rules')
+def rules_cli():
+    """Run the categorization rules."""
+
+
+@rules_cli.command('apply')
+@click.option('--from-date', 'from_date', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help="Only transactions dated on or after this day (YYYY-MM-DD).")
+@click.option('--to-date', 'to_date', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help="Only transactions dated on or before this day (YYYY-MM-DD).")
+@click.option('--dry-run', is_flag=True, help="Report what would be tagged without writing.")
+def apply_rules_command(from_date, to_date, dry_run):
+    """Adds the tags the rules assign to existing transactions."""
+    report = apply_rules(from_date.date() if from_date else None, to_date.date() if to_date else None, dry_run=dry_run)
+    if dry_run:
+        db.session.rollback()
+    else:
+        db.session.commit()
+    verb = "Would add" if dry_run else "Added"
+    click.echo(f"Scanned {report['transactions']} transaction(s). {verb} {report['links']} tag(s) to {report['tagged']} transaction(s).")
+
+
+
+@app.cli.group('database')
+def database_cli():
+    """Inspect and benchmark the database engine settings."""
+
+
+@database_cli.command('settings')
+def database_settings_command():
+    """Shows the engine options and, on SQLite, the PRAGMAs in effect."""
+    click.echo(f"Engine options: {app.config['SQLALCHEMY_ENGINE_OPTIONS']}")
+    if db.engine.dialect.name == 'sqlite':
+        with db.engine.connect() as connection:
+            for name, value in current_sqlite_settings(connection).items():
+                click.echo(f"PRAGMA {name} = {value}")
+
+
+@database_cli.command('benchmark')
+@click.option('--rows', default=100000, show_default=True, help="Transactions written by the import.")
+@click.option('--chunk-size', default=2000, show_default=True, help="Rows per import commit.")
+@click.option('--readers', default=4, show_default=True, help="Threads reading while the import runs.")
+@click.option('--compare', is_flag=True, help="Also run with SQLite's default settings, for comparison.")
+def database_benchmark_command(rows, chunk_size, readers, compare):
+    """
+    Measures read throughput during a concurrent bulk import, on a scratch
+    SQLite database with the configured settings (the app database is not touched).
+    """
+    runs = [('configured', sqlite_pragmas())]
+    if compare:
+        runs.append(('sqlite defaults', []))
+    for label, pragmas in runs:
+        result = run_import_read_benchmark(pragmas, rows, chunk_size, readers)
+        click.echo(
+            f"{label}: import {result['rows_per_second']:.0f} rows/s | "
+            f"reads {result['reads_per_second']:.0f}/s (p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms) | "
+            f"{result['errors']} error(s)"
+        )
+
+
+def run_import_read_benchmark(pragmas, rows, chunk_size, readers, seed_rows=20000):
+    """
+    Imports `rows` transactions in chunks on one thread while `readers` threads
+    page through the ledger and sum a month, on a scratch database.
+    """
+    scratch_dir = tempfile.mkdtemp(prefix='db_benchmark_')
+    uri = 'sqlite:///' + os.path.join(scratch_dir, 'benchmark.db')
+    options = engine_options(uri) if pragmas else {}
+    engine = create_engine(uri, **options)
+    install_sqlite_pragmas(engine, pragmas)
+    try:
+        db.metadata.create_all(engine)
+        randomizer = random.Random(0)
+        make_rows = lambda count: [{
+            'date': date(2020, 1, 1) + timedelta(days=randomizer.randrange(2000)),
+            'amount': randomizer.randrange(-100000, 100000) / 100,
+            'description': f"benchmark row {randomizer.randrange(10 ** 6)}",
+            'children_flag': False, 'doc_flag': False,
+        } for _ in range(count)]
+        with engine.begin() as connection:
+            connection.execute(insert(Transaction), make_rows(seed_rows))
+
+        done = threading.Event()
+        latencies, errors, lock = [], [0], threading.Lock()
+        page = select(Transaction.id, Transaction.date, Transaction.amount, Transaction.description) \
+            .order_by(Transaction.date.desc(), Transaction.id.desc()).limit(50)
+        month = select(func.count(), func.sum(Transaction.amount)) \
+            .where(Transaction.date.between(date(2022, 1, 1), date(2022, 1, 31)))
+
+        def read():
+            while not done.is_set():
+                started = time.perf_counter()
+                try:
+                    with engine.connect() as connection:
+                        connection.execute(page).all()
+                        connection.execute(month).one()
+                except OperationalError:
+                    with lock:
+                        errors[0] += 1
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+
+        threads = [threading.Thread(target=read) for _ in range(readers)]
+        for thread in threads:
+            thread.start()
+        started = time.perf_counter()
+        try:
+            for start in range(0, rows, chunk_size):
+                chunk = make_rows(min(chunk_size, rows - start))
+                while True:
+                    try:
+                        with engine.begin() as connection:
+                            connection.execute(insert(Transaction), chunk)
+                        break
+                    except OperationalError: # Locked out by readers; counted and retried
+                        with lock:
+                            errors[0] += 1
+        finally:
+            elapsed = time.perf_counter() - started
+            done.set()
+            for thread in threads:
+                thread.join()
+
+        latencies.sort()
+        percentile = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+        return {
+            'rows_per_second': rows / elapsed,
+            'reads_per_second': len(latencies) / elapsed,
+            'p50_ms': percentile(0.5),
+            'p95_ms': percentile(0.95),
+            'errors': errors[0],
+        }
+    finally:
+        engine.dispose()
+        shutil.rmtree(scratch_dir, ignore_errors=True)
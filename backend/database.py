@@ -0,0 +1,95 @@
+# File path: backend/database.py
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+import os
+
+
+# Database engine settings, read from the environment.
+#
+# SQLite connections are tuned as soon as they are opened:
+#   journal_mode=WAL       readers no longer block behind a writer (and vice versa)
+#   synchronous=NORMAL     safe with WAL; a commit no longer waits for an fsync
+#   cache_size, mmap_size  more of the database served from memory
+#   busy_timeout           a writer waits for the lock instead of failing at once
+#                          with "database is locked"
+#   foreign_keys=ON        ON DELETE rules of the schema are enforced
+# Every setting can be overridden with the SQLITE_* variable named below.
+#
+# Pool settings (DB_POOL_*) apply to every backend. Server databases also
+# get pre-ping and recycling, so connections dropped by the server are
+# replaced instead of failing a request.
+
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def sqlite_pragmas():
+    """The PRAGMAs run on every new SQLite connection, in order."""
+    return [
+        ('journal_mode', os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')),
+        ('synchronous', os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')),
+        ('cache_size', -env_int('SQLITE_CACHE_SIZE_KB', 64 * 1024)), # Negative: KiB instead of pages
+        ('mmap_size', env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        ('busy_timeout', env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+        ('temp_store', os.environ.get('SQLITE_TEMP_STORE', 'MEMORY')),
+        ('foreign_keys', 'ON'),
+    ]
+
+
+def is_sqlite(database_uri):
+    return make_url(database_uri).get_backend_name() == 'sqlite'
+
+
+def engine_options(database_uri):
+    """SQLALCHEMY_ENGINE_OPTIONS for a database URI."""
+    options = {
+        'pool_size': env_int('DB_POOL_SIZE', 5),
+        'max_overflow': env_int('DB_POOL_MAX_OVERFLOW', 10),
+        'pool_timeout': env_int('DB_POOL_TIMEOUT', 30),
+    }
+    if is_sqlite(database_uri):
+        if make_url(database_uri).database in (None, '', ':memory:'):
+            return {} # In-memory databases live in a single connection; keep SQLAlchemy's default pool
+        # The driver-level timeout is the same busy wait, applied while connecting
+        options['connect_args'] = {'timeout': env_int('SQLITE_BUSY_TIMEOUT_MS', 5000) / 1000}
+    else:
+        options['pool_pre_ping'] = True
+        options['pool_recycle'] = env_int('DB_POOL_RECYCLE', 1800)
+    return options
+
+
+def install_sqlite_pragmas(engine, pragmas=None):
+    """Runs `pragmas` (sqlite_pragmas() by default) on every connection the engine opens."""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas() if pragmas is None else pragmas
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas:
+                cursor.execute(f'PRAGMA {name} = {value}')
+        finally:
+            cursor.close()
+
+
+def current_sqlite_settings(connection):
+    """The values SQLite reports for the tuned PRAGMAs on a connection."""
+    return {name: connection.exec_driver_sql(f'PRAGMA {name}').scalar() for name, _ in sqlite_pragmas()}
+
+
+def begin_snapshot(session):
+    """
+    Starts a transaction on `session` whose reads all see one snapshot of the
+    database until it ends: REPEATABLE READ on server databases, an explicit
+    BEGIN on SQLite (whose driver only opens transactions for writes). Call
+    with no transaction in progress, and end it before writing.
+    """
+    if session.get_bind().dialect.name == 'sqlite':
+        session.connection().exec_driver_sql('BEGIN')
+    else:
+        session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
@@ -0,0 +1,221 @@
+# File path: backend/filters.py
+
+from flask import abort
+from models import Transaction, Tag, transaction_tags
+from datetime import datetime
+from sqlalchemy import and_, or_
+import base64
+import decimal
+import json
+
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+TRUE_VALUES = {'1', 'true', 'yes', 'on'}
+FALSE_VALUES = {'0', 'false', 'no', 'off'}
+
+
+
+# --- Query Argument Parsing ---
+
+
+
+def parse_date_arg(value, name):
+    """Parses a YYYY-MM-DD query argument, aborting with 400 on bad input."""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (ValueError, TypeError):
+        abort(400, description=f"Invalid '{name}' format. Use YYYY-MM-DD.")
+
+
+def parse_amount_arg(value, name):
+    """Parses a decimal query argument, accepting ',' as decimal separator. NaN and infinities are refused."""
+    try:
+        amount_str = str(value)
+        if ',' in amount_str:
+            amount_str = amount_str.replace(',', '.')
+        amount = decimal.Decimal(amount_str)
+    except (decimal.InvalidOperation, TypeError, ValueError):
+        abort(400, description=f"Invalid '{name}' format. Expected a number.")
+    if not amount.is_finite():
+        abort(400, description=f"Invalid '{name}' format. Expected a finite number.")
+    return amount
+
+
+def parse_bool_arg(value, name):
+    """Parses a boolean query argument (true/false, 1/0, yes/no, on/off)."""
+    lowered = str(value).strip().lower()
+    if lowered in TRUE_VALUES:
+        return True
+    if lowered in FALSE_VALUES:
+        return False
+    abort(400, description=f"'{name}' must be a boolean (true/false).")
+
+
+def parse_id_list_arg(values, name):
+    """
+    Parses a list of integer ids. Accepts repeated arguments (?tag_ids=1&tag_ids=2)
+    as well as comma-separated values (?tag_ids=1,2).
+    """
+    ids = []
+    for value in values:
+        for part in str(value).split(','):
+            part = part.strip()
+            if not part:
+                continue
+            try:
+                ids.append(int(part))
+            except ValueError:
+                abort(400, description=f"Invalid id '{part}' in '{name}'.")
+    return ids
+
+
+def parse_id_arg(value, name):
+    """Parses a single integer id argument, aborting with 400 unless there is exactly one."""
+    ids = parse_id_list_arg([value], name)
+    if len(ids) != 1:
+        abort(400, description=f"'{name}' must be a single id.")
+    return ids[0]
+
+
+
+# --- Transaction Filters ---
+
+
+
+def apply_transaction_filters(query, args):
+    """
+    Applies the server-side transaction filters found in `args` (a werkzeug
+    MultiDict, usually request.args) to a Transaction query.
+
+    Supported filters:
+        start_date, end_date      inclusive date range (YYYY-MM-DD)
+        tag_ids                   transactions tagged with any of these tags
+        tag_group_id              transactions with at least one tag of this group
+        min_amount, max_amount    inclusive amount range
+        description               case-insensitive substring of the description
+        has_documents             true/false
+        is_parent                 true/false (transactions that were split)
+        is_child                  true/false (sub-items of a split transaction)
+        parent_id                 children of one specific parent
+    """
+    if args.get('start_date'):
+        query = query.filter(Transaction.date >= parse_date_arg(args['start_date'], 'start_date'))
+    if args.get('end_date'):
+        query = query.filter(Transaction.date <= parse_date_arg(args['end_date'], 'end_date'))
+
+    tag_ids = parse_id_list_arg(args.getlist('tag_ids'), 'tag_ids')
+    if tag_ids:
+        query = query.filter(
+            Transaction.id.in_(
+                transaction_tags.select()
+                .with_only_columns(transaction_tags.c.transaction_id)
+                .where(transaction_tags.c.tag_id.in_(tag_ids))
+            )
+        )
+
+    if args.get('tag_group_id'):
+        tag_group_id = parse_id_arg(args['tag_group_id'], 'tag_group_id')
+        query = query.filter(
+            Transaction.id.in_(
+                transaction_tags.select()
+                .with_only_columns(transaction_tags.c.transaction_id)
+                .join(Tag, Tag.id == transaction_tags.c.tag_id)
+                .where(Tag.tag_group_id == tag_group_id)
+            )
+        )
+
+    if args.get('min_amount'):
+        query = query.filter(Transaction.amount >= parse_amount_arg(args['min_amount'], 'min_amount'))
+    if args.get('max_amount'):
+        query = query.filter(Transaction.amount <= parse_amount_arg(args['max_amount'], 'max_amount'))
+
+    if args.get('description'):
+        query = query.filter(Transaction.description.ilike(f"%{args['description']}%"))
+
+    if args.get('has_documents'):
+        has_documents = Transaction.documents.any()
+        if parse_bool_arg(args['has_documents'], 'has_documents'):
+            query = query.filter(has_documents)
+        else:
+            query = query.filter(~has_documents)
+
+    if args.get('is_parent'):
+        query = query.filter(Transaction.children_flag.is_(parse_bool_arg(args['is_parent'], 'is_parent')))
+
+    if args.get('is_child'):
+        if parse_bool_arg(args['is_child'], 'is_child'):
+            query = query.filter(Transaction.parent_id.isnot(None))
+        else:
+            query = query.filter(Transaction.parent_id.is_(None))
+
+    if args.get('parent_id'):
+        parent_id = parse_id_arg(args['parent_id'], 'parent_id')
+        query = query.filter(Transaction.parent_id == parent_id)
+
+    return query
+
+
+
+# --- Keyset (date, id) Pagination ---
+
+
+
+def parse_page_size(value):
+    """Parses the 'limit' query argument, clamped to MAX_PAGE_SIZE."""
+    if value is None or value == '':
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except (ValueError, TypeError):
+        abort(400, description="'limit' must be a valid integer.")
+    if limit <= 0:
+        abort(400, description="'limit' must be a positive integer.")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def parse_sort_order(value):
+    """Parses the 'order' query argument ('asc' or 'desc', default 'desc')."""
+    order = (value or 'desc').lower()
+    if order not in ('asc', 'desc'):
+        abort(400, description="'order' must be 'asc' or 'desc'.")
+    return order
+
+
+def encode_cursor(date_str, tx_id):
+    """Builds an opaque cursor pointing just after the (date, id) row given."""
+    raw = json.dumps([date_str, tx_id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor produced by encode_cursor into a (date, id) tuple."""
+    try:
+        date_str, tx_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.strptime(date_str, '%Y-%m-%d').date(), int(tx_id)
+    except (ValueError, TypeError, UnicodeError, json.JSONDecodeError):
+        abort(400, description="Invalid 'cursor'.")
+
+
+def apply_keyset_order(query, order, cursor=None):
+    """
+    Orders a Transaction query by (date, id) in the given direction and, if a
+    cursor is given, restricts it to the rows that come after the cursor.
+    """
+    if cursor:
+        cursor_date, cursor_id = decode_cursor(cursor)
+        if order == 'asc':
+            query = query.filter(or_(
+                Transaction.date > cursor_date,
+                and_(Transaction.date == cursor_date, Transaction.id > cursor_id)
+            ))
+        else:
+            query = query.filter(or_(
+                Transaction.date < cursor_date,
+                and_(Transaction.date == cursor_date, Transaction.id < cursor_id)
+            ))
+
+    if order == 'asc':
+        return query.order_by(Transaction.date.asc(), Transaction.id.asc())
+    return query.order_by(Transaction.date.desc(), Transaction.id.desc())
@@ -0,0 +1,473 @@
+# File path: backend/importing.py
+
+from app import db
+from models import Transaction, Tag, ImportKey, transaction_tags
+from balances import apply_contribution_deltas, CENTS
+from search import reindex_transactions
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, delete, func, and_, Column, Integer, Date, Numeric, MetaData, Table
+import decimal
+import itertools
+import re
+import unicodedata
+
+
+MAX_DATE_WINDOW_DAYS = 31
+MAX_BULK_ROWS = 20000
+MAX_IDEMPOTENCY_KEY_LENGTH = 128
+LOOKUP_CHUNK_SIZE = 500
+IMPORT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+AMOUNT_TYPE = Transaction.__table__.c.amount.type
+MAX_AMOUNT = decimal.Decimal(10) ** (AMOUNT_TYPE.precision - AMOUNT_TYPE.scale) # Numeric(10, 2): below 10^8
+
+
+
+# --- Row Parsing ---
+
+
+
+def parse_amount(value):
+    """
+    Parses an amount the way every transaction route does: str() it, accept a
+    ',' decimal separator, and build a Decimal rounded to the cent. Raises
+    ValueError when invalid, not finite or too large for Transaction.amount.
+    """
+    if value is None:
+        raise ValueError("Missing amount.")
+    amount_str = str(value).strip()
+    if ',' in amount_str:
+        amount_str = amount_str.replace(',', '.')
+    try:
+        amount = decimal.Decimal(amount_str)
+    except (decimal.InvalidOperation, TypeError, ValueError):
+        raise ValueError("Invalid amount format.")
+    if not amount.is_finite():
+        raise ValueError("Invalid amount format. Expected a finite number.")
+    if abs(amount) >= MAX_AMOUNT:
+        raise ValueError(f"Amount out of range: it must be less than {MAX_AMOUNT} in absolute value.")
+    amount = amount.quantize(CENTS, rounding=decimal.ROUND_HALF_UP)
+    if abs(amount) >= MAX_AMOUNT: # Rounded up to the limit
+        raise ValueError(f"Amount out of range: it must be less than {MAX_AMOUNT} in absolute value.")
+    return amount
+
+
+def parse_date(value):
+    """Parses a YYYY-MM-DD date. Raises ValueError when invalid."""
+    if not value:
+        raise ValueError("Missing date.")
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (ValueError, TypeError):
+        raise ValueError("Invalid date format. Use YYYY-MM-DD.")
+
+
+def row_value(row, key):
+    """Reads `key` from an incoming row, accepting 'Date' as well as 'date'."""
+    if key in row:
+        return row[key]
+    return row.get(key.capitalize())
+
+
+def parse_statement_rows(rows):
+    """
+    Validates a whole batch of incoming rows before anything touches the DB.
+    Returns a list of (index, parsed, error): `parsed` is a dict with date,
+    amount and description, or None when the row is invalid and `error` says why.
+    """
+    parsed_rows = []
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            parsed_rows.append((index, None, "Row must be an object."))
+            continue
+        try:
+            parsed = {
+                'date': parse_date(row_value(row, 'date')),
+                'amount': parse_amount(row_value(row, 'amount')),
+                'description': row_value(row, 'description'),
+            }
+            if parsed['description'] is not None and not isinstance(parsed['description'], str):
+                parsed['description'] = str(parsed['description'])
+        except ValueError as e:
+            parsed_rows.append((index, None, str(e)))
+            continue
+        parsed_rows.append((index, parsed, None))
+    return parsed_rows
+
+
+def normalize_description(description):
+    """
+    Fuzzy duplicate key for descriptions: case-folded, accents stripped and every
+    run of non-alphanumeric characters collapsed to a single space, so
+    'PIX  Transf. João' and 'pix transf joao' compare equal.
+    """
+    if description is None:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', description)
+    without_accents = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return re.sub(r'[\W_]+', ' ', without_accents.casefold()).strip()
+
+
+
+# --- Duplicate Detection ---
+
+
+
+def find_duplicates(parsed_rows, normalize=False, date_window_days=0, max_transaction_id=None):
+    """
+    Resolves which incoming rows already exist in the ledger with one join.
+
+    The candidate keys (amount plus a date range widened by `date_window_days`)
+    are loaded into a temporary table and joined against `transaction`, which the
+    (amount, date, description) index serves. Descriptions are then compared in
+    Python, exactly or normalized. When several transactions match a row, the
+    one closest in date (then lowest id) wins.
+
+    `parsed_rows` are (index, parsed, error) tuples from parse_statement_rows().
+    With `max_transaction_id` only transactions up to that id are considered.
+    Returns {index: matched_transaction_id} for the rows that are duplicates.
+    """
+    valid_rows = [(index, parsed) for index, parsed, error in parsed_rows if parsed is not None]
+    if not valid_rows:
+        return {}
+
+    window = timedelta(days=date_window_days)
+    incoming = Table(
+        'duplicate_check_incoming', MetaData(),
+        Column('idx', Integer, primary_key=True),
+        Column('amount', Numeric(precision=10, scale=2), nullable=False),
+        Column('date_from', Date, nullable=False),
+        Column('date_to', Date, nullable=False),
+        prefixes=['TEMPORARY'],
+    )
+
+    connection = db.session.connection()
+    incoming.create(connection, checkfirst=True)
+    try:
+        connection.execute(incoming.insert(), [
+            {
+                'idx': index,
+                'amount': parsed['amount'],
+                'date_from': parsed['date'] - window,
+                'date_to': parsed['date'] + window,
+            }
+            for index, parsed in valid_rows
+        ])
+        candidates_query = (
+            select(incoming.c.idx, Transaction.id, Transaction.date, Transaction.description)
+            .join(Transaction, and_(
+                Transaction.amount == incoming.c.amount,
+                Transaction.date >= incoming.c.date_from,
+                Transaction.date <= incoming.c.date_to,
+            ))
+        )
+        if max_transaction_id is not None:
+            candidates_query = candidates_query.where(Transaction.id <= max_transaction_id)
+        candidates = connection.execute(candidates_query).all()
+    finally:
+        incoming.drop(connection, checkfirst=True)
+
+    by_index = dict(valid_rows)
+    if normalize:
+        wanted = {index: normalize_description(parsed['description']) for index, parsed in valid_rows}
+    else:
+        wanted = {index: parsed['description'] for index, parsed in valid_rows}
+
+    matches = {}
+    for index, tx_id, tx_date, tx_description in candidates:
+        existing = normalize_description(tx_description) if normalize else tx_description
+        if existing != wanted[index]:
+            continue
+        rank = (abs((tx_date - by_index[index]['date']).days), tx_id)
+        if index not in matches or rank < matches[index][0]:
+            matches[index] = (rank, tx_id)
+
+    return {index: tx_id for index, (_, tx_id) in matches.items()}
+
+
+
+# --- Bulk Creation ---
+
+
+
+def chunked(items, size):
+    """Yields consecutive slices of `items` with at most `size` elements."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def parse_bulk_extras(row, parsed):
+    """Adds the note, tag_ids and idempotency_key of a bulk row to `parsed`. Raises ValueError."""
+    note = row_value(row, 'note')
+    parsed['note'] = '' if note is None else str(note)
+
+    tag_ids = row.get('tag_ids') or []
+    if not isinstance(tag_ids, list):
+        raise ValueError("'tag_ids' must be a list.")
+    try:
+        parsed['tag_ids'] = list(dict.fromkeys(int(tid) for tid in tag_ids if tid is not None))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid tag_id format in tag_ids list.")
+
+    key = row.get('idempotency_key')
+    if key is not None:
+        key = str(key)
+        if not key or len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+            raise ValueError(f"'idempotency_key' must be 1 to {MAX_IDEMPOTENCY_KEY_LENGTH} characters.")
+    parsed['idempotency_key'] = key
+
+
+def validate_bulk_rows(rows):
+    """
+    Validates a bulk-create batch in one pass: dates, amounts, notes, tag ids
+    (one query for the whole batch) and idempotency keys.
+    Returns a list of (index, parsed, error) like parse_statement_rows().
+    """
+    validated = []
+    for index, parsed, error in parse_statement_rows(rows):
+        if parsed is not None:
+            try:
+                parse_bulk_extras(rows[index], parsed)
+            except ValueError as e:
+                parsed, error = None, str(e)
+        validated.append((index, parsed, error))
+
+    # Tag ids: one lookup for the whole batch
+    wanted_tag_ids = {tid for _, parsed, _ in validated if parsed for tid in parsed['tag_ids']}
+    found_tag_ids = set()
+    for tag_chunk in chunked(sorted(wanted_tag_ids), LOOKUP_CHUNK_SIZE):
+        found_tag_ids.update(db.session.execute(select(Tag.id).where(Tag.id.in_(tag_chunk))).scalars())
+
+    # Idempotency keys must be unique within the batch
+    seen_keys = set()
+    checked = []
+    for index, parsed, error in validated:
+        if parsed is not None:
+            missing = [tid for tid in parsed['tag_ids'] if tid not in found_tag_ids]
+            if missing:
+                parsed, error = None, f"One or more tag IDs not found: {missing}"
+            elif parsed['idempotency_key'] is not None:
+                if parsed['idempotency_key'] in seen_keys:
+                    parsed, error = None, "Duplicate 'idempotency_key' in batch."
+                else:
+                    seen_keys.add(parsed['idempotency_key'])
+        checked.append((index, parsed, error))
+    return checked
+
+
+def existing_import_keys(keys):
+    """
+    Returns {key: transaction_id} for keys that were already imported. Keys left
+    behind by deleted transactions (possible while SQLite foreign keys are off)
+    are removed so they can be reused.
+    """
+    found = {}
+    stale = []
+    for key_chunk in chunked(sorted(keys), LOOKUP_CHUNK_SIZE):
+        rows = db.session.execute(
+            select(ImportKey.key, ImportKey.transaction_id, Transaction.id)
+            .outerjoin(Transaction, Transaction.id == ImportKey.transaction_id)
+            .where(ImportKey.key.in_(key_chunk))
+        ).all()
+        for key, tx_id, existing_tx_id in rows:
+            if existing_tx_id is None:
+                stale.append(key)
+            else:
+                found[key] = tx_id
+    for key_chunk in chunked(stale, LOOKUP_CHUNK_SIZE):
+        db.session.execute(delete(ImportKey).where(ImportKey.key.in_(key_chunk)))
+    return found
+
+
+def insert_transactions_chunk(rows, matcher=None):
+    """
+    Inserts already validated rows with executemany-style bulk INSERTs (the
+    transactions, then their tag links and idempotency keys) and updates the
+    daily balance table. With a rules.RuleMatcher, the tags its rules assign
+    are linked too. Returns the new ids, in the order of `rows`.
+    Does not commit.
+    """
+    result = db.session.execute(
+        insert(Transaction).returning(Transaction.id, sort_by_parameter_order=True),
+        [
+            {
+                'date': row['date'],
+                'amount': row['amount'],
+                'description': row['description'],
+                'note': row['note'],
+                'children_flag': False,
+                'doc_flag': False,
+            }
+            for row in rows
+        ],
+    )
+    new_ids = list(result.scalars())
+
+    tag_links = []
+    for tx_id, row in zip(new_ids, rows):
+        tag_ids = list(row['tag_ids'])
+        if matcher:
+            tag_ids.extend(matcher.tags_for(row['description'], row['amount'], row['date'], tag_ids))
+        tag_links.extend({'transaction_id': tx_id, 'tag_id': tag_id} for tag_id in tag_ids)
+    if tag_links:
+        db.session.execute(insert(transaction_tags), tag_links)
+
+    import_keys = [
+        {'key': row['idempotency_key'], 'transaction_id': tx_id}
+        for tx_id, row in zip(new_ids, rows)
+        if row['idempotency_key'] is not None
+    ]
+    if import_keys:
+        db.session.execute(insert(ImportKey), import_keys)
+
+    # New top-level transactions only add their own amount to their date
+    added = {}
+    for row in rows:
+        day = added.setdefault(row['date'], [decimal.Decimal('0.00'), 0])
+        day[0] += row['amount']
+        day[1] += 1
+    apply_contribution_deltas({}, added)
+    reindex_transactions(new_ids)
+    return new_ids
+
+
+def create_transactions_bulk(validated_rows, chunk_size=None, commit=True, matcher=None):
+    """
+    Creates every valid row of a validate_bulk_rows() batch.
+
+    Rows whose idempotency key was already imported are not inserted again and
+    report the existing transaction. With `chunk_size` unset everything is
+    committed in one DB transaction; otherwise each chunk is committed on its
+    own, so a failure only loses the rows of the failing chunk. With `commit`
+    False (and no chunk_size) the caller owns the DB transaction. `matcher`
+    (a rules.RuleMatcher) adds the tags of the categorization rules.
+
+    Returns per-row results: {index, status, transaction_id, error} with status
+    'created', 'existing' or 'error'.
+    """
+    results = {
+        index: {'index': index, 'status': 'error', 'transaction_id': None, 'error': error}
+        for index, parsed, error in validated_rows
+        if parsed is None
+    }
+
+    valid_rows = [(index, parsed) for index, parsed, _ in validated_rows if parsed is not None]
+    keys = {parsed['idempotency_key'] for _, parsed in valid_rows if parsed['idempotency_key'] is not None}
+    already_imported = existing_import_keys(keys) if keys else {}
+
+    pending = []
+    for index, parsed in valid_rows:
+        existing_id = already_imported.get(parsed['idempotency_key'])
+        if existing_id is not None:
+            results[index] = {'index': index, 'status': 'existing', 'transaction_id': existing_id, 'error': None}
+        else:
+            pending.append((index, parsed))
+
+    size = chunk_size or len(pending) or 1
+    for chunk in chunked(pending, size):
+        try:
+            new_ids = insert_transactions_chunk([parsed for _, parsed in chunk], matcher)
+            if chunk_size:
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            if not chunk_size:
+                raise
+            for index, _ in chunk:
+                results[index] = {'index': index, 'status': 'error', 'transaction_id': None, 'error': "Database error while inserting this chunk."}
+            continue
+        for (index, _), tx_id in zip(chunk, new_ids):
+            results[index] = {'index': index, 'status': 'created', 'transaction_id': tx_id, 'error': None}
+
+    if commit and not chunk_size:
+        db.session.commit()
+    return [results[index] for index, _, _ in validated_rows]
+
+
+
+# --- Streaming Statement Import ---
+
+
+
+def iter_chunks(iterable, size):
+    """Yields lists of at most `size` items from any iterable, consuming it lazily."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def import_statement_rows(records, chunk_size=IMPORT_CHUNK_SIZE, skip_duplicates=True,
+                          normalize=False, date_window_days=0, atomic=False, matcher=None, progress=None):
+    """
+    Imports a stream of (row_number, row, error) records (see statements.py)
+    chunk by chunk: each chunk is validated, checked for duplicates with one
+    join and bulk inserted, so memory use does not grow with the file size.
+
+    Duplicate detection only looks at transactions that existed before the
+    import started, so identical lines of the same statement are all kept.
+    Each chunk is committed on its own unless `atomic` is set, in which case
+    everything is rolled back if any row fails. `progress`, if given, is called
+    with the running summary after each chunk (and its commit).
+
+    A statement that cannot be read any further (a ValueError from `records`)
+    ends the import: the rows read until then are imported as usual (or, when
+    atomic, everything is rolled back) and the summary's 'error' tells why.
+
+    Returns a summary with counters and the first MAX_REPORTED_ERRORS errors.
+    """
+    summary = {'rows': 0, 'created': 0, 'existing': 0, 'duplicates': 0, 'failed': 0, 'rolled_back': False,
+               'error': None, 'errors': []}
+    max_transaction_id = db.session.execute(select(func.max(Transaction.id))).scalar() or 0
+
+    def record_error(row_number, error):
+        summary['failed'] += 1
+        if len(summary['errors']) < MAX_REPORTED_ERRORS:
+            summary['errors'].append({'row': row_number, 'error': error})
+
+    def readable_records():
+        try:
+            yield from records
+        except ValueError as e:
+            summary['error'] = f"Could not read the statement: {e}"
+
+    for chunk in iter_chunks(readable_records(), chunk_size):
+        summary['rows'] += len(chunk)
+        row_numbers = []
+        rows = []
+        for row_number, row, error in chunk:
+            if row is None:
+                record_error(row_number, error)
+            else:
+                row_numbers.append(row_number)
+                rows.append(row)
+
+        validated = validate_bulk_rows(rows)
+        if skip_duplicates:
+            matches = find_duplicates(validated, normalize=normalize, date_window_days=date_window_days,
+                                      max_transaction_id=max_transaction_id)
+            summary['duplicates'] += len(matches)
+            validated = [entry for entry in validated if entry[0] not in matches]
+
+        results = create_transactions_bulk(validated, commit=False, matcher=matcher)
+        for result in results:
+            if result['status'] == 'error':
+                record_error(row_numbers[result['index']], result['error'])
+            else:
+                summary[result['status']] += 1
+
+        if not atomic:
+            db.session.commit()
+        if progress is not None:
+            progress(summary)
+
+    if atomic:
+        if summary['failed'] or summary['error']:
+            db.session.rollback()
+            summary['created'] = 0
+            summary['rolled_back'] = True
+        else:
+            db.session.commit()
+    return summary
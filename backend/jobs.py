@@ -0,0 +1,401 @@
+# File path: backend/jobs.py
+
+from app import app, db
+from models import Job, Backup
+from backup import iter_backup_archive
+from importing import import_statement_rows
+from statements import iter_statement_rows
+from rules import apply_rules, get_matcher
+from database import sqlite_pragmas
+from sqlalchemy import select, update, delete, func, and_, or_
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+
+
+# Background jobs for the operations too long for a request: backups, statement
+# imports and rule runs.
+#
+# A job is a row of the Job table (kind, JSON params, status, progress, result)
+# plus, for some kinds, files in JOB_FOLDER: the uploaded input (<id>.input) and
+# the produced result (<id>.result, e.g. a backup archive). submit_job() stores
+# the row and hands the id to a thread pool of JOB_WORKERS threads in the same
+# process; no broker is involved. A worker claims the job with a conditional
+# UPDATE (queued -> running), so a job submitted twice, or picked up again by
+# recovery, still runs once.
+#
+# Handlers report progress through JobRun.progress(). The latest values are kept
+# in memory, where the status route of this process reads them, and written to
+# the row at most every JOB_PERSIST_SECONDS on a connection of their own, which
+# also serves as heartbeat and brings back cancellation requests made from
+# other processes. Those writes are best effort: on SQLite a job whose own
+# transaction holds the write lock (an atomic import) is not made to wait on
+# itself, its progress just reaches the row later.
+#
+# Cancelling a queued job cancels it at once. A running job stops at its next
+# progress report: a rule run or an atomic import is rolled back, a chunked
+# import keeps the chunks already committed, and a partial backup is removed.
+#
+# Rows of jobs whose process stopped are recovered lazily by the job routes:
+# running jobs without a heartbeat for JOB_STALE_SECONDS are marked failed and
+# queued ones are submitted again. A queued job records the process that
+# accepted it (Job.worker, with heartbeat_at as the time it did), and is taken
+# over only when nobody accepted it or it has waited JOB_STALE_SECONDS since;
+# a process never resubmits a job still in its own queue. Finished jobs, and
+# their files, are deleted JOB_RETENTION_SECONDS after they end.
+
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_PERSIST_SECONDS = 2.0 # Minimum time between two progress writes of a running job
+JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', 600))
+JOB_RECOVERY_SECONDS = 60.0 # Minimum time between two recovery passes of a process
+JOB_RETENTION_SECONDS = int(os.environ.get('JOB_RETENTION_SECONDS', 24 * 3600))
+FINISHED_STATUSES = ('succeeded', 'failed', 'cancelled')
+
+job_executor_state = {'executor': None, 'pid': None, 'recovered_at': 0.0}
+job_executor_lock = threading.Lock()
+running_jobs = {} # {job id: JobRun} for the jobs running in this process
+queued_jobs = set() # Ids handed to this process's pool whose run_job() has not returned yet
+running_jobs_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    """Raised from JobRun.progress() when the job was asked to stop."""
+
+
+class JobFailed(Exception):
+    """Raised by a handler that failed part way, with the result of what it did before."""
+
+    def __init__(self, message, result=None):
+        super().__init__(message)
+        self.result = result
+
+
+def worker_id():
+    """Identifies this process in Job.worker."""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def job_file_path(job_id, suffix):
+    return os.path.join(app.config['JOB_FOLDER'], f'{job_id}.{suffix}')
+
+
+def remove_job_files(job_id, suffixes=('input', 'result')):
+    for suffix in suffixes:
+        try:
+            os.remove(job_file_path(job_id, suffix))
+        except FileNotFoundError:
+            pass
+
+
+def enqueue_job(job_id):
+    """Hands a job to this process's pool and remembers it until its run_job() returns."""
+    with running_jobs_lock:
+        queued_jobs.add(job_id)
+    get_executor().submit(run_job, job_id)
+
+
+def get_executor():
+    """The job thread pool, created on first use (and again in a forked worker process)."""
+    with job_executor_lock:
+        if job_executor_state['pid'] != os.getpid():
+            job_executor_state['executor'] = ThreadPoolExecutor(max_workers=max(1, JOB_WORKERS), thread_name_prefix='job')
+            job_executor_state['pid'] = os.getpid()
+        return job_executor_state['executor']
+
+
+
+# --- Running ---
+
+
+
+class JobRun:
+    """A job running in this process, as its handler sees it."""
+
+    def __init__(self, job_id, kind, params):
+        self.id = job_id
+        self.kind = kind
+        self.params = params
+        self.input_path = job_file_path(job_id, 'input')
+        self.result_path = job_file_path(job_id, 'result')
+        self.values = {}
+        self.cancelled = threading.Event()
+        self.persisted_at = time.monotonic()
+
+    def progress(self, values):
+        """Records the handler's counters; raises JobCancelled if the job was asked to stop."""
+        self.values = dict(values)
+        now = time.monotonic()
+        if not self.cancelled.is_set() and now - self.persisted_at >= JOB_PERSIST_SECONDS:
+            self.persisted_at = now
+            if persist_progress(self.id, self.values):
+                self.cancelled.set()
+        if self.cancelled.is_set():
+            raise JobCancelled()
+
+
+def persist_progress(job_id, values):
+    """
+    Writes a running job's progress and heartbeat on a connection of its own,
+    so the handler's transaction is left alone. Returns whether a cancellation
+    was requested (possibly by another process).
+    """
+    with db.engine.connect() as connection:
+        sqlite = connection.dialect.name == 'sqlite'
+        if sqlite:
+            connection.exec_driver_sql('PRAGMA busy_timeout = 0') # Skip the write rather than wait on our own lock
+        try:
+            connection.execute(
+                update(Job).where(Job.id == job_id, Job.worker == worker_id())
+                .values(progress=json.dumps(values), heartbeat_at=func.now())
+            )
+            connection.commit()
+        except OperationalError:
+            connection.rollback()
+        finally:
+            if sqlite:
+                connection.exec_driver_sql(f"PRAGMA busy_timeout = {dict(sqlite_pragmas())['busy_timeout']}")
+        return bool(connection.execute(select(Job.cancel_requested).where(Job.id == job_id)).scalar())
+
+
+def run_job(job_id):
+    """Runs a queued job to its end, in a thread of the pool. Does nothing if another worker claimed it."""
+    with app.app_context():
+        run = None
+        try:
+            claimed = db.session.execute(
+                update(Job).where(Job.id == job_id, Job.status == 'queued')
+                .values(status='running', worker=worker_id(), started_at=func.now(), heartbeat_at=func.now())
+            ).rowcount
+            db.session.commit()
+            if not claimed:
+                return
+            job = db.session.get(Job, job_id)
+            run = JobRun(job.id, job.kind, json.loads(job.params))
+            db.session.commit()
+            with running_jobs_lock:
+                running_jobs[job_id] = run
+
+            result, result_filename, error = None, None, None
+            try:
+                result, result_filename = JOB_HANDLERS[run.kind](run)
+                status = 'succeeded'
+            except JobCancelled:
+                db.session.rollback()
+                status, result = 'cancelled', run.values
+            except JobFailed as e:
+                db.session.rollback()
+                status, result, error = 'failed', e.result, str(e)
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"Job {job_id} ({run.kind}) failed: {e}", exc_info=True)
+                status, error = 'failed', str(e) or e.__class__.__name__
+            remove_job_files(job_id, ('input',) if status == 'succeeded' else ('input', 'result'))
+
+            db.session.execute(
+                update(Job).where(Job.id == job_id, Job.worker == worker_id())
+                .values(status=status, progress=json.dumps(run.values), result=json.dumps(result) if result is not None else None,
+                        result_filename=result_filename if status == 'succeeded' else None, error=error,
+                        finished_at=func.now())
+            )
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            app.logger.error(f"Database error running job {job_id}: {e}", exc_info=True)
+        finally:
+            with running_jobs_lock:
+                running_jobs.pop(job_id, None)
+                queued_jobs.discard(job_id)
+            db.session.remove()
+
+
+
+# --- Submitting and Controlling ---
+
+
+
+def submit_job(kind, params, input_stream=None):
+    """
+    Stores a job and queues it. `input_stream`, if given, is copied to the
+    job's input file first. Commits. Returns the Job.
+    """
+    job = Job(id=str(uuid.uuid4()), kind=kind, status='queued', params=json.dumps(params),
+              worker=worker_id(), heartbeat_at=func.now())
+    if input_stream is not None:
+        os.makedirs(app.config['JOB_FOLDER'], exist_ok=True)
+        with open(job_file_path(job.id, 'input'), 'wb') as target:
+            shutil.copyfileobj(input_stream, target)
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        remove_job_files(job.id)
+        raise
+    enqueue_job(job.id)
+    return job
+
+
+def cancel_job(job):
+    """
+    Asks a job to stop: a queued one is cancelled at once, a running one at its
+    next progress report. Commits. Returns False if the job had already ended.
+    """
+    if job.status in FINISHED_STATUSES:
+        return False
+    cancelled_now = db.session.execute(
+        update(Job).where(Job.id == job.id, Job.status == 'queued')
+        .values(status='cancelled', cancel_requested=True, finished_at=func.now())
+    ).rowcount
+    if not cancelled_now:
+        db.session.execute(update(Job).where(Job.id == job.id).values(cancel_requested=True))
+    db.session.commit()
+    if cancelled_now:
+        remove_job_files(job.id)
+    with running_jobs_lock:
+        run = running_jobs.get(job.id)
+    if run is not None:
+        run.cancelled.set()
+    db.session.refresh(job)
+    return True
+
+
+def job_json(job):
+    """Job.to_json() with the live progress when the job runs in this process."""
+    data = job.to_json()
+    with running_jobs_lock:
+        run = running_jobs.get(job.id)
+    if run is not None and job.status == 'running':
+        data['progress'] = run.values
+    return data
+
+
+def maintain_jobs(force=False):
+    """
+    Recovers the jobs of processes that stopped and deletes expired ones, at
+    most once per JOB_RECOVERY_SECONDS unless `force`. Commits.
+    """
+    now = time.monotonic()
+    with job_executor_lock:
+        if not force and now - job_executor_state['recovered_at'] < JOB_RECOVERY_SECONDS:
+            return
+        job_executor_state['recovered_at'] = now
+
+    database_now = db.session.execute(select(func.now())).scalar()
+    with running_jobs_lock:
+        local_ids = list(running_jobs)
+        local_queued_ids = list(queued_jobs)
+
+    stale = and_(
+        Job.status == 'running', Job.id.not_in(local_ids),
+        or_(Job.heartbeat_at.is_(None), Job.heartbeat_at < database_now - timedelta(seconds=JOB_STALE_SECONDS)),
+    )
+    stale_ids = db.session.execute(select(Job.id).where(stale)).scalars().all()
+    if stale_ids:
+        # The same condition again, so a job that reported meanwhile is left alone
+        db.session.execute(
+            update(Job).where(Job.id.in_(stale_ids), stale)
+            .values(status='failed', error='The process running the job stopped.', finished_at=func.now())
+        )
+    # Queued jobs no live process has accepted: none did, this one lost them,
+    # or the one that did has not started them for JOB_STALE_SECONDS
+    orphaned = and_(
+        Job.status == 'queued', Job.id.not_in(local_queued_ids),
+        Job.created_at < database_now - timedelta(seconds=JOB_RECOVERY_SECONDS),
+        or_(Job.worker.is_(None), Job.worker == worker_id(), Job.heartbeat_at.is_(None),
+            Job.heartbeat_at < database_now - timedelta(seconds=JOB_STALE_SECONDS)),
+    )
+    requeued_ids = db.session.execute(select(Job.id).where(orphaned)).scalars().all()
+    if requeued_ids:
+        # The same condition again: of the jobs another process took over meanwhile, none is run twice
+        db.session.execute(
+            update(Job).where(Job.id.in_(requeued_ids), orphaned).values(worker=worker_id(), heartbeat_at=func.now())
+        )
+        requeued_ids = db.session.execute(select(Job.id).where(
+            Job.id.in_(requeued_ids), Job.status == 'queued', Job.worker == worker_id()
+        )).scalars().all()
+    expired_ids = db.session.execute(select(Job.id).where(
+        Job.status.in_(FINISHED_STATUSES), Job.finished_at < database_now - timedelta(seconds=JOB_RETENTION_SECONDS)
+    )).scalars().all()
+    if expired_ids:
+        db.session.execute(delete(Job).where(Job.id.in_(expired_ids)))
+    db.session.commit()
+
+    for job_id in stale_ids + expired_ids:
+        remove_job_files(job_id)
+    for job_id in requeued_ids:
+        enqueue_job(job_id)
+
+
+
+# --- Handlers ---
+
+
+
+def run_backup_job(run):
+    """Writes a full or incremental backup archive to the job's result file."""
+    base = None
+    if run.params.get('base_id'):
+        base = db.session.get(Backup, run.params['base_id'])
+        if base is None:
+            raise ValueError("The base backup no longer exists.")
+    written = 0
+    os.makedirs(app.config['JOB_FOLDER'], exist_ok=True)
+    with open(run.result_path, 'wb') as target:
+        for piece in iter_backup_archive(store_compressed=run.params.get('store_compressed', True), base=base):
+            target.write(piece)
+            written += len(piece)
+            run.progress({'bytes': written})
+    kind = 'incremental' if base is not None else 'backup'
+    return {'size': written}, f"categorization_{kind}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.zip"
+
+
+def run_import_job(run):
+    """Imports the job's input file as a statement (see import_statement_rows)."""
+    params = run.params
+    with open(run.input_path, 'rb') as stream:
+        summary = import_statement_rows(
+            iter_statement_rows(stream, params['options']),
+            chunk_size=params['chunk_size'],
+            skip_duplicates=params['skip_duplicates'],
+            normalize=params['normalize'],
+            date_window_days=params['date_window_days'],
+            atomic=params['atomic'],
+            matcher=get_matcher() if params['apply_rules'] else None,
+            progress=run.progress,
+        )
+    if summary['error']:
+        raise JobFailed(summary['error'], summary)
+    return summary, None
+
+
+def run_apply_rules_job(run):
+    """Runs the categorization rules over existing transactions (see apply_rules)."""
+    params = run.params
+    started = time.monotonic()
+    report = apply_rules(
+        date.fromisoformat(params['start_date']) if params.get('start_date') else None,
+        date.fromisoformat(params['end_date']) if params.get('end_date') else None,
+        dry_run=params['dry_run'],
+        progress=run.progress,
+    )
+    if params['dry_run']:
+        db.session.rollback()
+    else:
+        db.session.commit()
+    report.update(dry_run=params['dry_run'], elapsed_ms=round((time.monotonic() - started) * 1000))
+    return report, None
+
+
+JOB_HANDLERS = {
+    'backup': run_backup_job,
+    'import': run_import_job,
+    'apply_rules': run_apply_rules_job,
+}
@@ -0,0 +1,179 @@
+"""Initial schema
+
+The tables as create_all() built them before migrations were introduced.
+Databases created that way are adopted with `flask db stamp 3f1c2a9b7d01`
+(or `stamp head` once they have the later indexes).
+
+Revision ID: 3f1c2a9b7d01
+Revises:
+Create Date: 2026-10-18 11:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9b7d01'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('backup',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('base_id', sa.String(length=36), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('manifest', sa.Text(), nullable=False),
+        sa.ForeignKeyConstraint(['base_id'], ['backup.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('daily_balance',
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.Column('total', sa.Numeric(precision=12, scale=2), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('running_total', sa.Numeric(precision=14, scale=2), nullable=False),
+        sa.PrimaryKeyConstraint('date')
+    )
+    op.create_table('document_blob',
+        sa.Column('sha256', sa.String(length=64), nullable=False),
+        sa.Column('stored_filename', sa.String(length=255), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('ref_count', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.PrimaryKeyConstraint('sha256'),
+        sa.UniqueConstraint('stored_filename')
+    )
+    op.create_table('setting',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('key', sa.String(length=80), nullable=False),
+        sa.Column('value', sa.Numeric(precision=10, scale=2), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_setting_key', 'setting', ['key'], unique=True)
+    op.create_table('tag_group',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=80), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+    )
+    op.create_table('transaction',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.Column('amount', sa.Numeric(precision=10, scale=2), nullable=False),
+        sa.Column('description', sa.String(length=200), nullable=True),
+        sa.Column('note', sa.String(length=200), nullable=True),
+        sa.Column('children_flag', sa.Boolean(), nullable=False),
+        sa.Column('doc_flag', sa.Boolean(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column('parent_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['parent_id'], ['transaction.id'], name='fk_transaction_parent_id'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_transaction_duplicate_key', 'transaction', ['date', 'amount', 'description'], unique=False)
+    op.create_index('ix_transaction_date', 'transaction', ['date'], unique=False)
+    op.create_index('ix_transaction_updated_at', 'transaction', ['updated_at'], unique=False)
+    op.create_index('ix_transaction_parent_id', 'transaction', ['parent_id'], unique=False)
+    op.create_table('document',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('original_filename', sa.String(length=255), nullable=False),
+        sa.Column('stored_filename', sa.String(length=255), nullable=False),
+        sa.Column('mimetype', sa.String(length=255), nullable=False),
+        sa.Column('transaction_id', sa.Integer(), nullable=False),
+        sa.Column('blob_sha256', sa.String(length=64), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.ForeignKeyConstraint(['blob_sha256'], ['document_blob.sha256'], ),
+        sa.ForeignKeyConstraint(['transaction_id'], ['transaction.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('stored_filename')
+    )
+    op.create_index('ix_document_blob_sha256', 'document', ['blob_sha256'], unique=False)
+    op.create_index('ix_document_transaction_id', 'document', ['transaction_id'], unique=False)
+    op.create_table('import_key',
+        sa.Column('key', sa.String(length=128), nullable=False),
+        sa.Column('transaction_id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.ForeignKeyConstraint(['transaction_id'], ['transaction.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index('ix_import_key_transaction_id', 'import_key', ['transaction_id'], unique=False)
+    op.create_table('tag',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=80), nullable=False),
+        sa.Column('color', sa.String(length=7), nullable=True),
+        sa.Column('tag_group_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['tag_group_id'], ['tag_group.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name', 'tag_group_id', name='_tag_name_group_uc')
+    )
+    op.create_index('ix_tag_name', 'tag', ['name'], unique=False)
+    op.create_table('upload_session',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('transaction_id', sa.Integer(), nullable=False),
+        sa.Column('original_filename', sa.String(length=255), nullable=False),
+        sa.Column('mimetype', sa.String(length=255), nullable=False),
+        sa.Column('total_size', sa.BigInteger(), nullable=False),
+        sa.Column('received_size', sa.BigInteger(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.ForeignKeyConstraint(['transaction_id'], ['transaction.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_upload_session_transaction_id', 'upload_session', ['transaction_id'], unique=False)
+    op.create_index('ix_upload_session_updated_at', 'upload_session', ['updated_at'], unique=False)
+    op.create_table('categorization_rule',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=120), nullable=True),
+        sa.Column('tag_id', sa.Integer(), nullable=False),
+        sa.Column('pattern', sa.String(length=255), nullable=True),
+        sa.Column('match_type', sa.String(length=20), nullable=False),
+        sa.Column('min_amount', sa.Numeric(precision=10, scale=2), nullable=True),
+        sa.Column('max_amount', sa.Numeric(precision=10, scale=2), nullable=True),
+        sa.Column('start_date', sa.Date(), nullable=True),
+        sa.Column('end_date', sa.Date(), nullable=True),
+        sa.Column('priority', sa.Integer(), nullable=False),
+        sa.Column('enabled', sa.Boolean(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.ForeignKeyConstraint(['tag_id'], ['tag.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_categorization_rule_tag_id', 'categorization_rule', ['tag_id'], unique=False)
+    op.create_table('transaction_tags',
+        sa.Column('transaction_id', sa.Integer(), nullable=False),
+        sa.Column('tag_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['tag_id'], ['tag.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['transaction_id'], ['transaction.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('transaction_id', 'tag_id')
+    )
+
+
+def downgrade():
+    op.drop_table('transaction_tags')
+    op.drop_index('ix_categorization_rule_tag_id', table_name='categorization_rule')
+    op.drop_table('categorization_rule')
+    op.drop_index('ix_upload_session_updated_at', table_name='upload_session')
+    op.drop_index('ix_upload_session_transaction_id', table_name='upload_session')
+    op.drop_table('upload_session')
+    op.drop_index('ix_tag_name', table_name='tag')
+    op.drop_table('tag')
+    op.drop_index('ix_import_key_transaction_id', table_name='import_key')
+    op.drop_table('import_key')
+    op.drop_index('ix_document_transaction_id', table_name='document')
+    op.drop_index('ix_document_blob_sha256', table_name='document')
+    op.drop_table('document')
+    op.drop_index('ix_transaction_parent_id', table_name='transaction')
+    op.drop_index('ix_transaction_updated_at', table_name='transaction')
+    op.drop_index('ix_transaction_date', table_name='transaction')
+    op.drop_index('ix_transaction_duplicate_key', table_name='transaction')
+    op.drop_table('transaction')
+    op.drop_table('tag_group')
+    op.drop_index('ix_setting_key', table_name='setting')
+    op.drop_table('setting')
+    op.drop_table('document_blob')
+    op.drop_table('daily_balance')
+    op.drop_table('backup')
@@ -0,0 +1,35 @@
+"""Indexes for the hot queries
+
+(date, id) serves date ranges and the keyset order of the transaction list,
+replacing the single-column date index. transaction_tags(tag_id) serves
+filtering and deleting by tag (the primary key only helps by transaction),
+tag(tag_group_id) the tag group cascade.
+
+Revision ID: 8a4e6c2d1b55
+Revises: 3f1c2a9b7d01
+Create Date: 2026-10-18 11:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a4e6c2d1b55'
+down_revision = '3f1c2a9b7d01'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_transaction_date_id', 'transaction', ['date', 'id'], unique=False)
+    op.drop_index('ix_transaction_date', table_name='transaction')
+    op.create_index('ix_transaction_tags_tag_id', 'transaction_tags', ['tag_id'], unique=False)
+    op.create_index('ix_tag_tag_group_id', 'tag', ['tag_group_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_tag_tag_group_id', table_name='tag')
+    op.drop_index('ix_transaction_tags_tag_id', table_name='transaction_tags')
+    op.create_index('ix_transaction_date', 'transaction', ['date'], unique=False)
+    op.drop_index('ix_transaction_date_id', table_name='transaction')
@@ -0,0 +1,34 @@
+"""Counter table
+
+Holds the tag catalog version, bumped in the same commit as every catalog
+change so that all processes serving the catalog agree on it (catalog.py).
+It starts from the clock, above any version a process handed out before.
+
+Revision ID: a7c3e9d15b42
+Revises: e1b94f6a2c38
+Create Date: 2026-10-18 18:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import time
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e9d15b42'
+down_revision = 'e1b94f6a2c38'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    counter = op.create_table('counter',
+        sa.Column('name', sa.String(length=40), nullable=False),
+        sa.Column('value', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(counter, [{'name': 'catalog', 'value': time.time_ns() // 1000}])
+
+
+def downgrade():
+    op.drop_table('counter')
@@ -0,0 +1,33 @@
+"""Transaction change epoch
+
+Every write stamps a transaction with the change epoch open at the time
+(the 'change_epoch' counter). A backup closes the epoch once the writers
+stamping it have committed, and the next incremental packs the rows of
+later epochs (backup.py). Existing rows start in epoch 0.
+
+Revision ID: b3f8d2c61e07
+Revises: a7c3e9d15b42
+Create Date: 2026-10-18 20:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3f8d2c61e07'
+down_revision = 'a7c3e9d15b42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('change_epoch', sa.BigInteger(), server_default='0', nullable=False))
+        batch_op.create_index('ix_transaction_change_epoch', ['change_epoch'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.drop_index('ix_transaction_change_epoch')
+        batch_op.drop_column('change_epoch')
@@ -0,0 +1,42 @@
+"""Indexes shaped after the queries
+
+The duplicate check leads with amount (matched exactly) before the date range.
+The tag index also holds transaction_id, so tag filters are answered from the
+index alone. The parent_id index becomes partial: only split children have a
+parent_id, and leaving the top-level rows out keeps it small and selective.
+
+Revision ID: c5d2e7f40a93
+Revises: 8a4e6c2d1b55
+Create Date: 2026-10-18 14:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d2e7f40a93'
+down_revision = '8a4e6c2d1b55'
+branch_labels = None
+depends_on = None
+
+CHILDREN_ONLY = sa.text('parent_id IS NOT NULL')
+
+
+def upgrade():
+    op.create_index('ix_transaction_amount_date_description', 'transaction', ['amount', 'date', 'description'], unique=False)
+    op.drop_index('ix_transaction_duplicate_key', table_name='transaction')
+    op.create_index('ix_transaction_children', 'transaction', ['parent_id'], unique=False,
+                    sqlite_where=CHILDREN_ONLY, postgresql_where=CHILDREN_ONLY)
+    op.drop_index('ix_transaction_parent_id', table_name='transaction')
+    op.create_index('ix_transaction_tags_tag_id_transaction_id', 'transaction_tags', ['tag_id', 'transaction_id'], unique=False)
+    op.drop_index('ix_transaction_tags_tag_id', table_name='transaction_tags')
+
+
+def downgrade():
+    op.create_index('ix_transaction_tags_tag_id', 'transaction_tags', ['tag_id'], unique=False)
+    op.drop_index('ix_transaction_tags_tag_id_transaction_id', table_name='transaction_tags')
+    op.create_index('ix_transaction_parent_id', 'transaction', ['parent_id'], unique=False)
+    op.drop_index('ix_transaction_children', table_name='transaction')
+    op.create_index('ix_transaction_duplicate_key', 'transaction', ['date', 'amount', 'description'], unique=False)
+    op.drop_index('ix_transaction_amount_date_description', table_name='transaction')
@@ -0,0 +1,33 @@
+"""Blob documents without stored_filename
+
+Documents backed by a blob are read through DocumentBlob.stored_filename;
+their own stored_filename named no file. It becomes nullable and is cleared
+for them. A downgrade gives them a placeholder name again.
+
+Revision ID: d8a1f3b6c924
+Revises: b3f8d2c61e07
+Create Date: 2026-10-18 21:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8a1f3b6c924'
+down_revision = 'b3f8d2c61e07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('document', schema=None) as batch_op:
+        batch_op.alter_column('stored_filename', existing_type=sa.String(length=255), nullable=True)
+    op.execute("UPDATE document SET stored_filename = NULL WHERE blob_sha256 IS NOT NULL")
+
+
+def downgrade():
+    op.execute("UPDATE document SET stored_filename = 'blob-document-' || CAST(id AS VARCHAR(20)) "
+               "WHERE stored_filename IS NULL")
+    with op.batch_alter_table('document', schema=None) as batch_op:
+        batch_op.alter_column('stored_filename', existing_type=sa.String(length=255), nullable=False)
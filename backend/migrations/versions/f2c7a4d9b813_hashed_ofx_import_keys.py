@@ -0,0 +1,36 @@
+"""Hashed OFX import keys
+
+OFX rows are keyed by 'ofx:' and the sha256 of '<account>:<FITID>'
+instead of the pair itself, which could exceed the 128 characters of a
+key (statements.ofx_idempotency_key). Keys already stored are rewritten,
+so statements imported before are still recognized. The hash cannot be
+reversed: a downgrade keeps the new keys.
+
+Revision ID: f2c7a4d9b813
+Revises: d8a1f3b6c924
+Create Date: 2026-10-18 22:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import hashlib
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c7a4d9b813'
+down_revision = 'd8a1f3b6c924'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    import_key = sa.table('import_key', sa.column('key', sa.String(128)))
+    connection = op.get_bind()
+    old_keys = connection.execute(sa.select(import_key.c.key).where(import_key.c.key.like('ofx:%'))).scalars().all()
+    for old_key in old_keys:
+        new_key = 'ofx:' + hashlib.sha256(old_key[len('ofx:'):].encode()).hexdigest()
+        connection.execute(import_key.update().where(import_key.c.key == old_key).values(key=new_key))
+
+
+def downgrade():
+    pass
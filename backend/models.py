@@ -1,8 +1,10 @@
 # File path: backend/models.py
 
 from app import db
+from sqlalchemy import select, update
 from sqlalchemy.sql import func
 import decimal
+import json
 import uuid # For generating unique filenames for stored documents
 
 
@@ -12,7 +14,10 @@ import uuid # For generating unique filenames for stored documents
 
 transaction_tags = db.Table('transaction_tags',
     db.Column('transaction_id', db.Integer, db.ForeignKey('transaction.id', ondelete='CASCADE'), primary_key=True),
-    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id', ondelete='CASCADE'), primary_key=True)
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id', ondelete='CASCADE'), primary_key=True),
+    # The primary key serves lookups by transaction; this one serves lookups by tag,
+    # and covers them, so tag filters never read the table itself
+    db.Index('ix_transaction_tags_tag_id_transaction_id', 'tag_id', 'transaction_id'),
 )
 
 
@@ -20,24 +25,79 @@ transaction_tags = db.Table('transaction_tags',
 # --- Model Definitions ---
 
 
+class Counter(db.Model):
+    """
+    A named counter bumped in the same commit as the change it counts: the tag
+    catalog version (see catalog.py) and the change epoch of the transactions
+    (see backup.py). Not part of backups.
+    """
+    __tablename__ = 'counter'
+
+    name = db.Column(db.String(40), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False)
+
+    @classmethod
+    def bump(cls, name, start):
+        """Adds 1 to the counter `name` in the current transaction, creating it at `start` if missing."""
+        result = db.session.execute(
+            update(cls).where(cls.name == name).values(value=cls.value + 1)
+        )
+        if result.rowcount == 0:
+            db.session.add(cls(name=name, value=start))
+            db.session.flush()
+
+    def __repr__(self):
+        return f'<Counter {self.name} = {self.value}>'
+
+
+# The change epoch open right now, stamped on every transaction row written. The
+# share lock (PostgreSQL; SQLite writers hold the database lock anyway) keeps a
+# backup from closing the epoch until the writers stamping it have committed.
+CHANGE_EPOCH_COUNTER = 'change_epoch'
+current_change_epoch = select(func.coalesce(
+    select(Counter.value).where(Counter.name == CHANGE_EPOCH_COUNTER).with_for_update(read=True).scalar_subquery(), 0
+)).scalar_subquery()
+
+
+class DocumentBlob(db.Model):
+    """
+    A stored file, addressed by the sha256 of its content. Documents with the
+    same content share one blob; the file is removed when ref_count drops to 0.
+    """
+    __tablename__ = 'document_blob'
+
+    sha256 = db.Column(db.String(64), primary_key=True)
+    stored_filename = db.Column(db.String(255), unique=True, nullable=False) # path under UPLOAD_FOLDER
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    def __repr__(self):
+        return f'<DocumentBlob {self.sha256[:12]} | refs={self.ref_count}>'
+
+
 class Document(db.Model):
     """Represents a document attached to a transaction."""
     __tablename__ = 'document'
 
     id = db.Column(db.Integer, primary_key=True)
     original_filename = db.Column(db.String(255), nullable=False)
-    stored_filename = db.Column(db.String(255), unique=True, nullable=False) # e.g., UUID.ext
+    stored_filename = db.Column(db.String(255), unique=True, nullable=True) # e.g., UUID.ext; only documents without a blob have their own file
     mimetype = db.Column(db.String(255), nullable=False)
     transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id', ondelete='CASCADE'), nullable=False, index=True)
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('document_blob.sha256'), nullable=True, index=True)
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
 
+    blob = db.relationship('DocumentBlob', lazy='joined')
+
     def to_json(self):
         return {
             'id': self.id,
             'original_filename': self.original_filename,
             'mimetype': self.mimetype,
             'transaction_id': self.transaction_id,
+            'sha256': self.blob_sha256,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             # We don't expose stored_filename directly to client, URLs will handle it
         }
@@ -46,29 +106,74 @@ class Document(db.Model):
         return f'<Document {self.id} | {self.original_filename} | tx_id={self.transaction_id}>'
 
 
+class UploadSession(db.Model):
+    """
+    A chunked document upload in progress. Chunks are appended to a file in
+    UPLOAD_FOLDER; the Document is created when the upload is completed.
+    """
+    __tablename__ = 'upload_session'
+
+    id = db.Column(db.String(36), primary_key=True)
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id', ondelete='CASCADE'), nullable=False, index=True)
+    original_filename = db.Column(db.String(255), nullable=False)
+    mimetype = db.Column(db.String(255), nullable=False)
+    total_size = db.Column(db.BigInteger, nullable=False)
+    received_size = db.Column(db.BigInteger, nullable=False, default=0)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False)
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False, index=True)
+
+    def to_json(self):
+        return {
+            'id': self.id,
+            'transaction_id': self.transaction_id,
+            'original_filename': self.original_filename,
+            'mimetype': self.mimetype,
+            'total_size': self.total_size,
+            'offset': self.received_size,
+            'complete': self.received_size == self.total_size,
+        }
+
+    def __repr__(self):
+        return f'<UploadSession {self.id} | {self.received_size}/{self.total_size} | tx_id={self.transaction_id}>'
+
+
 class Transaction(db.Model):
     """Represents a financial transaction."""
     __tablename__ = 'transaction'
+    __table_args__ = (
+        # Serves the import duplicate check, which matches an amount exactly within a
+        # date range: the equality column first, so both narrow the index search
+        db.Index('ix_transaction_amount_date_description', 'amount', 'date', 'description'),
+        # Serves date ranges and the (date, id) keyset order of the transaction list
+        db.Index('ix_transaction_date_id', 'date', 'id'),
+        # Children of a split (parent_id = ?). Partial: top-level transactions, nearly all
+        # of them, stay out, which keeps the index small and its statistics selective
+        db.Index('ix_transaction_children', 'parent_id',
+                 sqlite_where=db.text('parent_id IS NOT NULL'), postgresql_where=db.text('parent_id IS NOT NULL')),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    date = db.Column(db.Date, nullable=False, index=True)
+    date = db.Column(db.Date, nullable=False)
     amount = db.Column(db.Numeric(precision=10, scale=2), nullable=False)
     description = db.Column(db.String(200), nullable=True)
     note = db.Column(db.String(200), nullable=True)
     children_flag = db.Column(db.Boolean, nullable=False, default=False) # Indicates if this is a parent transaction
     doc_flag = db.Column(db.Boolean, nullable=False, default=False)
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False)
-    updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False, index=True)
+    # Change epoch of the last write, for incremental backups (see backup.py)
+    change_epoch = db.Column(db.BigInteger, default=current_change_epoch, onupdate=current_change_epoch,
+                             server_default='0', nullable=False, index=True)
 
     # --- New fields for Split Transaction feature ---
-    parent_id = db.Column(db.Integer, db.ForeignKey('transaction.id', name='fk_transaction_parent_id'), nullable=True, index=True)
+    parent_id = db.Column(db.Integer, db.ForeignKey('transaction.id', name='fk_transaction_parent_id'), nullable=True)
     
     # Relationship to load children for a parent transaction
     # 'parent' backref allows child_transaction.parent to access the parent object
     children = db.relationship(
         'Transaction',
         backref=db.backref('parent', remote_side=[id]), 
-        lazy='subquery', # Fetches children using a separate query when parent.children is accessed
+        lazy='select', # Fetches children with a separate query when parent.children is accessed
         cascade='all, delete-orphan' # If parent is deleted, its children are also deleted
     )
     # --- End of New fields ---
@@ -76,7 +181,7 @@ class Transaction(db.Model):
     tags = db.relationship(
         'Tag',
         secondary=transaction_tags,
-        lazy='subquery', # Similar to above, fetches tags when parent.tags is accessed
+        lazy='select', # Similar to above, fetches tags when transaction.tags is accessed
         back_populates='transactions'
     )
 
@@ -84,7 +189,7 @@ class Transaction(db.Model):
     documents = db.relationship(
         'Document',
         backref='transaction', # Allows document.transaction to access the Transaction object
-        lazy='subquery',       # Fetches documents when transaction.documents is accessed
+        lazy='select',         # Fetches documents when transaction.documents is accessed
         cascade='all, delete-orphan' # If transaction is deleted, its documents are also deleted
     )
 
@@ -125,7 +230,7 @@ class Tag(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), unique=False, nullable=False, index=True)
     color = db.Column(db.String(7), nullable=True)
-    tag_group_id = db.Column(db.Integer, db.ForeignKey('tag_group.id'), nullable=False)
+    tag_group_id = db.Column(db.Integer, db.ForeignKey('tag_group.id'), nullable=False, index=True)
     tag_group = db.relationship('TagGroup', back_populates='tags')
     transactions = db.relationship(
         'Transaction',
@@ -180,6 +285,133 @@ class TagGroup(db.Model):
         return f'<TagGroup {self.id} ({self.name})>'
 
 
+# --- Categorization Rules ---
+class CategorizationRule(db.Model):
+    """
+    Assigns a tag to transactions whose description matches `pattern` and
+    whose amount and date fall in the optional ranges (see rules.py).
+    """
+    __tablename__ = 'categorization_rule'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey('tag.id', ondelete='CASCADE'), nullable=False, index=True)
+    pattern = db.Column(db.String(255), nullable=True) # Empty: any description
+    match_type = db.Column(db.String(20), nullable=False, default='contains') # 'contains', 'exact' or 'regex'
+    min_amount = db.Column(db.Numeric(precision=10, scale=2), nullable=True)
+    max_amount = db.Column(db.Numeric(precision=10, scale=2), nullable=True)
+    start_date = db.Column(db.Date, nullable=True)
+    end_date = db.Column(db.Date, nullable=True)
+    priority = db.Column(db.Integer, nullable=False, default=100) # Lower wins within a tag group
+    enabled = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False)
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+    tag = db.relationship('Tag')
+
+    def to_json(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'tag_id': self.tag_id,
+            'pattern': self.pattern,
+            'match_type': self.match_type,
+            'min_amount': str(self.min_amount) if self.min_amount is not None else None,
+            'max_amount': str(self.max_amount) if self.max_amount is not None else None,
+            'start_date': self.start_date.isoformat() if self.start_date else None,
+            'end_date': self.end_date.isoformat() if self.end_date else None,
+            'priority': self.priority,
+            'enabled': self.enabled,
+        }
+
+    def __repr__(self):
+        return f'<CategorizationRule {self.id} | {self.match_type} {self.pattern!r} -> tag_id={self.tag_id}>'
+
+
+# --- Import Idempotency Keys ---
+class ImportKey(db.Model):
+    """
+    Idempotency key of a transaction created through the bulk endpoint, so a
+    retried import returns the existing transaction instead of inserting it again.
+    """
+    __tablename__ = 'import_key'
+
+    key = db.Column(db.String(128), primary_key=True)
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id', ondelete='CASCADE'), nullable=False, index=True)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    def __repr__(self):
+        return f'<ImportKey {self.key} -> tx_id={self.transaction_id}>'
+
+
+# --- Backup History ---
+class Backup(db.Model):
+    """
+    A backup archive that was produced, with its manifest, so the next run can
+    pack only what changed since it (see backup.py).
+    """
+    __tablename__ = 'backup'
+
+    id = db.Column(db.String(36), primary_key=True)
+    kind = db.Column(db.String(20), nullable=False) # 'full' or 'incremental'
+    base_id = db.Column(db.String(36), db.ForeignKey('backup.id'), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False) # UTC start of the run; later changes go to the next backup
+    manifest = db.Column(db.Text, nullable=False) # JSON
+
+    def to_json(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'base_id': self.base_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+
+    def __repr__(self):
+        return f'<Backup {self.id} | {self.kind} | base={self.base_id}>'
+
+
+class Job(db.Model):
+    """
+    A long-running operation (backup, statement import, rule run) executed in
+    the background by jobs.py. The row outlives the process that ran it.
+    """
+    __tablename__ = 'job'
+
+    id = db.Column(db.String(36), primary_key=True)
+    kind = db.Column(db.String(40), nullable=False) # 'backup', 'import' or 'apply_rules'
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True) # queued, running, succeeded, failed, cancelled
+    params = db.Column(db.Text, nullable=False) # JSON
+    progress = db.Column(db.Text, nullable=True) # JSON, counters of the handler
+    result = db.Column(db.Text, nullable=True) # JSON summary
+    result_filename = db.Column(db.String(255), nullable=True) # Download name of the result file, when there is one
+    error = db.Column(db.Text, nullable=True)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    worker = db.Column(db.String(120), nullable=True) # host:pid of the process that queued or runs it
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False)
+    started_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    heartbeat_at = db.Column(db.DateTime(timezone=True), nullable=True) # Last progress write of a running job; when a queued one was accepted
+    finished_at = db.Column(db.DateTime(timezone=True), nullable=True)
+
+    def to_json(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'params': json.loads(self.params),
+            'progress': json.loads(self.progress) if self.progress else {},
+            'result': json.loads(self.result) if self.result else None,
+            'has_result_file': self.result_filename is not None,
+            'error': self.error,
+            'cancel_requested': self.cancel_requested,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f'<Job {self.id} | {self.kind} | {self.status}>'
+
+
 # --- New Settings Model ---
 class Setting(db.Model):
     """Represents an application setting."""
@@ -205,4 +437,37 @@ class Setting(db.Model):
 
     def __repr__(self):
         value_str = f"{self.value:.2f}" if self.value is not None else "None"
-        return f'<Setting {self.key} = {value_str}>'
\ No newline at end of file
+        return f'<Setting {self.key} = {value_str}>'
+
+# --- Materialized Daily Balances ---
+class DailyBalance(db.Model):
+    """
+    Per-date aggregate of the ledger, maintained incrementally by the transaction
+    write routes (see balances.py) and rebuildable with `flask daily-balances rebuild`.
+
+    'total' is the sum of the effective amounts of the day (a split parent counts
+    its amount minus its children), 'count' the number of transactions dated that
+    day, and 'running_total' the sum of every 'total' up to and including that day.
+    The end-of-day balance is initial_balance + running_total, so changing the
+    initial balance never requires rewriting this table.
+    """
+    __tablename__ = 'daily_balance'
+
+    date = db.Column(db.Date, primary_key=True) # Primary key index makes any date lookup O(log n)
+    total = db.Column(db.Numeric(precision=12, scale=2), nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    running_total = db.Column(db.Numeric(precision=14, scale=2), nullable=False, default=0)
+
+    def to_json(self, initial_balance=None):
+        data = {
+            'date': self.date.isoformat() if self.date else None,
+            'total': str(self.total),
+            'count': self.count,
+            'running_total': str(self.running_total),
+        }
+        if initial_balance is not None:
+            data['balance'] = str(initial_balance + self.running_total)
+        return data
+
+    def __repr__(self):
+        return f'<DailyBalance {self.date} | total={self.total} | running_total={self.running_total}>'
@@ -0,0 +1,226 @@
+# File path: backend/previews.py
+
+from app import app, db
+from models import DocumentBlob
+from sqlalchemy import select
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+
+try:
+    from PIL import Image, ImageOps
+except ImportError: # Pillow is optional: without it only PDFs (through pdftoppm) get previews
+    Image = None
+
+
+# Document thumbnails and previews.
+#
+# Small JPEG renditions of image documents (and of the first page of PDFs,
+# when poppler's pdftoppm is installed) are cached under PREVIEW_FOLDER, keyed
+# by the content hash of the blob and the rendition size, so documents sharing
+# a blob share their previews and a cached file is never stale. Renditions are
+# made by a thread pool: right after an upload (schedule_previews) and lazily
+# on the first request for one that is missing. A job already queued or
+# running for the same rendition is shared instead of starting another one.
+#
+# The cache is bounded by evict_previews(): renditions whose blob is gone are
+# removed, then the least recently served ones until the folder fits in
+# PREVIEW_CACHE_BYTES. Serving a rendition bumps its mtime.
+
+
+PREVIEW_SIZES = {'thumb': 256, 'preview': 1024} # Longest side, in pixels
+PREVIEW_WORKERS = int(os.environ.get('PREVIEW_WORKERS', 2))
+PREVIEW_WAIT_SECONDS = 10 # How long a request waits for a lazily generated rendition
+PREVIEW_JPEG_QUALITY = 80
+PREVIEW_CACHE_BYTES = int(os.environ.get('PREVIEW_CACHE_BYTES', 512 * 1024 * 1024))
+PREVIEW_EVICT_EVERY = 200 # Renditions generated between two background evictions
+PDFTOPPM_TIMEOUT_SECONDS = 30
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+
+preview_executor = ThreadPoolExecutor(max_workers=max(1, PREVIEW_WORKERS), thread_name_prefix='preview')
+pending_previews = {} # {preview path: Future}
+pending_previews_lock = threading.Lock()
+generated_since_eviction = 0 # Guarded by pending_previews_lock
+
+
+
+# --- Rendering ---
+
+
+
+def preview_kind(filename):
+    """'image', 'pdf' or None for a document that cannot be previewed here."""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension in IMAGE_EXTENSIONS and Image is not None:
+        return 'image'
+    if extension == 'pdf' and shutil.which('pdftoppm'):
+        return 'pdf'
+    return None
+
+
+def render_image(source_path, target_path, size):
+    """Writes a JPEG of an image scaled to fit `size` x `size`."""
+    with Image.open(source_path) as image:
+        # JPEGs can be decoded at a fraction of their size, which is much faster for large scans
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.split()[-1])
+            image = background
+        image.save(target_path, 'JPEG', quality=PREVIEW_JPEG_QUALITY, optimize=True)
+
+
+def render_pdf(source_path, target_path, size):
+    """Writes a JPEG of the first page of a PDF scaled to fit `size` x `size`, with pdftoppm."""
+    prefix = target_path[:-len('.jpg')]
+    subprocess.run(
+        ['pdftoppm', '-f', '1', '-l', '1', '-singlefile', '-jpeg', '-jpegopt', f'quality={PREVIEW_JPEG_QUALITY}',
+         '-scale-to', str(size), source_path, prefix],
+        check=True, capture_output=True, timeout=PDFTOPPM_TIMEOUT_SECONDS,
+    )
+
+
+def generate_preview(source_path, preview_path, kind, size):
+    """Renders one preview to a temporary file and moves it into place. Runs on the pool."""
+    global generated_since_eviction
+    os.makedirs(os.path.dirname(preview_path), exist_ok=True)
+    temp_path = os.path.join(os.path.dirname(preview_path), f".tmp-{uuid.uuid4()}.jpg")
+    try:
+        if kind == 'image':
+            render_image(source_path, temp_path, size)
+        else:
+            render_pdf(source_path, temp_path, size)
+        os.replace(temp_path, preview_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        with pending_previews_lock:
+            pending_previews.pop(preview_path, None)
+
+    with pending_previews_lock:
+        generated_since_eviction += 1
+        evict = generated_since_eviction >= PREVIEW_EVICT_EVERY
+        if evict:
+            generated_since_eviction = 0
+    if evict:
+        with app.app_context():
+            evict_previews()
+    return preview_path
+
+
+
+# --- Cache ---
+
+
+
+def preview_path_for(document, size_name):
+    """Where a rendition of a blob-backed document is cached, else None."""
+    if document.blob_sha256 is None:
+        return None
+    sha256 = document.blob_sha256
+    return os.path.join(app.config['PREVIEW_FOLDER'], sha256[:2], f"{sha256}-{size_name}.jpg")
+
+
+def request_preview(document, size_name, source_path):
+    """
+    Returns the Future of a rendition, submitting it to the pool unless it is
+    already pending. Returns None when the document cannot be previewed.
+    """
+    preview_path = preview_path_for(document, size_name)
+    kind = preview_kind(document.original_filename)
+    if preview_path is None or kind is None:
+        return None
+    with pending_previews_lock:
+        future = pending_previews.get(preview_path)
+        if future is None:
+            future = preview_executor.submit(generate_preview, source_path, preview_path, kind, PREVIEW_SIZES[size_name])
+            pending_previews[preview_path] = future
+    return future
+
+
+def schedule_previews(document, source_path):
+    """Queues the thumbnail of a new upload, so it is ready by the time it is listed."""
+    if preview_path_for(document, 'thumb') is not None and not os.path.exists(preview_path_for(document, 'thumb')):
+        request_preview(document, 'thumb', source_path)
+
+
+def get_preview(document, size_name, source_path, wait_seconds=PREVIEW_WAIT_SECONDS):
+    """
+    Path of a cached rendition, generating it first if needed. Returns None
+    when the document cannot be previewed; raises TimeoutError when the
+    rendition is still being generated after `wait_seconds`.
+    """
+    preview_path = preview_path_for(document, size_name)
+    if preview_path is not None and os.path.exists(preview_path):
+        try:
+            os.utime(preview_path) # Most recently served renditions are evicted last
+            return preview_path
+        except FileNotFoundError: # Evicted meanwhile
+            pass
+    future = request_preview(document, size_name, source_path)
+    if future is None:
+        return None
+    try:
+        return future.result(timeout=wait_seconds)
+    except FutureTimeoutError:
+        raise TimeoutError(f"Preview of document {document.id} is still being generated.")
+
+
+def evict_previews(max_bytes=None):
+    """
+    Removes renditions of blobs that no longer exist, then the least recently
+    served ones until the cache fits in `max_bytes` (PREVIEW_CACHE_BYTES).
+    Returns (files removed, bytes kept).
+    """
+    max_bytes = PREVIEW_CACHE_BYTES if max_bytes is None else max_bytes
+    preview_folder = app.config['PREVIEW_FOLDER']
+    if not os.path.isdir(preview_folder):
+        return 0, 0
+
+    entries = []
+    for directory, _, filenames in os.walk(preview_folder):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path, filename.split('-', 1)[0]))
+
+    live = set()
+    hashes = sorted({sha256 for _, _, _, sha256 in entries})
+    for start in range(0, len(hashes), 500):
+        live.update(db.session.execute(
+            select(DocumentBlob.sha256).where(DocumentBlob.sha256.in_(hashes[start:start + 500]))
+        ).scalars())
+
+    removed = 0
+    kept = []
+    stale_before = time.time() - 3600
+    for mtime, size, path, sha256 in entries:
+        if os.path.basename(path).startswith('.tmp-'):
+            # Renders in progress are left alone; old ones were interrupted
+            if mtime < stale_before:
+                os.remove(path)
+                removed += 1
+        elif sha256 not in live:
+            os.remove(path)
+            removed += 1
+        else:
+            kept.append((mtime, size, path))
+
+    total = sum(size for _, size, _ in kept)
+    for mtime, size, path in sorted(kept):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        removed += 1
+        total -= size
+    return removed, total
@@ -0,0 +1,486 @@
+# File path: backend/restore.py
+
+from app import db
+from models import Transaction, Tag, TagGroup, Setting, Document, DocumentBlob, DailyBalance, ImportKey, transaction_tags
+from backup import read_backup_chain, read_json_entry, utc_now, DOCUMENTS_FOLDER_IN_ZIP
+from balances import rebuild_daily_balances
+from search import rebuild_search_index
+from suggestions import reset_model
+from catalog import bump_catalog_version
+from storage import spool_and_hash, blob_filename, move_into_place, remove_files
+from sqlalchemy import select, insert, delete, text
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+import decimal
+import io
+import json
+import os
+import threading
+import time
+import zipfile
+
+
+# Restore from backup archives (see backup.py for the format).
+#
+# A single full archive is read as a stream: transactions.json is decoded one
+# transaction at a time, so the ledger is never loaded as a whole. A chain (full
+# plus incrementals) is replayed with read_backup_chain() first. Rows are written
+# with executemany-style bulk INSERTs in dependency order - tag groups, tags,
+# transactions (a child waits until its parent is in), tag links - keeping the
+# original ids. Document files are then extracted into UPLOAD_FOLDER by a pool
+# of threads, each with its own handle on the archive, and stored as
+# content-addressed blobs (see storage.py).
+
+
+RESTORE_BATCH_SIZE = 5000
+JSON_READ_SIZE = 1024 * 1024
+DEFAULT_EXTRACT_WORKERS = 4
+
+
+
+# --- Streaming JSON ---
+
+
+
+def iter_json_array(binary_stream, read_size=JSON_READ_SIZE):
+    """
+    Yields the items of a top-level JSON array read from a binary stream,
+    decoding one item at a time. Raises ValueError on malformed input.
+    """
+    decoder = json.JSONDecoder()
+    text_stream = io.TextIOWrapper(binary_stream, encoding='utf-8-sig')
+    buffer = ''
+    position = 0
+    eof = False
+    started = False
+
+    def read_more():
+        nonlocal buffer, position, eof
+        chunk = text_stream.read(read_size)
+        buffer = buffer[position:] + chunk
+        position = 0
+        eof = not chunk
+
+    while True:
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) or eof:
+                break
+            read_more()
+
+        if position >= len(buffer):
+            raise ValueError("Unexpected end of JSON array.")
+        if not started:
+            if buffer[position] != '[':
+                raise ValueError("Expected a JSON array.")
+            started = True
+            position += 1
+            continue
+        if buffer[position] == ']':
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise ValueError("Invalid JSON in backup archive.")
+            read_more()
+            continue
+        yield item
+        position = end
+
+
+
+# --- Database Preparation ---
+
+
+
+def database_is_empty():
+    """True when there are no transactions, tags, tag groups or documents."""
+    for model in (Transaction, Tag, TagGroup, Document):
+        if db.session.execute(select(model.id).limit(1)).first() is not None:
+            return False
+    return True
+
+
+def clear_database():
+    """
+    Deletes every ledger row. Returns the filenames of the deleted document
+    files, to be removed from disk once the restore has been committed.
+    """
+    stored_filenames = list(db.session.execute(
+        select(Document.stored_filename).where(Document.blob_sha256.is_(None))
+    ).scalars())
+    stored_filenames.extend(db.session.execute(select(DocumentBlob.stored_filename)).scalars())
+    db.session.execute(delete(transaction_tags))
+    db.session.execute(delete(Document))
+    db.session.execute(delete(DocumentBlob))
+    db.session.execute(delete(ImportKey))
+    db.session.execute(delete(DailyBalance))
+    db.session.execute(delete(Transaction).where(Transaction.parent_id.isnot(None)))
+    db.session.execute(delete(Transaction))
+    db.session.execute(delete(Tag))
+    db.session.execute(delete(TagGroup))
+    db.session.execute(delete(Setting))
+    return stored_filenames
+
+
+def remove_stored_files(upload_folder, stored_filenames):
+    """Deletes stored document files from `upload_folder`, ignoring missing ones."""
+    for stored_filename in stored_filenames:
+        path = os.path.join(upload_folder, stored_filename)
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def reset_id_sequences():
+    """Moves PostgreSQL id sequences past the restored ids (SQLite needs nothing)."""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for model in (TagGroup, Tag, Transaction, Document, Setting):
+        table = model.__tablename__
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM \"{table}\"), 0) + 1, false)"
+        ))
+
+
+
+# --- Row Conversion ---
+
+
+
+def parse_timestamp(value, default=None):
+    """Parses an isoformat timestamp from the archive, or returns `default`."""
+    return datetime.fromisoformat(value) if value else default
+
+
+def transaction_row(tx, restored_at):
+    """Converts a transactions.json entry into a row for a bulk INSERT, keeping its timestamps."""
+    return {
+        'id': tx['id'],
+        'date': date.fromisoformat(tx['date']),
+        'amount': decimal.Decimal(str(tx['amount'])),
+        'description': tx.get('description'),
+        'note': tx.get('note'),
+        'children_flag': bool(tx.get('children_flag')),
+        'doc_flag': bool(tx.get('doc_flag')),
+        'parent_id': tx.get('parent_id'),
+        'created_at': parse_timestamp(tx.get('created_at'), restored_at),
+        'updated_at': parse_timestamp(tx.get('updated_at'), restored_at),
+    }
+
+
+
+class LedgerLoader:
+    """Collects restored rows and writes them in dependency order, in batches."""
+
+    def __init__(self, batch_size=RESTORE_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.restored_at = utc_now()
+        self.group_ids = set()
+        self.tag_ids = set()
+        self.inserted_ids = set()
+        self.pending_groups = []
+        self.pending_tags = []
+        self.ready = []
+        self.waiting_for_parent = {}
+        self.counts = {'tag_groups': 0, 'tags': 0, 'transactions': 0, 'tag_links': 0}
+
+    def add_tag_group(self, group):
+        if group['id'] not in self.group_ids:
+            self.group_ids.add(group['id'])
+            self.pending_groups.append({'id': group['id'], 'name': group['name']})
+
+    def add_tag(self, tag, group=None):
+        group = group or tag.get('tag_group')
+        if group is not None:
+            self.add_tag_group(group)
+        if tag['id'] not in self.tag_ids:
+            self.tag_ids.add(tag['id'])
+            self.pending_tags.append({
+                'id': tag['id'],
+                'name': tag['name'],
+                'color': tag.get('color'),
+                'tag_group_id': tag['tag_group_id'],
+            })
+
+    def add_transaction(self, tx):
+        for tag in tx.get('tags', []):
+            self.add_tag(tag)
+        entry = (transaction_row(tx, self.restored_at), [tag['id'] for tag in tx.get('tags', [])])
+        parent_id = entry[0]['parent_id']
+        if parent_id is None or parent_id in self.inserted_ids:
+            self.ready.append(entry)
+        else:
+            self.waiting_for_parent.setdefault(parent_id, []).append(entry)
+        if len(self.ready) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes pending tag groups, tags, then ready transactions and their tag links."""
+        if self.pending_groups:
+            db.session.execute(insert(TagGroup), self.pending_groups)
+            self.counts['tag_groups'] += len(self.pending_groups)
+            self.pending_groups = []
+        if self.pending_tags:
+            db.session.execute(insert(Tag), self.pending_tags)
+            self.counts['tags'] += len(self.pending_tags)
+            self.pending_tags = []
+
+        while self.ready:
+            batch, self.ready = self.ready, []
+            db.session.execute(insert(Transaction), [row for row, _ in batch])
+            links = [{'transaction_id': row['id'], 'tag_id': tag_id} for row, tag_ids in batch for tag_id in tag_ids]
+            if links:
+                db.session.execute(insert(transaction_tags), links)
+            self.counts['transactions'] += len(batch)
+            self.counts['tag_links'] += len(links)
+            for row, _ in batch:
+                self.inserted_ids.add(row['id'])
+                # Children that arrived before their parent can go in now
+                self.ready.extend(self.waiting_for_parent.pop(row['id'], []))
+
+    def finish(self):
+        self.flush()
+        if self.waiting_for_parent:
+            missing = sorted(self.waiting_for_parent)[:10]
+            raise ValueError(f"Backup references parent transactions that are not in it: {missing}")
+
+
+
+# --- Documents ---
+
+
+
+def extract_documents(documents, upload_folder, temp_paths, workers=DEFAULT_EXTRACT_WORKERS):
+    """
+    Copies document files out of their archives into temporary files in
+    `upload_folder` in parallel, hashing them on the way. `documents` is
+    {document_id: entry} with 'source' (an open ZipFile, or None when the
+    content is missing) and 'path'; an archive entry shared by several
+    documents is copied once. Every temporary file is appended to
+    `temp_paths` as soon as it is written, for the caller to remove if the
+    restore fails (even here, with other copies still running).
+    Returns ({document_id: sha256}, {sha256: (temp_path, size)}, bytes_written, missing_ids).
+    """
+    local = threading.local()
+    opened = []
+
+    def archive_handle(source):
+        # ZipFile reads share one file position; give every thread its own handle
+        handles = getattr(local, 'handles', None)
+        if handles is None:
+            handles = local.handles = {}
+        if source.filename not in handles:
+            handles[source.filename] = zipfile.ZipFile(source.filename)
+            opened.append(handles[source.filename])
+        return handles[source.filename]
+
+    def extract(key):
+        source, path = key
+        with archive_handle(source).open(path) as content:
+            temp_path, sha256, size = spool_and_hash(content, upload_folder)
+        temp_paths.append(temp_path)
+        return key, (temp_path, sha256, size)
+
+    entries = {}
+    for doc_id, entry in documents.items():
+        if entry['source'] is not None:
+            entries.setdefault((entry['source'], entry['path']), []).append(doc_id)
+    missing = sorted(doc_id for doc_id, entry in documents.items() if entry['source'] is None)
+    hashes = {}
+    incoming = {}
+    total_bytes = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for key, (temp_path, sha256, size) in executor.map(extract, entries):
+                total_bytes += size
+                for doc_id in entries[key]:
+                    hashes[doc_id] = sha256
+                if sha256 in incoming:
+                    os.remove(temp_path)
+                else:
+                    incoming[sha256] = (temp_path, size)
+    finally:
+        # The pool's threads are gone; their handles would otherwise stay open until collected
+        for handle in opened:
+            handle.close()
+    return hashes, incoming, total_bytes, missing
+
+
+def insert_documents(documents, hashes, incoming, restored_transaction_ids, upload_folder, created_paths):
+    """
+    Moves the extracted files into place as blobs and bulk inserts their
+    DocumentBlob rows and the Document rows pointing at them. Extracted files
+    no restored document refers to are dropped. Every blob file created is
+    appended to `created_paths`, for the caller to remove if the restore fails.
+    Returns (documents inserted, stored filenames of the blobs).
+    """
+    restored_at = utc_now()
+    rows = []
+    ref_counts = {}
+    extensions = {}
+    for doc_id, entry in sorted(documents.items()):
+        if doc_id not in hashes or entry['transaction_id'] not in restored_transaction_ids:
+            continue
+        sha256 = hashes[doc_id]
+        _, extension = os.path.splitext(entry['original_filename'])
+        extension = extension[1:].lower()
+        ref_counts[sha256] = ref_counts.get(sha256, 0) + 1
+        extensions.setdefault(sha256, extension)
+        rows.append({
+            'id': doc_id,
+            'original_filename': entry['original_filename'],
+            'mimetype': entry['mimetype'],
+            'transaction_id': entry['transaction_id'],
+            'blob_sha256': sha256,
+            'created_at': parse_timestamp(entry.get('created_at'), restored_at),
+        })
+
+    blob_rows = []
+    for sha256, (temp_path, size) in incoming.items():
+        if sha256 not in ref_counts:
+            os.remove(temp_path)
+            continue
+        stored_filename = blob_filename(sha256, extensions[sha256])
+        blob_path = os.path.join(upload_folder, stored_filename)
+        # A file left by the data being replaced already has this content
+        if os.path.exists(blob_path):
+            os.remove(temp_path)
+        else:
+            created_paths.append(move_into_place(temp_path, stored_filename, upload_folder))
+        blob_rows.append({'sha256': sha256, 'stored_filename': stored_filename, 'size': size,
+                          'ref_count': ref_counts[sha256], 'created_at': restored_at})
+
+    for start in range(0, len(blob_rows), RESTORE_BATCH_SIZE):
+        db.session.execute(insert(DocumentBlob), blob_rows[start:start + RESTORE_BATCH_SIZE])
+    for start in range(0, len(rows), RESTORE_BATCH_SIZE):
+        db.session.execute(insert(Document), rows[start:start + RESTORE_BATCH_SIZE])
+    return len(rows), {row['stored_filename'] for row in blob_rows}
+
+
+
+# --- Restore ---
+
+
+
+def open_restore_source(zip_archives):
+    """
+    Returns what to restore from open archives: a single full archive is
+    streamed, a chain is replayed with read_backup_chain(). Raises ValueError.
+    """
+    if len(zip_archives) > 1:
+        return read_backup_chain(zip_archives)
+
+    zip_archive = zip_archives[0]
+    names = set(zip_archive.namelist())
+    if 'transactions.json' not in names:
+        raise ValueError("Not a backup archive: transactions.json is missing.")
+    manifest = read_json_entry(zip_archive, 'manifest.json')
+    if manifest is not None and manifest['kind'] != 'full':
+        raise ValueError("An incremental backup cannot be restored on its own; include its whole chain.")
+
+    def transactions():
+        with zip_archive.open('transactions.json') as entry:
+            yield from iter_json_array(entry)
+
+    documents = None
+    if manifest is not None:
+        documents = {
+            int(doc_id): dict(entry, source=zip_archive if entry['path'] in names else None)
+            for doc_id, entry in manifest['documents'].items()
+        }
+    return {
+        'manifest': manifest,
+        'transactions': transactions(),
+        'tag_groups': read_json_entry(zip_archive, 'tags.json'),
+        'settings': read_json_entry(zip_archive, 'settings.json'),
+        'documents': documents,
+    }
+
+
+def restore_backup(zip_archives, upload_folder, replace=False, workers=DEFAULT_EXTRACT_WORKERS):
+    """
+    Loads backup archives (one full archive, or a full one plus its
+    incrementals) into the database and `upload_folder`, in one DB transaction.
+    Refuses to run on a non-empty database unless `replace` is set.
+    Returns a report with row counts and throughput. Raises ValueError.
+    """
+    started = time.perf_counter()
+    replaced_files = []
+    if not database_is_empty():
+        if not replace:
+            raise ValueError("The database is not empty. Pass replace to overwrite it.")
+        replaced_files = clear_database()
+
+    source = open_restore_source(zip_archives)
+    loader = LedgerLoader()
+    for group in source['tag_groups'] or []:
+        for tag in group.get('tags', []):
+            loader.add_tag(tag, group=group)
+        loader.add_tag_group(group)
+
+    documents = source['documents']
+    collect_documents = documents is None
+    if collect_documents:
+        # Archives without a manifest list documents inside transactions.json
+        documents = {}
+        names = set(zip_archives[0].namelist())
+    for tx in source['transactions']:
+        if collect_documents:
+            for doc in tx.get('documents', []):
+                path = f"{DOCUMENTS_FOLDER_IN_ZIP}{doc['backup_filename']}"
+                documents[doc['id']] = {
+                    'transaction_id': tx['id'],
+                    'original_filename': doc['original_filename'],
+                    'mimetype': doc['mimetype'],
+                    'created_at': doc.get('created_at'),
+                    'path': path,
+                    'source': zip_archives[0] if path in names else None,
+                }
+        loader.add_transaction(tx)
+    loader.finish()
+    rows_done = time.perf_counter()
+
+    settings = source['settings'] or []
+    if settings:
+        db.session.execute(insert(Setting), [
+            {'id': setting['id'], 'key': setting['key'],
+             'value': decimal.Decimal(setting['value']) if setting['value'] is not None else None}
+            for setting in settings
+        ])
+
+    os.makedirs(upload_folder, exist_ok=True)
+    temp_paths = []
+    created_paths = []
+    try:
+        hashes, incoming, bytes_written, missing = extract_documents(documents, upload_folder, temp_paths, workers)
+        restored_documents, blob_files = insert_documents(
+            documents, hashes, incoming, loader.inserted_ids, upload_folder, created_paths)
+        rebuild_daily_balances()
+        rebuild_search_index()
+        reset_id_sequences()
+        bump_catalog_version()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        remove_files(created_paths + temp_paths)
+        raise
+    reset_model() # Restored rows keep their old updated_at, so retrain from scratch
+    # Blobs whose content came back keep their file
+    remove_stored_files(upload_folder, [name for name in replaced_files if name not in blob_files])
+
+    elapsed = time.perf_counter() - started
+    rows_elapsed = rows_done - started
+    return dict(
+        loader.counts,
+        settings=len(settings),
+        documents=restored_documents,
+        missing_documents=missing,
+        document_bytes=bytes_written,
+        seconds=round(elapsed, 3),
+        transactions_per_second=round(loader.counts['transactions'] / rows_elapsed) if rows_elapsed > 0 else None,
+        document_megabytes_per_second=round(bytes_written / 2**20 / (elapsed - rows_elapsed), 2) if elapsed > rows_elapsed and bytes_written else None,
+    )
@@ -1,23 +1,59 @@
 # File path: backend/routes.py
 
 from app import app, db
-from flask import request, jsonify, abort, send_from_directory, current_app, send_file
-from models import Transaction, Tag, TagGroup, Setting, Document
+from flask import request, jsonify, abort, send_from_directory, current_app, send_file, Response, stream_with_context
+from models import Transaction, Tag, TagGroup, Setting, Document, Backup, UploadSession, CategorizationRule, Job, transaction_tags
+from filters import (apply_transaction_filters, apply_keyset_order, parse_page_size, parse_sort_order, parse_date_arg, parse_bool_arg,
+                     parse_amount_arg, encode_cursor)
+from serializers import serialize_transactions, transaction_load_options
+from importing import (
+    parse_amount, parse_statement_rows, find_duplicates, validate_bulk_rows, create_transactions_bulk,
+    import_statement_rows,
+    MAX_DATE_WINDOW_DAYS, MAX_BULK_ROWS, IMPORT_CHUNK_SIZE,
+)
+from statements import parse_import_options, parse_positive_int_option, iter_statement_rows
+from backup import iter_backup_archive, touch_tagged_transactions
+from restore import restore_backup, database_is_empty, DEFAULT_EXTRACT_WORKERS
+from storage import (store_upload, discard_uncommitted_blob, release_documents, remove_released_files, remove_files,
+                     family_documents, documents_with_content, document_storage_name, start_layout_migration,
+                     layout_migration_status, append_chunk, complete_upload, discard_upload, expire_upload_sessions,
+                     sync_received_size, upload_extension, document_file_path, UploadConflict, LAYOUT_BATCH_SIZE,
+                     UPLOAD_CHUNK_SIZE)
+from previews import schedule_previews, get_preview, PREVIEW_SIZES
+from search import reindex_transactions, rebuild_search_index, search_transactions
+from rules import get_matcher, invalidate_matcher, parse_rule_fields, delete_rules_for_tags, apply_rules
+from catalog import catalog_response, bump_catalog_version
+from splits import parse_split_request, split_transaction_children, merge_children
+from jobs import submit_job, cancel_job, job_json, maintain_jobs, job_file_path
+from suggestions import suggest_tags, suggest_tags_batch, reset_model, DEFAULT_SUGGESTION_LIMIT, DEFAULT_MIN_CONFIDENCE
+from balances import (
+    get_initial_balance, balance_before, balance_at, ledger_daily_balances, ledger_total, final_running_balance,
+    filtered_daily_sums, family_root_id, family_contributions, apply_contribution_deltas,
+)
 from datetime import datetime
+from sqlalchemy import select, func, update, delete, insert, or_, true
+from sqlalchemy.orm import selectinload, joinedload
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 import decimal
-from werkzeug.exceptions import HTTPException
+from werkzeug.exceptions import HTTPException, NotFound
+from werkzeug.datastructures import MultiDict
 import os
 import traceback
 from werkzeug.utils import secure_filename # For sanitizing filenames
 import uuid # For generating unique filenames
-import io # For in-memory file handling
-import zipfile # For creating ZIP archives
-import json # Standard json library, ensure it's imported if not already
+import contextlib
+import mimetypes
+import re
+import tempfile
+import time
+import zipfile
 
 
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'doc', 'docx', 'xls', 'xlsx', 'csv'}
 
+MIMETYPE_RE = re.compile(r'[\w.+-]+/[\w.+-]+')
+BULK_TAG_CHUNK_SIZE = 500 # Transaction ids per statement of a bulk tag update
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -59,12 +95,9 @@ def create_transaction():
             abort(400, description="Invalid date format. Use YYYY-MM-DD.")
 
         try:
-            amount_str = str(data['amount'])
-            if ',' in amount_str:
-                amount_str = amount_str.replace(',', '.')
-            parsed_amount = decimal.Decimal(amount_str)
-        except (decimal.InvalidOperation, TypeError, ValueError):
-             abort(400, description="Invalid amount format.")
+            parsed_amount = parse_amount(data['amount'])
+        except ValueError as e:
+            abort(400, description=str(e))
 
         description = data.get('description')
         note = data.get('note', '')
@@ -99,6 +132,9 @@ def create_transaction():
             new_transaction.tags.extend(tags)
 
         db.session.add(new_transaction)
+        db.session.flush()
+        apply_contribution_deltas({}, family_contributions(new_transaction.id))
+        reindex_transactions([new_transaction.id])
         db.session.commit()
 
         return jsonify(new_transaction.to_json(include_tags=True, include_documents=True)), 201
@@ -119,33 +155,192 @@ def create_transaction():
 
 
 
-# Get all transactions
+# Create many transactions at once
+# Body: {"transactions": [{"date", "amount", "description", "note", "tag_ids", "idempotency_key"}, ...],
+#        "atomic": true, "chunk_size": null, "apply_rules": true}
+# The whole batch is validated first. With "atomic" (default) any invalid row rejects
+# the batch with 400; otherwise invalid rows are reported and the valid ones inserted.
+# Rows are inserted in bulk in one DB transaction, or committed per "chunk_size" rows.
+# With "apply_rules" (default) the categorization rules add their tags to new rows.
+@app.route('/api/transactions/bulk', methods=['POST'])
+def create_transactions_bulk_route():
+    data = request.get_json()
+    if not isinstance(data, dict) or not isinstance(data.get('transactions'), list):
+        abort(400, description="Expected an object with a 'transactions' list.")
+
+    rows = data['transactions']
+    if len(rows) > MAX_BULK_ROWS:
+        abort(400, description=f"A bulk request cannot exceed {MAX_BULK_ROWS} transactions.")
+
+    atomic = data.get('atomic', True)
+    if not isinstance(atomic, bool):
+        abort(400, description="'atomic' must be a boolean.")
+
+    chunk_size = data.get('chunk_size')
+    if chunk_size is not None:
+        try:
+            chunk_size = int(chunk_size)
+        except (ValueError, TypeError):
+            abort(400, description="'chunk_size' must be a valid integer.")
+        if chunk_size <= 0:
+            abort(400, description="'chunk_size' must be a positive integer.")
+        if atomic:
+            abort(400, description="'chunk_size' cannot be combined with 'atomic'.")
+
+    use_rules = data.get('apply_rules', True)
+    if not isinstance(use_rules, bool):
+        abort(400, description="'apply_rules' must be a boolean.")
+
+    try:
+        validated_rows = validate_bulk_rows(rows)
+        invalid = [{'index': index, 'status': 'error', 'transaction_id': None, 'error': error}
+                   for index, parsed, error in validated_rows if parsed is None]
+        if atomic and invalid:
+            db.session.rollback()
+            return jsonify({
+                "error": f"{len(invalid)} row(s) failed validation. Nothing was imported.",
+                "results": invalid,
+            }), 400
+
+        results = create_transactions_bulk(validated_rows, chunk_size=chunk_size,
+                                           matcher=get_matcher() if use_rules else None)
+        counts = {status: sum(1 for r in results if r['status'] == status) for status in ('created', 'existing', 'error')}
+        return jsonify({
+            'created': counts['created'],
+            'existing': counts['existing'],
+            'failed': counts['error'],
+            'results': results,
+        }), 201 if counts['created'] else 200
+
+    except HTTPException as e:
+        raise e
+    except IntegrityError as e:
+        db.session.rollback()
+        app.logger.error(f"Integrity error in bulk transaction create: {e}", exc_info=True)
+        abort(409, description="A database constraint was violated. An idempotency key may have been imported concurrently.")
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Database error in bulk transaction create: {e}", exc_info=True)
+        abort(500, description="A database error occurred while creating the transactions.")
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Unexpected error in bulk transaction create: {e}", exc_info=True)
+        abort(500, description="An unexpected error occurred while creating the transactions.")
+
+
+
+# Get transactions
+# Without 'limit'/'cursor' the whole (filtered) ledger is returned as a list, as before.
+# With them, a keyset-paginated page is returned:
+#   {"transactions": [...], "next_cursor": "...", "has_more": true}
+# Filters are documented in filters.apply_transaction_filters.
 @app.route('/api/transactions', methods=['GET'])
 def get_transactions():
     try:
-        # The frontend will handle grouping children under parents using parent_id.
-        # Default sort order by date desc.
-        transactions = Transaction.query.order_by(Transaction.date.desc(), Transaction.id.asc()).all()
-        return jsonify([transaction.to_json(include_tags=True, include_documents=True) for transaction in transactions])
+        query = apply_transaction_filters(Transaction.query, request.args)
+
+        # Both forms use the keyset (date, id) order, so a filter lists the same rows
+        # in the same order with or without pagination
+        order = parse_sort_order(request.args.get('order'))
+        paginate = 'limit' in request.args or 'cursor' in request.args
+        if not paginate:
+            # The frontend will handle grouping children under parents using parent_id.
+            query = apply_keyset_order(query, order)
+            return jsonify(serialize_transactions(query, include_tags=True, include_documents=True))
+
+        limit = parse_page_size(request.args.get('limit'))
+        query = apply_keyset_order(query, order, request.args.get('cursor'))
+
+        # Fetch one extra row to know whether another page exists
+        transactions = serialize_transactions(query.limit(limit + 1), include_tags=True, include_documents=True)
+        has_more = len(transactions) > limit
+        transactions = transactions[:limit]
+
+        return jsonify({
+            'transactions': transactions,
+            'next_cursor': encode_cursor(transactions[-1]['date'], transactions[-1]['id']) if has_more else None,
+            'has_more': has_more,
+        })
+    except HTTPException as e:
+        raise e
     except Exception as e:
         app.logger.error(f"Error getting transactions: {e}", exc_info=True)
         abort(500, description="An error occurred while retrieving transactions.")
 
 
 
+# Full-text search over descriptions, notes and document names
+# GET /api/transactions/search?q=<words>&page=1&limit=50 (plus any list filter)
+#   {"query", "total", "page", "limit", "has_more",
+#    "results": [{"transaction": {...}, "rank", "highlights": {"description", "note", "documents"}}]}
+# Results are best match first; every word must match, the last one as a prefix.
+# Highlights are HTML-escaped text with matches wrapped in <mark>.
+@app.route('/api/transactions/search', methods=['GET'])
+def search_transactions_route():
+    query_text = request.args.get('q', '').strip()
+    if not query_text:
+        abort(400, description="Missing 'q' query parameter.")
+    limit = parse_page_size(request.args.get('limit'))
+    page = parse_positive_int_option(request.args, 'page', default=1)
+    try:
+        hits, total = search_transactions(query_text, request.args, limit, (page - 1) * limit)
+        ids = [hit['transaction_id'] for hit in hits]
+        transactions = {
+            tx['id']: tx
+            for tx in serialize_transactions(Transaction.query.filter(Transaction.id.in_(ids)), include_tags=True, include_documents=True)
+        }
+        return jsonify({
+            'query': query_text,
+            'total': total,
+            'page': page,
+            'limit': limit,
+            'has_more': page * limit < total,
+            'results': [
+                {'transaction': transactions[hit['transaction_id']], 'rank': hit['rank'], 'highlights': hit['highlights']}
+                for hit in hits if hit['transaction_id'] in transactions
+            ],
+        }), 200
+    except HTTPException as e:
+        raise e
+    except SQLAlchemyError as e:
+        app.logger.error(f"Database error searching transactions: {e}", exc_info=True)
+        abort(500, description="A database error occurred while searching transactions.")
+
+
+
 # Get transaction by ID
 @app.route('/api/transactions/view/<int:transaction_id>', methods=['GET'])
 def view_transaction(transaction_id):
-    transaction = Transaction.query.get_or_404(transaction_id, description=f"Transaction {transaction_id} not found")
+    transaction = Transaction.query.options(*transaction_load_options()).get_or_404(transaction_id, description=f"Transaction {transaction_id} not found")
     return jsonify(transaction.to_json(include_tags=True, include_documents=True))
 
 
 
+def split_response(parent, status_code):
+    children_query = Transaction.query.filter(Transaction.parent_id == parent.id).order_by(Transaction.id.asc())
+    children = serialize_transactions(children_query, include_tags=True, include_documents=True)
+    allocated = sum((decimal.Decimal(child['amount']) for child in children), decimal.Decimal('0.00'))
+    return jsonify({
+        "parent": parent.to_json(include_tags=True, include_documents=True),
+        "children": children,
+        "unallocated": str(parent.amount - allocated),
+    }), status_code
+
+
 # Splitting Transaction
+# Body: {"num_children": n} creates n zero-amount children, as before, or, in one commit,
+# {"allocation": "amounts" | "percentages" | "equal", "children": [
+#     {"amount": "-12.50" | "percentage": 25, "description": "...", "note": "...", "tag_ids": [...]}, ...],
+#  "replace": false}
+# (see splits.py). Children left without a description, note or tags take the parent's.
+# An entry with the "id" of a current child re-allocates that child instead of creating
+# one; with "replace": true the current children missing from the list are merged back.
+# {"num_children": n, "allocation": "equal"} shares the amount among n new children.
+# The response holds the parent, all its children and the amount left on the parent.
 @app.route('/api/transactions/<int:transaction_id>/split', methods=['POST'])
 def split_transaction(transaction_id):
     try:
-        parent_transaction = Transaction.query.get(transaction_id)
+        parent_transaction = db.session.get(Transaction, transaction_id)
         if not parent_transaction:
             abort(404, description=f"Transaction {transaction_id} not found.")
 
@@ -153,46 +348,16 @@ def split_transaction(transaction_id):
         if parent_transaction.parent_id is not None:
             abort(400, description="Cannot split a child transaction. Only parent or non-split transactions can be split.")
 
-        data = request.get_json()
-        if not data or 'num_children' not in data:
-            abort(400, description="Missing 'num_children' in request body.")
-
-        try:
-            num_children = int(data['num_children'])
-            if num_children <= 0:
-                abort(400, description="'num_children' must be a positive integer.")
-            if num_children > 20: # Arbitrary limit for sanity
-                abort(400, description="'num_children' cannot exceed 20 for a single split operation.")
-        except (ValueError, TypeError):
-            abort(400, description="'num_children' must be a valid integer.")
+        allocation, children, replace = parse_split_request(request.get_json(silent=True))
 
-        # Mark parent as having children (this is idempotent if already true)
-        parent_transaction.children_flag = True
-        
-        new_child_transactions = []
-        inherited_tags = list(parent_transaction.tags)
-        for _ in range(num_children):
-            # Create new sub-transaction
-            child_transaction = Transaction(
-                parent_id=parent_transaction.id,
-                date=parent_transaction.date,               # Inherit date
-                description='Sub-item: ' + parent_transaction.description, # Inherit description
-                note=parent_transaction.note,               # Inherit note
-                amount=decimal.Decimal('0.00'),             # Initialize amount to 0
-                tags=inherited_tags,                        # Inherit tags by associating same Tag objects
-                children_flag=False,                        # Children cannot be parents themselves initially
-                doc_flag=False                              # doc_flag not specified to be inherited, defaults to False
-            )
-            db.session.add(child_transaction)
-            new_child_transactions.append(child_transaction)
-        
-        parent_transaction.tags = [] # Delete tags from the original (parent) transaction
+        balances_before = family_contributions(parent_transaction.id)
+        updated, created_ids, merged_ids = split_transaction_children(parent_transaction, allocation, children, replace=replace)
+        apply_contribution_deltas(balances_before, family_contributions(parent_transaction.id))
+        # Merged children's documents now belong to the parent, whose index row lists them
+        reindex_transactions([child.id for child in updated] + merged_ids + ([parent_transaction.id] if merged_ids else []))
         db.session.commit()
 
-        return jsonify({
-            "parent": parent_transaction.to_json(include_tags=True, include_documents=True),
-            "children": [child.to_json(include_tags=True, include_documents=True) for child in new_child_transactions]
-        }), 201
+        return split_response(parent_transaction, 201 if created_ids else 200)
 
     except HTTPException as e:
         db.session.rollback() # Ensure rollback for aborts if they don't automatically
@@ -208,6 +373,50 @@ def split_transaction(transaction_id):
 
 
 
+# Merge children of a split back into their parent
+# Body (optional): {"child_ids": [...]}, default every child. Their amounts return to
+# the parent's unallocated rest and their documents move to the parent. Once no child
+# is left the parent is a regular transaction again, with the tags its children had.
+@app.route('/api/transactions/<int:transaction_id>/merge', methods=['POST'])
+def merge_transaction_children(transaction_id):
+    try:
+        parent_transaction = db.session.get(Transaction, transaction_id)
+        if not parent_transaction:
+            abort(404, description=f"Transaction {transaction_id} not found.")
+        if not parent_transaction.children:
+            abort(400, description=f"Transaction {transaction_id} has no children to merge.")
+
+        data = request.get_json(silent=True) or {}
+        current = {child.id: child for child in parent_transaction.children}
+        child_ids = data.get('child_ids', list(current))
+        if not isinstance(child_ids, list) or not child_ids or not all(isinstance(child_id, int) for child_id in child_ids):
+            abort(400, description="'child_ids' must be a non-empty list of integers.")
+        unknown = sorted(set(child_ids) - set(current))
+        if unknown:
+            abort(400, description=f"Transactions {', '.join(map(str, unknown))} are not children of transaction {transaction_id}.")
+
+        balances_before = family_contributions(parent_transaction.id)
+        merged_ids = merge_children(parent_transaction, [current[child_id] for child_id in dict.fromkeys(child_ids)])
+        apply_contribution_deltas(balances_before, family_contributions(parent_transaction.id))
+        reindex_transactions(merged_ids + [parent_transaction.id])
+        db.session.commit()
+
+        return split_response(parent_transaction, 200)
+
+    except HTTPException as e:
+        db.session.rollback()
+        raise e
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Database error merging the children of transaction {transaction_id}: {e}", exc_info=True)
+        abort(500, description="A database error occurred while merging the children.")
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Unexpected error merging the children of transaction {transaction_id}: {e}", exc_info=True)
+        abort(500, description="An unexpected error occurred while merging the children.")
+
+
+
 # Delete a transaction
 @app.route('/api/transactions/delete/<int:transaction_id>', methods=['DELETE'])
 def delete_transaction(transaction_id):
@@ -216,24 +425,15 @@ def delete_transaction(transaction_id):
         transaction_to_delete = db.session.get(Transaction, transaction_id) 
         if not transaction_to_delete:
             abort(404, description=f"Transaction {transaction_id} not found")
+
+        root_id = family_root_id(transaction_to_delete)
+        balances_before = family_contributions(root_id)
         
-        # If deleting a parent transaction, its documents (and children's documents via cascade)
-        # will be deleted.
-        # If deleting a child, only its documents are deleted.
-        # The actual file deletion for documents will be handled by Document model's cascade or 
-        # manual cleanup if not.
-        # For now, assuming SQLAlchemy cascade handles Document records, and we'll add explicit 
-        # file deletion later in document delete route.
-
-        # Clean up associated document files if transaction is deleted
-        for doc in transaction_to_delete.documents:
-            try:
-                doc_path = os.path.join(app.config['UPLOAD_FOLDER'], doc.stored_filename)
-                if os.path.exists(doc_path):
-                    os.remove(doc_path)
-            except Exception as file_e:
-                app.logger.error(f"Error deleting file {doc.stored_filename} for transaction {transaction_id}: {file_e}")
-                # Continue deleting transaction even if a file can't be removed
+        # Documents of the transaction and of its children go with it (cascade)
+        documents = family_documents(transaction_to_delete)
+        deleted_ids = [transaction_id] + list(db.session.execute(
+            select(Transaction.id).where(Transaction.parent_id == transaction_id)
+        ).scalars())
 
         # Check if the transaction to delete is a child and if it's the last one
         if transaction_to_delete.parent_id is not None:
@@ -251,7 +451,12 @@ def delete_transaction(transaction_id):
                     db.session.add(parent) 
 
         db.session.delete(transaction_to_delete)
+        apply_contribution_deltas(balances_before, family_contributions(root_id))
+        # Their files go only with the last reference, after the commit
+        released_files = release_documents(documents)
+        reindex_transactions(deleted_ids)
         db.session.commit()
+        remove_released_files(released_files)
         return jsonify({'message': 'Transaction deleted successfully'}), 200
     
     except HTTPException as e: 
@@ -279,6 +484,9 @@ def update_transaction(transaction_id):
         if not data:
             abort(400, description="Missing request body.")
 
+        root_id = family_root_id(transaction)
+        balances_before = family_contributions(root_id)
+
         if 'date' in data:
             try:
                 transaction.date = datetime.strptime(data['date'], '%Y-%m-%d').date()
@@ -287,12 +495,9 @@ def update_transaction(transaction_id):
         
         if 'amount' in data:
             try:
-                amount_str = str(data['amount'])
-                if ',' in amount_str:
-                    amount_str = amount_str.replace(',', '.')
-                transaction.amount = decimal.Decimal(amount_str)
-            except (decimal.InvalidOperation, TypeError, ValueError):
-                abort(400, description="Invalid amount format.")
+                transaction.amount = parse_amount(data['amount'])
+            except ValueError as e:
+                abort(400, description=str(e))
 
         if 'description' in data:
             transaction.description = data.get('description')
@@ -312,6 +517,9 @@ def update_transaction(transaction_id):
             else:
                 abort(400, description="'doc_flag' must be a boolean.")
         
+        apply_contribution_deltas(balances_before, family_contributions(root_id))
+        if 'description' in data or 'note' in data:
+            reindex_transactions([transaction.id])
         db.session.commit()
 
         return jsonify(transaction.to_json(include_tags=True, include_documents=True)), 200
@@ -329,51 +537,205 @@ def update_transaction(transaction_id):
 
 
 
+# Bulk duplicate check
+# Body is either a plain list of rows ({"Date", "Amount", "Description"}), answered
+# with a list of booleans as before, or an object:
+#   {"transactions": [...], "normalize_description": false, "date_window_days": 0}
+# answered with per-row results that include the matching transaction id.
 @app.route('/api/transactions/check-duplicates-bulk', methods=['POST'])
 def check_transactions_duplicates_bulk():
-    incoming_transactions = request.get_json()
+    data = request.get_json()
+    detailed = isinstance(data, dict)
+    incoming_transactions = data.get('transactions') if detailed else data
     if not isinstance(incoming_transactions, list):
         abort(400, description="Expected a list of transactions.")
 
-    results = []
-    for tx_data in incoming_transactions:
-        date_str = tx_data.get('Date')
-        amount_str = tx_data.get('Amount')
-        description = tx_data.get('Description')
-
-        if not date_str or amount_str is None:
-            results.append(False)
-            continue
-        
+    normalize = False
+    date_window_days = 0
+    if detailed:
+        normalize = data.get('normalize_description', False)
+        if not isinstance(normalize, bool):
+            abort(400, description="'normalize_description' must be a boolean.")
         try:
-            parsed_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+            date_window_days = int(data.get('date_window_days', 0))
         except (ValueError, TypeError):
-            results.append(False) 
-            continue
+            abort(400, description="'date_window_days' must be a valid integer.")
+        if date_window_days < 0 or date_window_days > MAX_DATE_WINDOW_DAYS:
+            abort(400, description=f"'date_window_days' must be between 0 and {MAX_DATE_WINDOW_DAYS}.")
 
-        try:
-            current_amount_str = str(amount_str)
-            if ',' in current_amount_str:
-                current_amount_str = current_amount_str.replace(',', '.')
-            parsed_amount = decimal.Decimal(current_amount_str)
-        except (decimal.InvalidOperation, TypeError, ValueError):
-            results.append(False)
-            continue
-        
-        query_description = description if description is not None else None
+    # Validate the whole batch up front, then resolve every match in one join
+    parsed_rows = parse_statement_rows(incoming_transactions)
+    try:
+        matches = find_duplicates(parsed_rows, normalize=normalize, date_window_days=date_window_days)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Database error during bulk duplicate check: {e}", exc_info=True)
+        abort(500, description="A database error occurred while checking for duplicates.")
+
+    if not detailed:
+        return jsonify([index in matches for index, _, _ in parsed_rows]), 200
+
+    results = [
+        {
+            'index': index,
+            'duplicate': index in matches,
+            'matched_transaction_id': matches.get(index),
+            'error': error,
+        }
+        for index, _, error in parsed_rows
+    ]
+    return jsonify({
+        'results': results,
+        'duplicates': len(matches),
+        'invalid': sum(1 for _, parsed, _ in parsed_rows if parsed is None),
+    }), 200
+
+
+
+# Import a CSV or OFX statement parsed on the server
+# Send the file as multipart 'file' (or as the raw request body) with the options
+# of statements.parse_import_options plus "skip_duplicates" (default true),
+# "normalize_description", "date_window_days", "atomic" (default false), "chunk_size"
+# and "apply_rules" (default true) as form fields or query arguments. The file is parsed as a stream
+# and imported chunk by chunk; the response is a summary with the first errors.
+# A file that cannot be read past some row answers 400 with the summary of what
+# was imported before it and its 'error'.
+def statement_upload():
+    """The statement file of the request (multipart 'file' or raw body) as (stream, filename)."""
+    upload = request.files.get('file')
+    if upload is not None:
+        return upload.stream, upload.filename
+    if request.content_length:
+        return request.stream, request.values.get('filename')
+    abort(400, description="No statement file provided.")
+
+
+def parse_statement_import_args(values, filename):
+    """Reads the statement import arguments of `values`, aborting with 400 on bad input."""
+    options = parse_import_options(values, filename)
+    skip_duplicates = True
+    if values.get('skip_duplicates'):
+        skip_duplicates = parse_bool_arg(values['skip_duplicates'], 'skip_duplicates')
+    normalize = False
+    if values.get('normalize_description'):
+        normalize = parse_bool_arg(values['normalize_description'], 'normalize_description')
+    atomic = False
+    if values.get('atomic'):
+        atomic = parse_bool_arg(values['atomic'], 'atomic')
+    use_rules = True
+    if values.get('apply_rules'):
+        use_rules = parse_bool_arg(values['apply_rules'], 'apply_rules')
+    chunk_size = parse_positive_int_option(values, 'chunk_size', default=IMPORT_CHUNK_SIZE)
+    chunk_size = min(chunk_size, MAX_BULK_ROWS)
+    try:
+        date_window_days = int(values.get('date_window_days') or 0)
+    except ValueError:
+        abort(400, description="'date_window_days' must be a valid integer.")
+    if date_window_days < 0 or date_window_days > MAX_DATE_WINDOW_DAYS:
+        abort(400, description=f"'date_window_days' must be between 0 and {MAX_DATE_WINDOW_DAYS}.")
+    return {
+        'options': options,
+        'skip_duplicates': skip_duplicates,
+        'normalize': normalize,
+        'atomic': atomic,
+        'apply_rules': use_rules,
+        'chunk_size': chunk_size,
+        'date_window_days': date_window_days,
+    }
+
+
+@app.route('/api/transactions/import', methods=['POST'])
+def import_statement():
+    stream, filename = statement_upload()
+    args = parse_statement_import_args(request.values, filename)
 
-        try:
-            existing_transaction = db.session.query(Transaction).filter(
-                Transaction.date == parsed_date,
-                Transaction.amount == parsed_amount,
-                Transaction.description == query_description
-            ).first()
-            results.append(existing_transaction is not None)
-        except Exception as e:
-            app.logger.error(f"Error during duplicate check query for {tx_data}: {e}")
-            results.append(False)
-            
-    return jsonify(results), 200
+    try:
+        summary = import_statement_rows(
+            iter_statement_rows(stream, args['options']),
+            chunk_size=args['chunk_size'],
+            skip_duplicates=args['skip_duplicates'],
+            normalize=args['normalize'],
+            date_window_days=args['date_window_days'],
+            atomic=args['atomic'],
+            matcher=get_matcher() if args['apply_rules'] else None,
+        )
+        if summary['error']:
+            # Unreadable past some row: the summary tells what was imported before it
+            return jsonify(summary), 400
+        return jsonify(summary), 201 if summary['created'] else 200
+
+    except HTTPException as e:
+        raise e
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Database error during statement import: {e}", exc_info=True)
+        abort(500, description="A database error occurred while importing the statement.")
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Unexpected error during statement import: {e}", exc_info=True)
+        abort(500, description="An unexpected error occurred while importing the statement.")
+
+
+
+# Daily sums and end-of-day balances
+# Accepts the same filters as GET /api/transactions. 'sum' and 'count' cover the
+# filtered transactions of each day; 'balance' is always the end-of-day balance
+# of the whole ledger (initial_balance + every effective amount up to that day).
+@app.route('/api/transactions/daily-balances', methods=['GET'])
+def get_daily_balances():
+    try:
+        start_date = parse_date_arg(request.args['start_date'], 'start_date') if request.args.get('start_date') else None
+        end_date = parse_date_arg(request.args['end_date'], 'end_date') if request.args.get('end_date') else None
+
+        initial_balance = get_initial_balance()
+        ledger_days = ledger_daily_balances(start_date, end_date, initial_balance)
+        opening_balance = balance_before(start_date, initial_balance)
+
+        days = []
+        for day, day_sum, day_count in filtered_daily_sums(request.args):
+            _, day_balance = ledger_days.get(day, (None, opening_balance))
+            days.append({
+                'date': day.isoformat(),
+                'sum': str(day_sum),
+                'count': day_count,
+                'balance': str(day_balance),
+            })
+
+        closing_balance = opening_balance + sum((day_sum for day_sum, _ in ledger_days.values()), decimal.Decimal('0.00'))
+
+        return jsonify({
+            'initial_balance': str(initial_balance),
+            'opening_balance': str(opening_balance),
+            'closing_balance': str(closing_balance),
+            'final_balance': str(initial_balance + ledger_total()),
+            'days': days,
+        }), 200
+
+    except HTTPException as e:
+        raise e
+    except SQLAlchemyError as e:
+        app.logger.error(f"Database error computing daily balances: {e}", exc_info=True)
+        abort(500, description="A database error occurred while computing daily balances.")
+    except Exception as e:
+        app.logger.error(f"Unexpected error computing daily balances: {e}", exc_info=True)
+        abort(500, description="An unexpected error occurred while computing daily balances.")
+
+
+
+# End-of-day balance for a single date (defaults to the last day of the ledger)
+@app.route('/api/transactions/balance', methods=['GET'])
+def get_balance():
+    try:
+        initial_balance = get_initial_balance()
+        if request.args.get('date'):
+            day = parse_date_arg(request.args['date'], 'date')
+            return jsonify({'date': day.isoformat(), 'balance': str(balance_at(day, initial_balance))}), 200
+        return jsonify({'date': None, 'balance': str(initial_balance + ledger_total())}), 200
+    except HTTPException as e:
+        raise e
+    except SQLAlchemyError as e:
+        app.logger.error(f"Database error retrieving balance: {e}", exc_info=True)
+        abort(500, description="A database error occurred while retrieving the balance.")
 
 
 
@@ -396,45 +758,84 @@ def upload_document(transaction_id):
     if file and allowed_file(file.filename):
         original_filename = secure_filename(file.filename) # Sanitize original filename for safety
         file_ext = original_filename.rsplit('.', 1)[1].lower() if '.' in original_filename else ''
-        stored_filename = f"{uuid.uuid4()}.{file_ext}"
-        
+
+        blob = None
         try:
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], stored_filename)
-            file.save(filepath)
+            # Hashed while streamed to disk; identical content is kept only once
+            blob = store_upload(file.stream, file_ext)
 
             new_document = Document(
                 original_filename=original_filename,
-                stored_filename=stored_filename,
                 mimetype=file.mimetype,
-                transaction_id=transaction.id
+                transaction_id=transaction.id,
+                blob_sha256=blob.sha256,
             )
             db.session.add(new_document)
             
             if not transaction.doc_flag:
                 transaction.doc_flag = True
-            
+
+            reindex_transactions([transaction.id])
             db.session.commit()
-            return jsonify(new_document.to_json()), 201
+            schedule_previews(new_document, document_file_path(new_document))
+            response = new_document.to_json()
+            response['duplicates'] = [
+                {'document_id': doc.id, 'transaction_id': doc.transaction_id, 'original_filename': doc.original_filename}
+                for doc in documents_with_content(blob.sha256, exclude_document_id=new_document.id)
+            ]
+            return jsonify(response), 201
         except Exception as e:
+            blob_key = (blob.sha256, blob.stored_filename) if blob is not None else None
             db.session.rollback()
-            # Attempt to delete partially saved file if error occurs after save but before commit
-            if 'filepath' in locals() and os.path.exists(filepath):
-                try:
-                    os.remove(filepath)
-                except Exception as file_del_err:
-                    app.logger.error(f"Error cleaning up file {filepath} after upload error: {file_del_err}")
+            if blob_key is not None:
+                discard_uncommitted_blob(*blob_key)
             app.logger.error(f"Error uploading document for transaction {transaction_id}: {e}", exc_info=True)
             abort(500, description="Could not save document.")
     else:
         abort(400, description="File type not allowed.")
 
 
+# Document files never change once stored, so responses are cacheable: the
+# ETag is the content hash (stored name and mtime for legacy files),
+# If-None-Match / If-Modified-Since get a 304 and Range requests a 206. A URL
+# carrying ?v=<sha256> (as the documents list builds it) names one exact
+# content and is cached as immutable; without it the browser revalidates.
+DOCUMENT_MAX_AGE = 365 * 24 * 3600
+
+def send_document(document, as_attachment):
+    sha256 = document.blob_sha256
+    versioned = sha256 is not None and request.args.get('v') == sha256
+    if sha256 is not None and sha256 in request.if_none_match:
+        # Answered from the row alone, without touching the file
+        response = Response(status=304)
+        response.set_etag(sha256)
+    else:
+        response = send_from_directory(
+            app.config['UPLOAD_FOLDER'], document_storage_name(document),
+            as_attachment=as_attachment,
+            download_name=document.original_filename,
+            mimetype=document.mimetype,
+            etag=sha256 if sha256 is not None else True,
+            conditional=True,
+        )
+        response.accept_ranges = 'bytes' # Lets PDF viewers fetch pages progressively
+    response.cache_control.private = True
+    if versioned:
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = DOCUMENT_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.max_age = None
+        response.cache_control.no_cache = True
+    return response
+
+
 @app.route('/api/documents/<int:document_id>/view', methods=['GET'])
 def view_document(document_id):
     document = Document.query.get_or_404(document_id, description=f"Document {document_id} not found.")
     try:
-        return send_from_directory(app.config['UPLOAD_FOLDER'], document.stored_filename, as_attachment=False, mimetype=document.mimetype)
-    except FileNotFoundError:
+        return send_document(document, as_attachment=False)
+    except (FileNotFoundError, NotFound):
         abort(404, description="File not found on server.")
     except Exception as e:
         app.logger.error(f"Error serving document {document_id} for view: {e}", exc_info=True)
@@ -445,31 +846,65 @@ def view_document(document_id):
 def download_document(document_id):
     document = Document.query.get_or_404(document_id, description=f"Document {document_id} not found.")
     try:
-        return send_from_directory(app.config['UPLOAD_FOLDER'], document.stored_filename, as_attachment=True, download_name=document.original_filename)
-    except FileNotFoundError:
+        return send_document(document, as_attachment=True)
+    except (FileNotFoundError, NotFound):
         abort(404, description="File not found on server.")
     except Exception as e:
         app.logger.error(f"Error serving document {document_id} for download: {e}", exc_info=True)
         abort(500, description="Could not serve document for download.")
 
 
+# Small JPEG rendition of an image or PDF document: ?size=thumb (default) or
+# preview. Generated on first request if the upload did not already queue it;
+# 202 with Retry-After while it is still rendering, 415 for other file types.
+@app.route('/api/documents/<int:document_id>/preview', methods=['GET'])
+def preview_document(document_id):
+    document = Document.query.get_or_404(document_id, description=f"Document {document_id} not found.")
+    size_name = request.args.get('size', 'thumb')
+    if size_name not in PREVIEW_SIZES:
+        abort(400, description=f"'size' must be one of {', '.join(PREVIEW_SIZES)}.")
+    try:
+        preview_path = get_preview(document, size_name, document_file_path(document))
+    except TimeoutError:
+        response = jsonify({'message': 'Preview is being generated.'})
+        response.status_code = 202
+        response.headers['Retry-After'] = '2'
+        return response
+    except Exception as e:
+        app.logger.error(f"Error generating {size_name} preview of document {document_id}: {e}", exc_info=True)
+        abort(500, description="Could not generate the preview.")
+    if preview_path is None:
+        abort(415, description="No preview is available for this document.")
+
+    response = send_file(preview_path, mimetype='image/jpeg', etag=f"{document.blob_sha256}-{size_name}", conditional=True)
+    response.cache_control.private = True
+    if request.args.get('v') == document.blob_sha256:
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = DOCUMENT_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.max_age = None
+        response.cache_control.no_cache = True
+    return response
+
+
 @app.route('/api/documents/<int:document_id>', methods=['DELETE'])
 def delete_document(document_id):
     document = Document.query.get_or_404(document_id, description=f"Document {document_id} not found.")
     transaction = document.transaction # Get associated transaction before deleting document
 
     try:
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], document.stored_filename)
-        if os.path.exists(filepath):
-            os.remove(filepath)
-        
         db.session.delete(document)
+        # The file goes only with its last reference, after the commit
+        released_files = release_documents([document])
         
         # Check if the transaction has any other documents left
         if transaction and not transaction.documents: # This checks after the current document is marked for deletion
             transaction.doc_flag = False
-        
+
+        reindex_transactions([document.transaction_id])
         db.session.commit()
+        remove_released_files(released_files)
         return jsonify({"message": "Document deleted successfully."}), 200
     except Exception as e:
         db.session.rollback()
@@ -477,6 +912,174 @@ def delete_document(document_id):
         abort(500, description="Could not delete document.")
 
 
+# Chunked, resumable document upload, for large files and unreliable connections:
+#   POST   /api/transactions/<id>/uploads   {filename, size[, mimetype]} -> session (name, type and
+#                                           size are checked here, before any data is sent)
+#   PUT    /api/uploads/<id>?offset=N       raw chunk body, appended at byte N
+#   GET    /api/uploads/<id>                session with the offset to resume from
+#   POST   /api/uploads/<id>/complete       creates the Document
+#   DELETE /api/uploads/<id>                cancels the upload
+# Chunks are streamed from the request body straight into a file in the upload
+# folder, which is renamed into place on completion.
+@app.route('/api/transactions/<int:transaction_id>/uploads', methods=['POST'])
+def init_chunked_upload(transaction_id):
+    transaction = Transaction.query.get_or_404(transaction_id, description=f"Transaction {transaction_id} not found")
+    data = request.get_json(silent=True) or {}
+
+    original_filename = secure_filename(data.get('filename') or '')
+    if not original_filename:
+        abort(400, description="'filename' is required.")
+    if not allowed_file(original_filename):
+        abort(400, description="File type not allowed.")
+    mimetype = data.get('mimetype') or mimetypes.guess_type(original_filename)[0] or 'application/octet-stream'
+    if not MIMETYPE_RE.fullmatch(mimetype):
+        abort(400, description="'mimetype' is not a valid media type.")
+
+    total_size = data.get('size')
+    if isinstance(total_size, bool) or not isinstance(total_size, int) or total_size <= 0:
+        abort(400, description="'size' must be a positive integer (bytes).")
+    if total_size > app.config['MAX_DOCUMENT_SIZE']:
+        abort(413, description=f"File is larger than the {app.config['MAX_DOCUMENT_SIZE']} byte limit.")
+
+    try:
+        expire_upload_sessions()
+        upload = UploadSession(
+            id=str(uuid.uuid4()),
+            transaction_id=transaction.id,
+            original_filename=original_filename,
+            mimetype=mimetype,
+            total_size=total_size,
+            received_size=0,
+        )
+        db.session.add(upload)
+        db.session.commit()
+        return jsonify(dict(upload.to_json(), chunk_size=UPLOAD_CHUNK_SIZE)), 201
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Database error starting upload for transaction {transaction_id}: {e}", exc_info=True)
+        abort(500, description="A database error occurred while starting the upload.")
+
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def put_upload_chunk(upload_id):
+    upload = UploadSession.query.get_or_404(upload_id, description=f"Upload {upload_id} not found.")
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        abort(400, description="'offset' must be a valid integer.")
+    # Refuse an oversized chunk from its headers, before reading the body
+    if request.content_length is not None and offset + request.content_length > upload.total_size:
+        abort(413, description=f"Chunk goes past the declared size of {upload.total_size} bytes.")
+
+    # A retried or out-of-order chunk gets the offset to resume from
+    if offset != sync_received_size(upload):
+        db.session.commit()
+        abort(409, description=f"Expected offset {upload.received_size}, got {offset}.")
+
+    try:
+        append_chunk(upload, request.stream, offset)
+        db.session.commit()
+        return jsonify(upload.to_json()), 200
+    except UploadConflict as e:
+        # Checked again under the upload's lock; a concurrent retry lands here
+        sync_received_size(upload)
+        db.session.commit()
+        abort(409, description=str(e))
+    except ValueError as e:
+        db.session.commit()
+        abort(400, description=str(e))
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error writing chunk of upload {upload_id}: {e}", exc_info=True)
+        abort(500, description="Could not write the chunk.")
+
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    upload = UploadSession.query.get_or_404(upload_id, description=f"Upload {upload_id} not found.")
+    sync_received_size(upload)
+    db.session.commit()
+    return jsonify(upload.to_json()), 200
+
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    upload = UploadSession.query.get_or_404(upload_id, description=f"Upload {upload_id} not found.")
+    blob = None
+    try:
+        transaction = db.session.get(Transaction, upload.transaction_id)
+        if transaction is None:
+            abort(404, description=f"Transaction {upload.transaction_id} not found")
+        blob = complete_upload(upload)
+        new_document = Document(
+            original_filename=upload.original_filename,
+            mimetype=upload.mimetype,
+            transaction_id=upload.transaction_id,
+            blob_sha256=blob.sha256,
+        )
+        db.session.add(new_document)
+        if not transaction.doc_flag:
+            transaction.doc_flag = True
+        db.session.delete(upload)
+        reindex_transactions([transaction.id])
+        db.session.commit()
+        schedule_previews(new_document, document_file_path(new_document))
+
+        response = new_document.to_json()
+        response['duplicates'] = [
+            {'document_id': doc.id, 'transaction_id': doc.transaction_id, 'original_filename': doc.original_filename}
+            for doc in documents_with_content(blob.sha256, exclude_document_id=new_document.id)
+        ]
+        return jsonify(response), 201
+    except HTTPException as e:
+        raise e
+    except ValueError as e:
+        db.session.rollback()
+        abort(409, description=str(e))
+    except Exception as e:
+        blob_key = (blob.sha256, blob.stored_filename) if blob is not None else None
+        db.session.rollback()
+        if blob_key is not None:
+            discard_uncommitted_blob(*blob_key)
+        app.logger.error(f"Error completing upload {upload_id}: {e}", exc_info=True)
+        abort(500, description="Could not save document.")
+
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    upload = UploadSession.query.get_or_404(upload_id, description=f"Upload {upload_id} not found.")
+    try:
+        path = discard_upload(upload)
+        db.session.commit()
+        remove_files([path])
+        return jsonify({"message": "Upload cancelled."}), 200
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Database error cancelling upload {upload_id}: {e}", exc_info=True)
+        abort(500, description="A database error occurred while cancelling the upload.")
+
+
+# Moves document files stored flat by earlier versions into the fan-out layout,
+# in a background thread (see storage.migrate_layout). Documents stay readable
+# while it runs; POST again after an interruption to resume.
+@app.route('/api/documents/layout-migration', methods=['POST'])
+def start_document_layout_migration():
+    batch_size = parse_positive_int_option(request.values, 'batch_size', default=LAYOUT_BATCH_SIZE)
+    started = start_layout_migration(batch_size)
+    return jsonify(dict(layout_migration_status(), started=started)), 202 if started else 200
+
+
+@app.route('/api/documents/layout-migration', methods=['GET'])
+def document_layout_migration_status():
+    try:
+        return jsonify(layout_migration_status()), 200
+    except SQLAlchemyError as e:
+        app.logger.error(f"Database error reading layout migration status: {e}", exc_info=True)
+        abort(500, description="A database error occurred while reading the migration status.")
+
+
 
 
 # --- TagGroup Routes ---
@@ -493,6 +1096,7 @@ def create_tag_group():
     try:
         new_group = TagGroup(name=data['name'])
         db.session.add(new_group)
+        bump_catalog_version()
         db.session.commit()
         return jsonify(new_group.to_json(include_tags=False)), 201
     except IntegrityError:
@@ -510,11 +1114,14 @@ def create_tag_group():
 
 
 # Get all TagGroups
+# Served from the catalog cache, with the catalog version as ETag (see catalog.py)
 @app.route('/api/tag-groups', methods=['GET'])
 def get_tag_groups():
     try:
-        groups = TagGroup.query.order_by(TagGroup.name.asc()).all()
-        return jsonify([group.to_json(include_tags=True) for group in groups])
+        return catalog_response('tag-groups', lambda: [
+            group.to_json(include_tags=True)
+            for group in TagGroup.query.options(selectinload(TagGroup.tags)).order_by(TagGroup.name.asc())
+        ])
     except SQLAlchemyError as e:
         app.logger.error(f"Database error getting tag groups: {e}", exc_info=True)
         abort(500, description="An error occurred while retrieving tag groups.")
@@ -537,7 +1144,10 @@ def get_tag_group(group_id):
 def delete_tag_group(group_id):
     group = TagGroup.query.get_or_404(group_id, description=f"TagGroup with id {group_id} not found.")
     try:
+        touch_tagged_transactions(select(Tag.id).where(Tag.tag_group_id == group.id))
+        delete_rules_for_tags(select(Tag.id).where(Tag.tag_group_id == group.id))
         db.session.delete(group) # Cascade will handle deleting associated Tags
+        bump_catalog_version()
         db.session.commit()
         return jsonify({"message": f"TagGroup '{group.name}' and its tags deleted."}), 200
     except SQLAlchemyError as e:
@@ -576,6 +1186,7 @@ def create_tag():
             tag_group_id=data['tag_group_id']
         )
         db.session.add(new_tag)
+        bump_catalog_version()
         db.session.commit()
         return jsonify(new_tag.to_json(include_group=True, include_transactions=False)), 201
     except IntegrityError:
@@ -593,15 +1204,17 @@ def create_tag():
 
 
 # Get all Tags
+# Served from the catalog cache, with the catalog version as ETag (see catalog.py)
 @app.route('/api/tags', methods=['GET'])
 def get_tags():
     try:
         group_id = request.args.get('group_id', type=int)
-        query = Tag.query
+        query = Tag.query.options(joinedload(Tag.tag_group))
         if group_id:
             query = query.filter(Tag.tag_group_id == group_id)
-        tags = query.order_by(Tag.name.asc()).all()
-        return jsonify([tag.to_json(include_group=True, include_transactions=False) for tag in tags])
+        return catalog_response(('tags', group_id), lambda: [
+            tag.to_json(include_group=True, include_transactions=False) for tag in query.order_by(Tag.name.asc())
+        ])
     except SQLAlchemyError as e:
         app.logger.error(f"Database error getting tags: {e}", exc_info=True)
         abort(500, description="An error occurred while retrieving tags.")
@@ -624,7 +1237,10 @@ def get_tag(tag_id):
 def delete_tag(tag_id):
     tag = Tag.query.get_or_404(tag_id, description=f"Tag with id {tag_id} not found.")
     try:
+        touch_tagged_transactions([tag.id])
+        delete_rules_for_tags([tag.id])
         db.session.delete(tag)
+        bump_catalog_version()
         db.session.commit()
         return jsonify({"message": f"Tag '{tag.name}' deleted."}), 200
     except SQLAlchemyError as e:
@@ -661,6 +1277,7 @@ def add_tag_to_transaction(tx_id):
 
     try:
         tx.tags.append(tag)
+        tx.updated_at = func.now()
         db.session.commit()
         return jsonify(tx.to_json(include_tags=True, include_documents=True)), 200
     except SQLAlchemyError as e:
@@ -685,6 +1302,7 @@ def remove_tag_from_transaction(tx_id, tag_id):
 
     try:
         tx.tags.remove(tag)
+        tx.updated_at = func.now()
         db.session.commit()
         return jsonify(tx.to_json(include_tags=True, include_documents=True)), 200
     except SQLAlchemyError as e:
@@ -699,16 +1317,361 @@ def remove_tag_from_transaction(tx_id, tag_id):
 
 
 
+
+# Add and remove tags on many transactions at once
+# Body: {"transaction_ids": [...]} or {"filter": {...}} with the query arguments of
+#       GET /api/transactions (at least one), plus {"add": [tag ids], "remove": [tag ids]}.
+# Split parents are left out, as their tags live on the children. Everything is applied
+# with set-based statements in one commit; only counts are returned:
+#   {"transactions": matched, "changed": transactions whose tags changed, "added": links, "removed": links}
+@app.route('/api/transactions/tags/bulk', methods=['POST'])
+def bulk_update_transaction_tags():
+    data = request.get_json()
+    if not isinstance(data, dict):
+        abort(400, description="Request body must be a JSON object.")
+
+    add_ids = parse_tag_id_list(data, 'add')
+    remove_ids = parse_tag_id_list(data, 'remove')
+    if not add_ids and not remove_ids:
+        abort(400, description="Provide tag ids to 'add' and/or 'remove'.")
+    if set(add_ids) & set(remove_ids):
+        abort(400, description="A tag cannot be both added and removed.")
+    known = set(db.session.execute(select(Tag.id).where(Tag.id.in_(add_ids + remove_ids))).scalars())
+    unknown = sorted(set(add_ids + remove_ids) - known)
+    if unknown:
+        abort(404, description=f"Tag(s) not found: {', '.join(map(str, unknown))}.")
+
+    if isinstance(data.get('transaction_ids'), list):
+        ids = data['transaction_ids']
+        if not all(isinstance(tx_id, int) and not isinstance(tx_id, bool) for tx_id in ids):
+            abort(400, description="'transaction_ids' must be a list of integers.")
+        if len(ids) > MAX_BULK_ROWS:
+            abort(400, description=f"A bulk request cannot exceed {MAX_BULK_ROWS} transactions.")
+        targets = select(Transaction.id).where(Transaction.id.in_(ids), Transaction.children_flag.is_(False))
+    elif isinstance(data.get('filter'), dict):
+        filtered = apply_transaction_filters(db.session.query(Transaction.id), filter_args(data['filter']))
+        if filtered.whereclause is None:
+            abort(400, description="'filter' must narrow the transactions; list their ids to retag everything.")
+        targets = filtered.filter(Transaction.children_flag.is_(False)).statement
+    else:
+        abort(400, description="Expected a 'transaction_ids' list or a 'filter' object.")
+
+    try:
+        # The targets are read once, before any write: a filter on tags would otherwise
+        # be re-evaluated after the DELETE below and miss the transactions it just untagged
+        target_ids = list(dict.fromkeys(db.session.execute(targets).scalars()))
+        matched = len(target_ids)
+        link = transaction_tags.alias('link')
+        changed = added = removed = 0
+        for start in range(0, len(target_ids), BULK_TAG_CHUNK_SIZE):
+            chunk_ids = target_ids[start:start + BULK_TAG_CHUNK_SIZE]
+            has_removed_tag = select(link.c.transaction_id).where(
+                link.c.transaction_id == Transaction.id, link.c.tag_id.in_(remove_ids)).exists()
+            lacks_added_tag = select(Tag.id).where(
+                Tag.id.in_(add_ids),
+                # Correlated to the updated row two levels up, which is not the default
+                ~select(link.c.tag_id).where(link.c.transaction_id == Transaction.id, link.c.tag_id == Tag.id)
+                .correlate_except(link).exists(),
+            ).exists()
+            # Tag changes count as transaction changes (incremental backups rely on it); bumped
+            # first, as the conditions look at the links before the change
+            changed += db.session.execute(
+                update(Transaction)
+                .where(Transaction.id.in_(chunk_ids), or_(has_removed_tag, lacks_added_tag))
+                .values(updated_at=func.now())
+                .execution_options(synchronize_session=False)
+            ).rowcount
+
+            if remove_ids:
+                removed += db.session.execute(
+                    delete(transaction_tags)
+                    .where(transaction_tags.c.transaction_id.in_(chunk_ids), transaction_tags.c.tag_id.in_(remove_ids))
+                ).rowcount
+            if add_ids:
+                added += db.session.execute(
+                    insert(transaction_tags).from_select(
+                        ['transaction_id', 'tag_id'],
+                        select(Transaction.id, Tag.id).select_from(Transaction).join(Tag, true()).where(
+                            Transaction.id.in_(chunk_ids),
+                            Tag.id.in_(add_ids),
+                            ~select(link.c.tag_id).where(link.c.transaction_id == Transaction.id, link.c.tag_id == Tag.id).exists(),
+                        ),
+                    )
+                ).rowcount
+        db.session.commit()
+        return jsonify({'transactions': matched, 'changed': changed, 'added': added, 'removed': removed}), 200
+
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Database error in bulk tag update: {e}", exc_info=True)
+        abort(500, description="A database error occurred while updating the tags.")
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Unexpected error in bulk tag update: {e}", exc_info=True)
+        abort(500, description="An unexpected error occurred while updating the tags.")
+
+
+def parse_tag_id_list(data, key):
+    """A list of tag ids from a JSON body (empty when absent), aborting with 400 on bad input."""
+    values = data.get(key) or []
+    if not isinstance(values, list) or not all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        abort(400, description=f"'{key}' must be a list of tag ids.")
+    return sorted(set(values))
+
+
+def filter_args(filters):
+    """Turns a JSON filter object into query arguments for apply_transaction_filters."""
+    args = MultiDict()
+    for key, value in filters.items():
+        for item in value if isinstance(value, list) else [value]:
+            if item is not None:
+                args.add(key, str(item).lower() if isinstance(item, bool) else str(item))
+    return args
+
+
+
+
+# Suggested tags for a transaction, learned from the tags of past transactions
+# Query: "limit" (default 5), "min_confidence" between 0 and 1 (default 0.3).
+# At most one tag per tag group, none for groups the transaction already has a tag of:
+#   {"transaction_id": 1, "suggestions": [{"tag_id", "tag_name", "tag_group_id", "confidence"}]}
+@app.route('/api/transactions/<int:tx_id>/tag-suggestions', methods=['GET'])
+def get_tag_suggestions(tx_id):
+    tx = Transaction.query.get_or_404(tx_id, description=f"Transaction with id {tx_id} not found.")
+    limit, min_confidence = parse_suggestion_options(request.args)
+    try:
+        suggestions = suggest_tags(tx.description, tx.amount, [tag.id for tag in tx.tags], min_confidence, limit)
+        return jsonify({'transaction_id': tx.id, 'suggestions': suggestions}), 200
+    except SQLAlchemyError as e:
+        app.logger.error(f"Database error suggesting tags for transaction {tx_id}: {e}", exc_info=True)
+        abort(500, description="An error occurred while suggesting tags.")
+    except Exception as e:
+        app.logger.error(f"Unexpected error suggesting tags for transaction {tx_id}: {e}", exc_info=True)
+        abort(500, description="An unexpected error occurred while suggesting tags.")
+
+
+
+
+# Suggested tags for a batch, scored at once
+# Body: {"transaction_ids": [...]} for saved transactions, or
+#       {"transactions": [{"description", "amount", "tag_ids"}, ...]} for rows not imported yet,
+# plus the "limit" and "min_confidence" options of the single transaction route.
+# Results follow the order of the request: {"results": [{"index", "transaction_id", "suggestions"}]}
+@app.route('/api/transactions/tag-suggestions', methods=['POST'])
+def get_tag_suggestions_batch():
+    data = request.get_json()
+    if not isinstance(data, dict):
+        abort(400, description="Request body must be a JSON object.")
+    limit, min_confidence = parse_suggestion_options(data)
+
+    try:
+        if isinstance(data.get('transaction_ids'), list):
+            ids = data['transaction_ids']
+            if len(ids) > MAX_BULK_ROWS:
+                abort(400, description=f"A batch cannot exceed {MAX_BULK_ROWS} transactions.")
+            if not all(isinstance(tx_id, int) and not isinstance(tx_id, bool) for tx_id in ids):
+                abort(400, description="'transaction_ids' must be a list of integers.")
+            found = {}
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                for tx_id, description, amount in db.session.execute(
+                    select(Transaction.id, Transaction.description, Transaction.amount).where(Transaction.id.in_(batch))
+                ):
+                    found[tx_id] = (description, amount, [])
+                for tx_id, tag_id in db.session.execute(
+                    select(transaction_tags.c.transaction_id, transaction_tags.c.tag_id)
+                    .where(transaction_tags.c.transaction_id.in_(batch))
+                ):
+                    found[tx_id][2].append(tag_id)
+            missing = [tx_id for tx_id in ids if tx_id not in found]
+            if missing:
+                abort(404, description=f"Transaction(s) not found: {', '.join(map(str, missing[:20]))}.")
+            items = [found[tx_id] for tx_id in ids]
+        elif isinstance(data.get('transactions'), list):
+            ids = [None] * len(data['transactions'])
+            if len(ids) > MAX_BULK_ROWS:
+                abort(400, description=f"A batch cannot exceed {MAX_BULK_ROWS} transactions.")
+            items = []
+            for row in data['transactions']:
+                if not isinstance(row, dict):
+                    abort(400, description="Each transaction must be an object.")
+                description = row.get('description')
+                if description is not None and not isinstance(description, str):
+                    abort(400, description="'description' must be a string.")
+                amount = parse_amount_arg(row['amount'], 'amount') if row.get('amount') not in (None, '') else None
+                items.append((description, amount, parse_tag_id_list(row, 'tag_ids')))
+        else:
+            abort(400, description="Expected a 'transaction_ids' or a 'transactions' list.")
+
+        results = suggest_tags_batch(items, min_confidence, limit)
+        return jsonify({'results': [
+            {'index': index, 'transaction_id': tx_id, 'suggestions': suggestions}
+            for index, (tx_id, suggestions) in enumerate(zip(ids, results))
+        ]}), 200
+    except HTTPException as e:
+        raise e
+    except SQLAlchemyError as e:
+        app.logger.error(f"Database error suggesting tags for a batch: {e}", exc_info=True)
+        abort(500, description="An error occurred while suggesting tags.")
+    except Exception as e:
+        app.logger.error(f"Unexpected error suggesting tags for a batch: {e}", exc_info=True)
+        abort(500, description="An unexpected error occurred while suggesting tags.")
+
+
+def parse_suggestion_options(values):
+    """Reads 'limit' and 'min_confidence' from query arguments or a JSON body."""
+    try:
+        limit = int(values.get('limit') or DEFAULT_SUGGESTION_LIMIT)
+        min_confidence = float(values.get('min_confidence') if values.get('min_confidence') is not None else DEFAULT_MIN_CONFIDENCE)
+    except (ValueError, TypeError):
+        abort(400, description="'limit' must be an integer and 'min_confidence' a number.")
+    if limit <= 0:
+        abort(400, description="'limit' must be a positive integer.")
+    if not 0 <= min_confidence <= 1:
+        abort(400, description="'min_confidence' must be between 0 and 1.")
+    return limit, min_confidence
+
+
+
+
+# --- Categorization Rule Routes ---
+
+
+
+
+# List the categorization rules, in the order they win ties (priority, then age)
+@app.route('/api/rules', methods=['GET'])
+def get_rules():
+    try:
+        rules = CategorizationRule.query.order_by(CategorizationRule.priority.asc(), CategorizationRule.id.asc()).all()
+        return jsonify([rule.to_json() for rule in rules])
+    except SQLAlchemyError as e:
+        app.logger.error(f"Database error getting rules: {e}", exc_info=True)
+        abort(500, description="An error occurred while retrieving rules.")
+
+
+
+# Create a categorization rule
+# Body: {"tag_id", "name", "pattern", "match_type": "contains" | "exact" | "regex",
+#        "min_amount", "max_amount", "start_date", "end_date", "priority": 100, "enabled": true}
+# Only "tag_id" is required; a rule without pattern or ranges matches everything.
+@app.route('/api/rules', methods=['POST'])
+def create_rule():
+    data = request.get_json()
+    if not isinstance(data, dict) or 'tag_id' not in data:
+        abort(400, description="Missing 'tag_id' in request body.")
+    try:
+        rule = parse_rule_fields(data, CategorizationRule())
+        db.session.add(rule)
+        db.session.commit()
+        invalidate_matcher()
+        return jsonify(rule.to_json()), 201
+    except HTTPException as e:
+        raise e
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Database error creating rule: {e}", exc_info=True)
+        abort(500, description="Could not create rule.")
+
+
+
+# Update a categorization rule (only the fields present in the body change)
+@app.route('/api/rules/<int:rule_id>', methods=['PATCH'])
+def update_rule(rule_id):
+    rule = CategorizationRule.query.get_or_404(rule_id, description=f"Rule with id {rule_id} not found.")
+    data = request.get_json()
+    if not isinstance(data, dict):
+        abort(400, description="Request body must be a JSON object.")
+    try:
+        parse_rule_fields(data, rule)
+        db.session.commit()
+        invalidate_matcher()
+        return jsonify(rule.to_json()), 200
+    except HTTPException as e:
+        db.session.rollback()
+        raise e
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Database error updating rule {rule_id}: {e}", exc_info=True)
+        abort(500, description="Could not update rule.")
+
+
+
+# Delete a categorization rule (tags it already added stay)
+@app.route('/api/rules/<int:rule_id>', methods=['DELETE'])
+def delete_rule(rule_id):
+    rule = CategorizationRule.query.get_or_404(rule_id, description=f"Rule with id {rule_id} not found.")
+    try:
+        db.session.delete(rule)
+        db.session.commit()
+        invalidate_matcher()
+        return jsonify({"message": f"Rule {rule_id} deleted."}), 200
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Database error deleting rule {rule_id}: {e}", exc_info=True)
+        abort(500, description="Could not delete rule.")
+
+
+
+# Run the rules over existing transactions
+# Body: {"start_date": "YYYY-MM-DD", "end_date": "YYYY-MM-DD", "dry_run": false}
+# Both dates are optional. Tags are only added, never removed; a transaction that
+# already has a tag of a group keeps it. With "dry_run" nothing is written and the
+# response tells what would change.
+def parse_apply_rules_args(data):
+    """Reads (start_date, end_date, dry_run) of a rule run request body, aborting with 400 on bad input."""
+    start_date = parse_date_arg(data['start_date'], 'start_date') if data.get('start_date') else None
+    end_date = parse_date_arg(data['end_date'], 'end_date') if data.get('end_date') else None
+    if start_date and end_date and start_date > end_date:
+        abort(400, description="'start_date' cannot be after 'end_date'.")
+    dry_run = data.get('dry_run', False)
+    if not isinstance(dry_run, bool):
+        abort(400, description="'dry_run' must be a boolean.")
+    return start_date, end_date, dry_run
+
+
+@app.route('/api/rules/apply', methods=['POST'])
+def apply_rules_route():
+    start_date, end_date, dry_run = parse_apply_rules_args(request.get_json(silent=True) or {})
+
+    try:
+        started = time.monotonic()
+        report = apply_rules(start_date, end_date, dry_run=dry_run)
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+        report.update(dry_run=dry_run, elapsed_ms=round((time.monotonic() - started) * 1000))
+        return jsonify(report), 200
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Database error applying rules: {e}", exc_info=True)
+        abort(500, description="A database error occurred while applying the rules.")
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Unexpected error applying rules: {e}", exc_info=True)
+        abort(500, description="An unexpected error occurred while applying the rules.")
+
+
+
+
 # --- Settings Routes ---
 
 
 
-SUPPORTED_DECIMAL_SETTINGS = ['initial_balance', 'final_running_balance']
+SUPPORTED_DECIMAL_SETTINGS = ['initial_balance']
+# Settings derived from the ledger by the server; they can be read but not written
+COMPUTED_SETTINGS = {
+    'final_running_balance': final_running_balance,
+}
 
 @app.route('/api/settings/<string:setting_key>', methods=['GET'])
 def get_setting(setting_key):
     """Retrieves a specific setting value."""
     try:
+        if setting_key in COMPUTED_SETTINGS:
+            return jsonify({'key': setting_key, 'value': str(COMPUTED_SETTINGS[setting_key]())})
+
         setting = Setting.query.filter_by(key=setting_key).first()
 
         if setting:
@@ -731,6 +1694,9 @@ def get_setting(setting_key):
 @app.route('/api/settings/<string:setting_key>', methods=['POST'])
 def set_setting(setting_key):
     """Creates or updates a specific setting value."""
+    if setting_key in COMPUTED_SETTINGS:
+        abort(400, description=f"Setting '{setting_key}' is computed by the server and cannot be set.")
+
     data = request.get_json()
     if not data or 'value' not in data:
         abort(400, description="Missing 'value' in request body.")
@@ -783,82 +1749,233 @@ def set_setting(setting_key):
 
 
 # --- Backup Route ---
+def stream_backup(store_compressed, base=None):
+    """Streams a backup archive (full, or incremental against `base`) as a ZIP download."""
+    def generate():
+        try:
+            yield from iter_backup_archive(store_compressed=store_compressed, base=base)
+        except Exception as e:
+            # Headers are already sent; the client sees a truncated archive
+            db.session.rollback()
+            current_app.logger.error(f"Error during backup: {e}", exc_info=True)
+            raise
+
+    kind = 'incremental' if base is not None else 'backup'
+    backup_filename = f"categorization_{kind}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.zip"
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{backup_filename}"'},
+    )
+
+
+def parse_store_compressed_arg(values=None):
+    values = request.args if values is None else values
+    if values.get('store_compressed') not in (None, ''):
+        return parse_bool_arg(values['store_compressed'], 'store_compressed')
+    return True
+
+
+def get_backup_base(base_id):
+    """The base of an incremental backup: the Backup `base_id`, or the newest one for 'latest'. 404 if none."""
+    if base_id == 'latest':
+        base = Backup.query.order_by(Backup.created_at.desc()).first()
+    else:
+        base = db.session.get(Backup, base_id)
+    if base is None:
+        abort(404, description="Base backup not found. Take a full backup first.")
+    return base
+
+
+# Full backup, streamed while it is being built (nothing is held in memory).
+# Already-compressed documents (PDF, JPEG, PNG, ...) are stored as they are;
+# pass ?store_compressed=false to deflate every file.
 @app.route('/api/backup/all', methods=['GET'])
 def backup_all_data():
-    try:
-        # 1. Fetch all transactions
-        transactions = Transaction.query.order_by(Transaction.date.asc(), Transaction.id.asc()).all()
-        # We need to modify how document filenames are stored in the JSON if we change them in the ZIP
-        # For simplicity, let's assume the JSON will still refer to original_filename,
-        # and the restore process would need to map backed-up names if they change.
-        # Or, we can add a 'backup_filename' field to the document's JSON representation for backup.
-
-        transactions_list_for_json = []
-        for tx in transactions:
-            tx_json = tx.to_json(include_tags=True, include_documents=False) # Exclude documents initially
-            tx_json['documents'] = []
-            for doc in tx.documents:
-                doc_json = doc.to_json()
-                # Create a unique filename for the backup archive
-                # This will be the name used *inside* the ZIP's Documents folder
-                doc_json['backup_filename'] = f"{doc.id}_{doc.original_filename.replace('/', '_').replace(' ', '_')}"
-                tx_json['documents'].append(doc_json)
-            transactions_list_for_json.append(tx_json)
-        
-        transactions_json_string = json.dumps(transactions_list_for_json, indent=4, default=str)
+    return stream_backup(parse_store_compressed_arg())
 
-        # 3. Prepare to collect document files (already implicitly done by fetching transactions with documents)
-        all_documents = Document.query.all() # Or iterate through transactions.documents
 
-        # 4. Create a ZIP archive in memory
-        memory_file = io.BytesIO()
-        with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zip_archive:
-            # Add transactions.json
-            zip_archive.writestr('transactions.json', transactions_json_string)
+# Incremental backup: only what changed since ?base=<backup id> (or base=latest).
+# Restoring needs the full backup and every incremental of the chain.
+@app.route('/api/backup/incremental', methods=['GET'])
+def backup_incremental():
+    base_id = request.args.get('base')
+    if not base_id:
+        abort(400, description="Missing 'base' backup id (or 'latest').")
+    return stream_backup(parse_store_compressed_arg(), base=get_backup_base(base_id))
 
-            upload_folder = current_app.config['UPLOAD_FOLDER']
-            if not os.path.isdir(upload_folder): 
-                current_app.logger.error(f"Upload folder {upload_folder} not found or is not a directory during backup.")
-            else:
-                documents_folder_in_zip = "Documents/" # Root folder for documents in ZIP
-                
-                # Keep track of filenames to ensure uniqueness within the ZIP's Documents folder.
-                # This is an alternative to just using doc.id if we want to preserve original_filename as much as possible.
-                # However, simply prefixing with doc.id is more robust and simpler.
-                # Let's stick to the doc.id prefix method for guaranteed uniqueness directly.
-
-                for doc in all_documents: # Iterate through all documents directly
-                    # Use the unique backup_filename created earlier (or generate it here)
-                    unique_backup_filename = f"{doc.id}_{doc.original_filename.replace('/', '_').replace(' ', '_')}"
-                    # Sanitize further if needed, but doc.id prefix helps a lot.
-                    # Example: remove characters not allowed in filenames on some OS
-                    # safe_original_part = secure_filename(doc.original_filename) might be too aggressive
-                    # For backup, often better to be more permissive with original name and rely on ID for uniqueness.
-                    
-                    zip_entry_name = f"{documents_folder_in_zip}{unique_backup_filename}"
-                    
-                    doc_file_path = os.path.join(upload_folder, doc.stored_filename)
-                    
-                    if os.path.exists(doc_file_path) and os.path.isfile(doc_file_path):
-                        zip_archive.write(doc_file_path, arcname=zip_entry_name)
-                    else:
-                        current_app.logger.warning(f"Document file not found or is not a file: {doc_file_path} for document ID {doc.id} (original: {doc.original_filename}). Skipping.")
-        
-        memory_file.seek(0)
 
-        # 5. Send the ZIP file
-        backup_filename = f"categorization_backup_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.zip"
-        
+# Backups taken so far, newest first
+@app.route('/api/backups', methods=['GET'])
+def list_backups():
+    backups = Backup.query.order_by(Backup.created_at.desc()).all()
+    return jsonify([backup.to_json() for backup in backups]), 200
+
+
+
+# Restore from backup archives sent as multipart 'file' fields: one full backup,
+# or a full backup plus its incrementals. The database must be empty unless
+# ?replace=true. Archives are spooled to disk so documents can be extracted in
+# parallel; the response reports row counts and throughput.
+@app.route('/api/backup/restore', methods=['POST'])
+def restore_from_backup():
+    uploads = request.files.getlist('file')
+    if not uploads:
+        abort(400, description="No backup archive provided.")
+    replace = False
+    if request.values.get('replace'):
+        replace = parse_bool_arg(request.values['replace'], 'replace')
+    workers = parse_positive_int_option(request.values, 'workers', default=DEFAULT_EXTRACT_WORKERS)
+
+    if not replace and not database_is_empty():
+        abort(409, description="The database is not empty. Pass replace=true to overwrite it.")
+
+    with tempfile.TemporaryDirectory() as spool_dir, contextlib.ExitStack() as stack:
+        try:
+            zip_archives = []
+            for position, upload in enumerate(uploads):
+                path = os.path.join(spool_dir, f"{position}.zip")
+                upload.save(path)
+                zip_archives.append(stack.enter_context(zipfile.ZipFile(path)))
+
+            report = restore_backup(zip_archives, current_app.config['UPLOAD_FOLDER'], replace=replace, workers=workers)
+            return jsonify(report), 200
+
+        except HTTPException as e:
+            raise e
+        except (ValueError, zipfile.BadZipFile) as e:
+            db.session.rollback()
+            abort(400, description=f"Could not restore the backup: {e}")
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            app.logger.error(f"Database error during restore: {e}", exc_info=True)
+            abort(500, description="A database error occurred while restoring the backup.")
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Unexpected error during restore: {e}", exc_info=True)
+            abort(500, description="An unexpected error occurred while restoring the backup.")
+
+
+
+# --- Job Routes ---
+
+
+
+# Backups, statement imports and rule runs can also run as background jobs (see
+# jobs.py). Each POST answers 202 at once with the job; poll GET /api/jobs/<id>
+# for its status and progress, then fetch GET /api/jobs/<id>/result.
+
+def queue_job(kind, params, input_stream=None):
+    try:
+        maintain_jobs()
+        job = submit_job(kind, params, input_stream=input_stream)
+        return jsonify(job_json(job)), 202
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Database error queueing a {kind} job: {e}", exc_info=True)
+        abort(500, description=f"A database error occurred while queueing the {kind} job.")
+    except OSError as e:
+        app.logger.error(f"Could not store the input of a {kind} job: {e}", exc_info=True)
+        abort(500, description=f"Could not store the input of the {kind} job.")
+
+
+def get_job_or_404(job_id):
+    maintain_jobs()
+    job = db.session.get(Job, job_id)
+    if job is None:
+        abort(404, description=f"Job {job_id} not found.")
+    return job
+
+
+# Backup as a job
+# Body: {"store_compressed": true, "base": "<backup id>" or "latest"}, both optional;
+# with "base" the backup is incremental. The result is the ZIP archive.
+@app.route('/api/jobs/backup', methods=['POST'])
+def submit_backup_job():
+    data = request.get_json(silent=True) or {}
+    params = {'store_compressed': parse_store_compressed_arg(data), 'base_id': None}
+    if data.get('base'):
+        params['base_id'] = get_backup_base(data['base']).id
+    return queue_job('backup', params)
+
+
+# Statement import as a job
+# Same file and arguments as POST /api/transactions/import. The file is stored
+# with the job; the result is the import summary.
+@app.route('/api/jobs/import', methods=['POST'])
+def submit_import_job():
+    stream, filename = statement_upload()
+    params = parse_statement_import_args(request.values, filename)
+    params['filename'] = filename
+    return queue_job('import', params, input_stream=stream)
+
+
+# Rule run as a job
+# Same body as POST /api/rules/apply; the result is its report.
+@app.route('/api/jobs/apply-rules', methods=['POST'])
+def submit_apply_rules_job():
+    start_date, end_date, dry_run = parse_apply_rules_args(request.get_json(silent=True) or {})
+    return queue_job('apply_rules', {
+        'start_date': start_date.isoformat() if start_date else None,
+        'end_date': end_date.isoformat() if end_date else None,
+        'dry_run': dry_run,
+    })
+
+
+# Jobs, newest first; ?status=, ?kind= and ?limit= narrow the list
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    query = select(Job).order_by(Job.created_at.desc(), Job.id)
+    if request.args.get('status'):
+        query = query.where(Job.status == request.args['status'])
+    if request.args.get('kind'):
+        query = query.where(Job.kind == request.args['kind'])
+    query = query.limit(parse_page_size(request.args.get('limit')))
+    maintain_jobs()
+    jobs = db.session.execute(query).scalars().all()
+    return jsonify([job_json(job) for job in jobs]), 200
+
+
+# Status, progress and (once finished) result summary or error of a job
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    return jsonify(job_json(get_job_or_404(job_id))), 200
+
+
+# Ask a job to stop: a queued job is cancelled at once, a running one at its next
+# progress report (committed import chunks stay). 409 if the job already ended.
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job_route(job_id):
+    job = get_job_or_404(job_id)
+    try:
+        if not cancel_job(job):
+            abort(409, description=f"Job {job_id} has already {job.status}.")
+        return jsonify(job_json(job)), 200
+    except HTTPException as e:
+        raise e
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Database error cancelling job {job_id}: {e}", exc_info=True)
+        abort(500, description="A database error occurred while cancelling the job.")
+
+
+# Result of a succeeded job: the file it produced (a backup archive) as a
+# download, else its JSON summary. 409 while the job has not succeeded.
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = get_job_or_404(job_id)
+    if job.status != 'succeeded':
+        abort(409, description=f"Job {job_id} is {job.status}; only a succeeded job has a result.")
+    if job.result_filename is None:
+        return jsonify(job.to_json()['result']), 200
+    try:
         return send_file(
-            memory_file,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=backup_filename
+            job_file_path(job.id, 'result'), as_attachment=True, download_name=job.result_filename,
+            mimetype=mimetypes.guess_type(job.result_filename)[0] or 'application/octet-stream',
         )
+    except FileNotFoundError:
+        abort(404, description="The result file is no longer available.")
 
-    except Exception as e:
-        current_app.logger.error(f"Error during backup: {e}", exc_info=True)
-        return jsonify({"error": "Failed to create backup.", "details": str(e)}), 500
 
 
 
@@ -888,6 +2005,10 @@ def reset_database_for_test():
             
             app.logger.info("Attempting to create all tables...")
             db.create_all()
+            rebuild_search_index() # The FTS table is not part of the models
+            reset_model()
+            bump_catalog_version()
+            db.session.commit()
             app.logger.info("All tables created successfully.")
         
         app.logger.info("Database schema reset (dropped and recreated) successfully for testing.")
@@ -0,0 +1,293 @@
+# File path: backend/rules.py
+
+from app import db
+from flask import abort
+from models import Transaction, Tag, CategorizationRule, transaction_tags
+from importing import normalize_description
+from filters import parse_date_arg, parse_amount_arg
+from sqlalchemy import select, insert, update, delete, func
+import re
+import threading
+
+
+# Rule-based categorization.
+#
+# A CategorizationRule assigns its tag to transactions whose description
+# matches its pattern and whose amount and date fall in its optional ranges.
+# The enabled rules are compiled into one RuleMatcher:
+#   - 'contains' keywords (the common case) go into a single trie-shaped regex
+#     run over the normalized description (see importing.normalize_description),
+#     so a description is scanned once however many keywords there are;
+#   - 'exact' patterns are a dict lookup of the normalized description;
+#   - 'regex' patterns are tried one by one on the raw description.
+# Amount and date ranges are only checked for the rules whose text matched.
+# When several matching rules assign tags of the same tag group, the one with
+# the lowest priority (then the oldest) wins, and a tag the transaction already
+# has in that group is kept.
+#
+# The matcher is cached per process and rebuilt only when the rule table
+# changes (its row count and latest update are compared on every use).
+
+
+MATCH_TYPES = ('contains', 'exact', 'regex')
+APPLY_BATCH_SIZE = 5000
+
+matcher_cache = {'fingerprint': None, 'matcher': None}
+matcher_cache_lock = threading.Lock()
+
+
+
+# --- Compilation ---
+
+
+
+def trie_regex(keywords):
+    """
+    Regex source matching any of `keywords`, shaped as a trie so the engine
+    branches on one character at a time instead of trying every keyword.
+    Longer keywords are preferred where one extends another.
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node):
+        ends_here = '' in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return f'(?:{body})?' if ends_here else body
+
+    return build(trie)
+
+
+class RuleMatcher:
+    """The enabled rules, compiled for matching many transactions."""
+
+    def __init__(self, rules, tag_groups):
+        self.tag_groups = tag_groups # {tag_id: tag_group_id}, for every tag
+        rules = [rule for rule in rules if rule.tag_id in tag_groups]
+        self.rules = {rule.id: rule for rule in rules}
+        self.keywords = {}
+        self.exact = {}
+        self.regexes = []
+        self.unconditional = []
+        for rule in rules:
+            pattern = rule.pattern or ''
+            if rule.match_type == 'regex' and pattern:
+                self.regexes.append((re.compile(pattern, re.IGNORECASE), rule.id))
+            elif rule.match_type == 'exact' and pattern:
+                self.exact.setdefault(normalize_description(pattern), []).append(rule.id)
+            elif normalize_description(pattern):
+                self.keywords.setdefault(normalize_description(pattern), []).append(rule.id)
+            else:
+                self.unconditional.append(rule.id)
+
+        self.keyword_lengths = sorted({len(keyword) for keyword in self.keywords})
+        # A lookahead finds the longest keyword at every position, overlapping ones included
+        self.keyword_re = re.compile(f'(?=({trie_regex(self.keywords)}))') if self.keywords else None
+
+    def text_matches(self, description):
+        """Ids of the rules whose pattern matches a description."""
+        matched = set(self.unconditional)
+        normalized = normalize_description(description)
+        if self.keyword_re is not None and normalized:
+            for match in self.keyword_re.finditer(normalized):
+                found = match.group(1)
+                if not found:
+                    continue
+                # Shorter keywords that are prefixes of the longest one match here too
+                for length in self.keyword_lengths:
+                    if length > len(found):
+                        break
+                    matched.update(self.keywords.get(found[:length], ()))
+        matched.update(self.exact.get(normalized, ()))
+        for regex, rule_id in self.regexes:
+            if description and regex.search(description):
+                matched.add(rule_id)
+        return matched
+
+    def tags_for(self, description, amount, day, current_tag_ids=()):
+        """Tag ids the rules add to a transaction (not counting `current_tag_ids`)."""
+        taken_groups = {self.tag_groups.get(tag_id) for tag_id in current_tag_ids}
+        best = {}
+        for rule_id in self.text_matches(description):
+            rule = self.rules[rule_id]
+            if rule.min_amount is not None and amount < rule.min_amount:
+                continue
+            if rule.max_amount is not None and amount > rule.max_amount:
+                continue
+            if rule.start_date is not None and day < rule.start_date:
+                continue
+            if rule.end_date is not None and day > rule.end_date:
+                continue
+            group_id = self.tag_groups.get(rule.tag_id)
+            if group_id in taken_groups:
+                continue
+            current = best.get(group_id)
+            if current is None or (rule.priority, rule.id) < (current.priority, current.id):
+                best[group_id] = rule
+        return [rule.tag_id for rule in best.values()]
+
+    def __bool__(self):
+        return bool(self.rules)
+
+
+def rules_fingerprint():
+    """Changes whenever a rule is added, edited or deleted."""
+    return tuple(db.session.execute(
+        select(func.count(CategorizationRule.id), func.max(CategorizationRule.id), func.max(CategorizationRule.updated_at))
+    ).one())
+
+
+def get_matcher():
+    """The compiled matcher of the enabled rules, rebuilt only if the rules changed."""
+    fingerprint = rules_fingerprint()
+    with matcher_cache_lock:
+        if matcher_cache['matcher'] is not None and matcher_cache['fingerprint'] == fingerprint:
+            return matcher_cache['matcher']
+    rules = CategorizationRule.query.filter(CategorizationRule.enabled.is_(True)).all()
+    for rule in rules:
+        db.session.expunge(rule) # Shared across requests, detached from this session
+    tag_groups = dict(db.session.execute(select(Tag.id, Tag.tag_group_id)).all())
+    matcher = RuleMatcher(rules, tag_groups)
+    with matcher_cache_lock:
+        matcher_cache.update(fingerprint=fingerprint, matcher=matcher)
+    return matcher
+
+
+def invalidate_matcher():
+    with matcher_cache_lock:
+        matcher_cache.update(fingerprint=None, matcher=None)
+
+
+
+# --- Rule Maintenance ---
+
+
+
+def parse_rule_fields(data, rule):
+    """
+    Copies the fields present in a request body onto a CategorizationRule,
+    aborting with 400 on bad input. A new rule needs 'tag_id'.
+    """
+    if 'tag_id' in data or rule.tag_id is None:
+        try:
+            tag_id = int(data.get('tag_id'))
+        except (ValueError, TypeError):
+            abort(400, description="'tag_id' must be a valid integer.")
+        if db.session.get(Tag, tag_id) is None:
+            abort(404, description=f"Tag with id {tag_id} not found.")
+        rule.tag_id = tag_id
+    if 'name' in data:
+        rule.name = (data['name'] or '').strip() or None
+    if 'match_type' in data or rule.match_type is None:
+        match_type = data.get('match_type') or 'contains'
+        if match_type not in MATCH_TYPES:
+            abort(400, description=f"'match_type' must be one of {', '.join(MATCH_TYPES)}.")
+        rule.match_type = match_type
+    if 'pattern' in data:
+        rule.pattern = (data['pattern'] or '').strip() or None
+    if rule.match_type == 'regex' and rule.pattern:
+        try:
+            re.compile(rule.pattern)
+        except re.error as e:
+            abort(400, description=f"Invalid regular expression: {e}")
+
+    for key in ('min_amount', 'max_amount'):
+        if key in data:
+            value = data[key]
+            setattr(rule, key, parse_amount_arg(str(value), key) if value not in (None, '') else None)
+    for key in ('start_date', 'end_date'):
+        if key in data:
+            value = data[key]
+            setattr(rule, key, parse_date_arg(value, key) if value else None)
+    if rule.min_amount is not None and rule.max_amount is not None and rule.min_amount > rule.max_amount:
+        abort(400, description="'min_amount' cannot be greater than 'max_amount'.")
+    if rule.start_date is not None and rule.end_date is not None and rule.start_date > rule.end_date:
+        abort(400, description="'start_date' cannot be after 'end_date'.")
+
+    if 'priority' in data:
+        if isinstance(data['priority'], bool) or not isinstance(data['priority'], int):
+            abort(400, description="'priority' must be an integer.")
+        rule.priority = data['priority']
+    if 'enabled' in data:
+        if not isinstance(data['enabled'], bool):
+            abort(400, description="'enabled' must be a boolean.")
+        rule.enabled = data['enabled']
+    return rule
+
+
+def delete_rules_for_tags(tag_ids):
+    """Deletes the rules assigning any of these tags (a list or a select of ids). Does not commit."""
+    db.session.execute(
+        delete(CategorizationRule).where(CategorizationRule.tag_id.in_(tag_ids))
+        .execution_options(synchronize_session=False)
+    )
+    invalidate_matcher()
+
+
+
+# --- Applying Rules ---
+
+
+
+def apply_rules(start_date=None, end_date=None, dry_run=False, progress=None):
+    """
+    Runs the rules over the existing transactions dated in [start_date,
+    end_date] (split parents excluded, as their tags live on the children)
+    and adds the tags they assign. Rows are read and tagged in batches with
+    bulk INSERTs. Does not commit. `progress`, if given, is called with the
+    running report after each batch.
+
+    Returns {'transactions': scanned, 'tagged': transactions that gained
+    tags, 'links': tag links added}.
+    """
+    matcher = get_matcher()
+    report = {'transactions': 0, 'tagged': 0, 'links': 0}
+    if not matcher:
+        return report
+
+    query = select(Transaction.id, Transaction.description, Transaction.amount, Transaction.date) \
+        .where(Transaction.children_flag.is_(False)).order_by(Transaction.id.asc())
+    if start_date is not None:
+        query = query.where(Transaction.date >= start_date)
+    if end_date is not None:
+        query = query.where(Transaction.date <= end_date)
+
+    last_id = 0
+    while True:
+        rows = db.session.execute(query.where(Transaction.id > last_id).limit(APPLY_BATCH_SIZE)).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        report['transactions'] += len(rows)
+
+        current = {}
+        for tx_id, tag_id in db.session.execute(
+            select(transaction_tags.c.transaction_id, transaction_tags.c.tag_id)
+            .where(transaction_tags.c.transaction_id.between(rows[0].id, last_id))
+        ):
+            current.setdefault(tx_id, []).append(tag_id)
+
+        links = []
+        for row in rows:
+            for tag_id in matcher.tags_for(row.description, row.amount, row.date, current.get(row.id, ())):
+                links.append({'transaction_id': row.id, 'tag_id': tag_id})
+        tagged_ids = sorted({link['transaction_id'] for link in links})
+        report['tagged'] += len(tagged_ids)
+        report['links'] += len(links)
+        if links and not dry_run:
+            db.session.execute(insert(transaction_tags), links)
+            # Tag changes count as transaction changes (incremental backups rely on it)
+            db.session.execute(
+                update(Transaction).where(Transaction.id.in_(tagged_ids))
+                .values(updated_at=func.now()).execution_options(synchronize_session=False)
+            )
+        if progress is not None:
+            progress(report)
+    return report
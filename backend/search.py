@@ -0,0 +1,207 @@
+# File path: backend/search.py
+
+from app import app, db
+from models import Transaction, Document
+from filters import apply_transaction_filters
+from sqlalchemy import select, text, bindparam, or_, exists, func, table, column, literal_column
+from sqlalchemy.exc import OperationalError
+import html
+import re
+
+
+# Full-text search over transaction descriptions, notes and document names.
+#
+# On SQLite the text is indexed in an FTS5 table with one row per transaction
+# (rowid = transaction id): description, note, and the original filenames of
+# its documents joined by spaces. The write paths call reindex_transactions()
+# with the ids they touched, in the same DB transaction as the change, so the
+# index never disagrees with a committed ledger; bulk loads rebuild it in one
+# INSERT ... SELECT. Hits are ranked with bm25, with a description match
+# weighing more than a note match and a note match more than a filename one.
+#
+# Databases without FTS5 (PostgreSQL, or a SQLite built without it) fall back
+# to case-insensitive substring matching, newest first, without highlights.
+
+
+SEARCH_TABLE = 'transaction_search'
+SEARCH_WEIGHTS = (10.0, 4.0, 2.0) # description, note, documents
+MAX_QUERY_TERMS = 16
+REINDEX_BATCH_SIZE = 500
+HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE = '\x02', '\x03' # Swapped for <mark> after escaping
+
+search_index_state = {'enabled': None}
+
+INDEXED_ROWS_SQL = (
+    'SELECT t.id, t.description, t.note, '
+    '(SELECT group_concat(d.original_filename, \' \') FROM document d WHERE d.transaction_id = t.id) '
+    'FROM "transaction" t'
+)
+
+
+
+# --- Index Maintenance ---
+
+
+
+def search_index_enabled():
+    """Whether the FTS5 index exists on this database (checked once per process)."""
+    if search_index_state['enabled'] is None:
+        enabled = False
+        if db.engine.dialect.name == 'sqlite':
+            enabled = db.session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': SEARCH_TABLE}
+            ).first() is not None
+        search_index_state['enabled'] = enabled
+    return search_index_state['enabled']
+
+
+def reindex_transactions(transaction_ids):
+    """
+    Refreshes the index rows of these transactions from the ledger: changed
+    ones are re-read and deleted ones dropped. Does not commit.
+    """
+    if not search_index_enabled():
+        return
+    ids = sorted({tx_id for tx_id in transaction_ids if tx_id is not None})
+    if not ids:
+        return
+    db.session.flush()
+    for start in range(0, len(ids), REINDEX_BATCH_SIZE):
+        batch = ids[start:start + REINDEX_BATCH_SIZE]
+        db.session.execute(
+            text(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN :ids').bindparams(bindparam('ids', expanding=True)),
+            {'ids': batch},
+        )
+        db.session.execute(
+            text(f'INSERT INTO {SEARCH_TABLE} (rowid, description, note, documents) {INDEXED_ROWS_SQL} WHERE t.id IN :ids')
+            .bindparams(bindparam('ids', expanding=True)),
+            {'ids': batch},
+        )
+
+
+def rebuild_search_index():
+    """Re-creates every index row from the ledger and optimizes the index. Does not commit."""
+    if not search_index_enabled():
+        return 0
+    db.session.flush()
+    db.session.execute(text(f'DELETE FROM {SEARCH_TABLE}'))
+    result = db.session.execute(text(f'INSERT INTO {SEARCH_TABLE} (rowid, description, note, documents) {INDEXED_ROWS_SQL}'))
+    db.session.execute(text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')"))
+    return result.rowcount
+
+
+def ensure_search_index():
+    """Creates the FTS5 index on SQLite databases that lack it, filling it from the ledger."""
+    if db.engine.dialect.name != 'sqlite' or search_index_enabled():
+        return
+    try:
+        db.session.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+            "description, note, documents, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        ))
+    except OperationalError as e:
+        db.session.rollback()
+        app.logger.warning(f"SQLite FTS5 is not available, search falls back to substring matching: {e}")
+        return
+    search_index_state['enabled'] = True
+    rebuild_search_index()
+    db.session.commit()
+
+
+
+# --- Queries ---
+
+
+
+def search_terms(query_text):
+    """Splits free text into at most MAX_QUERY_TERMS words."""
+    return re.findall(r'\w+', query_text or '')[:MAX_QUERY_TERMS]
+
+
+def fts_match_expression(terms):
+    """
+    Builds an FTS5 query from plain words: every word must match, the last
+    one as a prefix (search as you type). User input never reaches the FTS5
+    query syntax unquoted.
+    """
+    quoted = ['"' + term.replace('"', '""') + '"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def render_highlight(value):
+    """Escapes highlighted index text for HTML and turns the match markers into <mark> tags."""
+    if value is None:
+        return None
+    return html.escape(value).replace(HIGHLIGHT_OPEN, '<mark>').replace(HIGHLIGHT_CLOSE, '</mark>')
+
+
+def filtered_ids_subquery(args):
+    """Ids of the transactions passing the regular list filters in `args`, or None without filters."""
+    filtered = apply_transaction_filters(db.session.query(Transaction.id), args)
+    if filtered.whereclause is None:
+        return None
+    return filtered.subquery()
+
+
+def search_transactions(query_text, args, limit, offset):
+    """
+    Returns (hits, total) for a free-text search, best matches first. Each hit
+    is {transaction_id, rank, highlights}; `args` may narrow the search with
+    the filters of the transaction list.
+    """
+    terms = search_terms(query_text)
+    if not terms:
+        return [], 0
+    filtered = filtered_ids_subquery(args)
+
+    if not search_index_enabled():
+        return fallback_search(terms, filtered, limit, offset)
+
+    index = table(SEARCH_TABLE, column('rowid'))
+    index_ref = literal_column(SEARCH_TABLE)
+    conditions = [index_ref.op('MATCH')(fts_match_expression(terms))]
+    if filtered is not None:
+        conditions.append(index.c.rowid.in_(select(filtered.c.id)))
+
+    rank = func.bm25(index_ref, *SEARCH_WEIGHTS)
+    highlight = lambda column_number: func.highlight(index_ref, column_number, HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE)
+    rows = db.session.execute(
+        select(index.c.rowid, rank, highlight(0), highlight(1), highlight(2))
+        .select_from(index).where(*conditions)
+        .order_by(rank).limit(limit).offset(offset)
+    ).all()
+    total = db.session.execute(select(func.count()).select_from(index).where(*conditions)).scalar()
+
+    hits = [
+        {
+            'transaction_id': tx_id,
+            'rank': round(-rank, 4), # bm25 is lower-is-better; flip it so higher is better
+            'highlights': {
+                'description': render_highlight(description),
+                'note': render_highlight(note),
+                'documents': render_highlight(documents),
+            },
+        }
+        for tx_id, rank, description, note, documents in rows
+    ]
+    return hits, total
+
+
+def fallback_search(terms, filtered, limit, offset):
+    """Substring search for databases without FTS5: every word in any field, newest first."""
+    query = db.session.query(Transaction.id)
+    for term in terms:
+        pattern = f'%{term}%'
+        query = query.filter(or_(
+            Transaction.description.ilike(pattern),
+            Transaction.note.ilike(pattern),
+            exists().where(Document.transaction_id == Transaction.id, Document.original_filename.ilike(pattern)),
+        ))
+    if filtered is not None:
+        query = query.filter(Transaction.id.in_(select(filtered.c.id)))
+    total = query.count()
+    ids = query.order_by(Transaction.date.desc(), Transaction.id.desc()).limit(limit).offset(offset).all()
+    hits = [{'transaction_id': tx_id, 'rank': None, 'highlights': None} for (tx_id,) in ids]
+    return hits, total
@@ -0,0 +1,107 @@
+# File path: backend/serializers.py
+
+from app import db
+from models import Transaction, Tag, Document, transaction_tags
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload, joinedload
+
+
+# Bulk serialization for transaction lists.
+#
+# Calling Transaction.to_json() row by row lazy-loads tags, tag groups and
+# documents for every transaction. The helpers below load a whole list with a
+# fixed number of statements instead:
+#   1. the transactions themselves
+#   2. their (transaction_id, tag_id) associations
+#   3. the tags (joined with their group) referenced by those associations
+#   4. their documents
+# and build each Tag / TagGroup dict once per call, sharing it between rows.
+
+
+
+def transaction_load_options(include_tags=True, include_documents=True):
+    """
+    Eager-loading options for endpoints that serialize a single transaction
+    (or a handful of them) through Transaction.to_json().
+    """
+    options = []
+    if include_tags:
+        options.append(selectinload(Transaction.tags).joinedload(Tag.tag_group))
+    if include_documents:
+        options.append(selectinload(Transaction.documents))
+    return options
+
+
+def build_tag_dicts(tags):
+    """Builds {tag_id: tag_dict} with each TagGroup dict built once and shared."""
+    group_dicts = {}
+    tag_dicts = {}
+    for tag in tags:
+        data = tag.to_json(include_group=False, include_transactions=False)
+        group = tag.tag_group
+        if group is not None:
+            if group.id not in group_dicts:
+                group_dicts[group.id] = group.to_json(include_tags=False)
+            data['tag_group'] = group_dicts[group.id]
+        tag_dicts[tag.id] = data
+    return tag_dicts
+
+
+def serialize_transactions(query, include_tags=True, include_documents=True):
+    """
+    Executes a Transaction query and serializes every row in the same shape as
+    Transaction.to_json(), using a constant number of SQL statements however
+    many rows the query returns.
+
+    The association and document lookups reuse `query` as an id subquery, so
+    filters, ordering and LIMIT apply to them too and no IN (...) list with
+    one parameter per transaction is ever sent to the database.
+    """
+    transactions = query.all()
+    if not transactions:
+        return []
+
+    id_subquery = query.with_entities(Transaction.id).subquery()
+    id_select = select(id_subquery.c.id)
+
+    tags_by_tx = {}
+    if include_tags:
+        links = db.session.execute(
+            select(transaction_tags.c.transaction_id, transaction_tags.c.tag_id)
+            .where(transaction_tags.c.transaction_id.in_(id_select))
+        ).all()
+        tag_ids = {tag_id for _, tag_id in links}
+        tag_dicts = {}
+        if tag_ids:
+            tags = (
+                Tag.query
+                .options(joinedload(Tag.tag_group))
+                .filter(Tag.id.in_(tag_ids))
+                .order_by(Tag.id.asc())
+                .all()
+            )
+            tag_dicts = build_tag_dicts(tags)
+        for tx_id, tag_id in links:
+            if tag_id in tag_dicts:
+                tags_by_tx.setdefault(tx_id, []).append(tag_dicts[tag_id])
+
+    documents_by_tx = {}
+    if include_documents:
+        documents = (
+            Document.query
+            .filter(Document.transaction_id.in_(id_select))
+            .order_by(Document.id.asc())
+            .all()
+        )
+        for doc in documents:
+            documents_by_tx.setdefault(doc.transaction_id, []).append(doc.to_json())
+
+    results = []
+    for tx in transactions:
+        data = tx.to_json(include_tags=False, include_documents=False)
+        if include_tags:
+            data['tags'] = tags_by_tx.get(tx.id, [])
+        if include_documents:
+            data['documents'] = documents_by_tx.get(tx.id, [])
+        results.append(data)
+    return results
@@ -0,0 +1,266 @@
+# File path: backend/splits.py
+
+from app import db
+from models import Transaction, Tag
+from balances import to_decimal, CENTS
+from importing import parse_amount
+from flask import abort
+from sqlalchemy import select, func
+import decimal
+
+
+# Splitting a transaction into children with their amounts, descriptions and
+# tags, re-splitting it and merging children back, each in one commit.
+#
+# A split parent keeps its own amount; it counts in the ledger for that amount
+# minus its children (see balances.py), so whatever the children do not take
+# stays on the parent as its unallocated rest. The allocation of a split is
+# given in one of ALLOCATION_MODES:
+#   amounts       every child gives its amount
+#   percentages   every child gives a percentage of the parent amount (100 at most in total)
+#   equal         the parent amount is shared equally among the children
+# Shares are computed in whole cents by largest remainder: the cents that
+# rounding leaves over go to the children with the largest fractions (the
+# first ones on ties), so the shares always add up exactly.
+#
+# The routes snapshot the family's balance contributions around these helpers,
+# reindex and commit; the helpers only change the session.
+
+
+MAX_SPLIT_CHILDREN = 200
+ALLOCATION_MODES = ('amounts', 'percentages', 'equal')
+HUNDRED = decimal.Decimal(100)
+MAX_DESCRIPTION_LENGTH = Transaction.__table__.c.description.type.length
+
+
+
+# --- Allocation ---
+
+
+
+def allocate_shares(amount, weights, denominator):
+    """
+    Splits `amount` into len(weights) parts, the i-th worth weights[i] /
+    denominator of it, in whole cents by largest remainder. The parts add up
+    to `amount` * sum(weights) / denominator rounded to the cent.
+    """
+    cents = int(to_decimal(amount) / CENTS)
+    sign = -1 if cents < 0 else 1
+    cents = abs(cents)
+    exact = [decimal.Decimal(cents) * weight / denominator for weight in weights]
+    target = int((decimal.Decimal(cents) * sum(weights) / denominator).to_integral_value(rounding=decimal.ROUND_HALF_UP))
+    shares = [int(share) for share in exact]
+    leftover = target - sum(shares)
+    by_fraction = sorted(range(len(exact)), key=lambda i: (-(exact[i] - shares[i]), i))
+    for i in by_fraction[:leftover]:
+        shares[i] += 1
+    return [sign * share * CENTS for share in shares]
+
+
+def check_allocation(parent_amount, allocated):
+    """Aborts with 400 if the children take more than the parent amount (or go the other way)."""
+    parent_amount = to_decimal(parent_amount)
+    if allocated == 0:
+        return
+    if abs(allocated) > abs(parent_amount) or (allocated < 0) != (parent_amount < 0):
+        abort(400, description=f"The children's amounts ({allocated}) exceed the parent amount ({parent_amount}).")
+
+
+
+# --- Request Parsing ---
+
+
+
+def parse_child_entry(entry, position, allocation):
+    """Reads one entry of 'children', aborting with 400 on bad input."""
+    if not isinstance(entry, dict):
+        abort(400, description=f"Child {position}: expected an object.")
+    child = {'id': entry.get('id')}
+    if child['id'] is not None and not isinstance(child['id'], int):
+        abort(400, description=f"Child {position}: 'id' must be an integer.")
+
+    if allocation == 'amounts' and 'amount' in entry:
+        try:
+            child['amount'] = to_decimal(parse_amount(entry['amount']))
+        except ValueError as e:
+            abort(400, description=f"Child {position}: {e}")
+    elif allocation == 'amounts' and child['id'] is None:
+        abort(400, description=f"Child {position}: missing 'amount'.")
+    elif allocation == 'percentages':
+        try:
+            child['percentage'] = decimal.Decimal(str(entry['percentage']).replace(',', '.'))
+        except KeyError:
+            abort(400, description=f"Child {position}: missing 'percentage'.")
+        except decimal.InvalidOperation:
+            abort(400, description=f"Child {position}: 'percentage' must be a number.")
+        if not child['percentage'].is_finite() or child['percentage'] <= 0:
+            abort(400, description=f"Child {position}: 'percentage' must be positive.")
+
+    for field in ('description', 'note'):
+        if field in entry:
+            value = entry[field]
+            if value is not None and not isinstance(value, str):
+                abort(400, description=f"Child {position}: '{field}' must be a string.")
+            if value is not None and len(value) > MAX_DESCRIPTION_LENGTH:
+                abort(400, description=f"Child {position}: '{field}' cannot exceed {MAX_DESCRIPTION_LENGTH} characters.")
+            child[field] = value
+    if 'tag_ids' in entry:
+        tag_ids = entry['tag_ids']
+        if not isinstance(tag_ids, list) or not all(isinstance(tag_id, int) for tag_id in tag_ids):
+            abort(400, description=f"Child {position}: 'tag_ids' must be a list of integers.")
+        child['tag_ids'] = list(dict.fromkeys(tag_ids))
+    return child
+
+
+def parse_split_request(data):
+    """
+    Reads a split request body, aborting with 400 on bad input. Returns
+    (allocation, children, replace); allocation is None for a bare
+    {"num_children": n}, which creates zero-amount children as it always has.
+    """
+    if not isinstance(data, dict):
+        abort(400, description="Request body must be a JSON object.")
+    replace = data.get('replace', False)
+    if not isinstance(replace, bool):
+        abort(400, description="'replace' must be a boolean.")
+    allocation = data.get('allocation')
+    if allocation is not None and allocation not in ALLOCATION_MODES:
+        abort(400, description=f"'allocation' must be one of {', '.join(ALLOCATION_MODES)}.")
+
+    if 'children' in data:
+        entries = data['children']
+        if not isinstance(entries, list) or not entries:
+            abort(400, description="'children' must be a non-empty list.")
+        allocation = allocation or 'amounts'
+    elif 'num_children' in data:
+        try:
+            num_children = int(data['num_children'])
+        except (ValueError, TypeError):
+            abort(400, description="'num_children' must be a valid integer.")
+        if num_children <= 0:
+            abort(400, description="'num_children' must be a positive integer.")
+        if num_children > MAX_SPLIT_CHILDREN:
+            abort(400, description=f"'num_children' cannot exceed {MAX_SPLIT_CHILDREN} for a single split operation.")
+        if allocation not in (None, 'equal'):
+            abort(400, description="With 'num_children', 'allocation' can only be 'equal'; give 'children' for the others.")
+        entries = [{} for _ in range(num_children)]
+    else:
+        abort(400, description="Missing 'children' (or 'num_children') in request body.")
+
+    if len(entries) > MAX_SPLIT_CHILDREN:
+        abort(400, description=f"A split cannot have more than {MAX_SPLIT_CHILDREN} children.")
+    children = [parse_child_entry(entry, position, allocation) for position, entry in enumerate(entries)]
+    child_ids = [child['id'] for child in children if child['id'] is not None]
+    if len(child_ids) != len(set(child_ids)):
+        abort(400, description="A child 'id' is listed more than once.")
+    if allocation == 'percentages' and sum(child['percentage'] for child in children) > HUNDRED:
+        abort(400, description="The percentages add up to more than 100.")
+    return allocation, children, replace
+
+
+def load_tags(tag_ids):
+    """{id: Tag} of `tag_ids`, aborting with 400 if any does not exist."""
+    if not tag_ids:
+        return {}
+    tags = {tag.id: tag for tag in db.session.execute(select(Tag).where(Tag.id.in_(tag_ids))).scalars()}
+    missing = sorted(set(tag_ids) - set(tags))
+    if missing:
+        abort(400, description=f"Tags not found: {', '.join(str(tag_id) for tag_id in missing)}.")
+    return tags
+
+
+
+# --- Splitting and Merging ---
+
+
+
+def split_transaction_children(parent, allocation, children, replace=False):
+    """
+    Applies a parsed split request to `parent`: entries with an 'id' update
+    that child, the others create new children. With `replace`, current
+    children left out of the request are merged back into the parent (see
+    merge_children). Aborts with 400 if the allocation does not fit.
+    Returns (children of the request in order, ids of the created children,
+    ids of the merged children).
+    """
+    current = {child.id: child for child in parent.children}
+    unknown = sorted(child['id'] for child in children if child['id'] is not None and child['id'] not in current)
+    if unknown:
+        abort(400, description=f"Transactions {', '.join(map(str, unknown))} are not children of transaction {parent.id}.")
+
+    if allocation == 'equal':
+        amounts = allocate_shares(parent.amount, [1] * len(children), len(children))
+    elif allocation == 'percentages':
+        amounts = allocate_shares(parent.amount, [child['percentage'] for child in children], HUNDRED)
+    elif allocation == 'amounts':
+        amounts = [child.get('amount', current[child['id']].amount if child['id'] is not None else None)
+                   for child in children]
+    else:
+        amounts = [decimal.Decimal('0.00')] * len(children)
+
+    listed_ids = {child['id'] for child in children}
+    merged = [child for child_id, child in current.items() if replace and child_id not in listed_ids]
+    kept_amounts = [to_decimal(child.amount) for child_id, child in current.items()
+                    if child_id not in listed_ids and not replace]
+    check_allocation(parent.amount, sum(map(to_decimal, amounts)) + sum(kept_amounts))
+
+    tags = load_tags(sorted({tag_id for child in children for tag_id in child.get('tag_ids', ())}))
+    inherited_tags = list(parent.tags)
+    results = []
+    for child, amount in zip(children, amounts):
+        if child['id'] is None:
+            transaction = Transaction(
+                date=parent.date,
+                description=('Sub-item: ' + (parent.description or ''))[:MAX_DESCRIPTION_LENGTH],
+                note=parent.note,
+                amount=amount,
+                tags=inherited_tags,
+                children_flag=False,
+                doc_flag=False,
+            )
+            parent.children.append(transaction)
+        else:
+            transaction = current[child['id']]
+            transaction.amount = amount
+        for field in ('description', 'note'):
+            if field in child:
+                setattr(transaction, field, child[field])
+        if 'tag_ids' in child:
+            new_tags = [tags[tag_id] for tag_id in child['tag_ids']]
+            if child['id'] is not None and set(new_tags) != set(transaction.tags):
+                transaction.updated_at = func.now()
+            transaction.tags = new_tags
+        results.append(transaction)
+
+    merged_ids = merge_children(parent, merged)
+    parent.children_flag = True
+    parent.tags = [] # The tags live on the children
+    db.session.flush()
+    created_ids = [transaction.id for child, transaction in zip(children, results) if child['id'] is None]
+    return results, created_ids, merged_ids
+
+
+def merge_children(parent, children):
+    """
+    Folds `children` back into `parent`: their documents move to the parent and
+    the children are deleted, so their amounts return to the parent's rest.
+    When no child is left the parent is a plain transaction again and takes the
+    tags its children had. Returns the merged ids.
+    """
+    if not children:
+        return []
+    merged_ids = [child.id for child in children]
+    remaining = [child for child in parent.children if child.id not in set(merged_ids)]
+    for child in children:
+        for document in list(child.documents):
+            document.transaction = parent
+            parent.doc_flag = True
+        if not remaining:
+            for tag in child.tags:
+                if tag not in parent.tags:
+                    parent.tags.append(tag)
+        parent.children.remove(child)
+    if not remaining:
+        parent.children_flag = False
+        parent.updated_at = func.now()
+    return merged_ids
@@ -0,0 +1,318 @@
+# File path: backend/statements.py
+
+from flask import abort
+from filters import parse_bool_arg
+from datetime import datetime
+import codecs
+import csv
+import hashlib
+import io
+import re
+
+
+# Streaming statement parsers.
+#
+# Uploaded CSV / OFX statements are read through a text wrapper over the upload
+# stream and turned into transaction rows one at a time by generators, so only
+# the current line (CSV) or the current <STMTTRN> block (OFX) is held in memory.
+# Every record is yielded as (row_number, row, error): `row` is a dict with the
+# keys validate_bulk_rows() expects, or None when the record is invalid.
+
+
+DATE_FORMATS = {
+    'DD/MM/YYYY': '%d/%m/%Y',
+    'MM/DD/YYYY': '%m/%d/%Y',
+    'YYYY-MM-DD': '%Y-%m-%d',
+    'DD-MM-YYYY': '%d-%m-%Y',
+    'MM-DD-YYYY': '%m-%d-%Y',
+}
+DECIMAL_SEPARATORS = ('auto', ',', '.')
+STATEMENT_FORMATS = ('csv', 'ofx')
+DEFAULT_ENCODING = 'windows-1252'  # Same default the import screen has always used
+
+OFX_BLOCK_SIZE = 64 * 1024
+MAX_OFX_RECORD_SIZE = 1024 * 1024
+OFX_TRANSACTION_RE = re.compile(r'<STMTTRN>(.*?)</STMTTRN>', re.S | re.I)
+OFX_FIELD_RE = re.compile(r'<(\w+)>([^<\r\n]*)')
+OFX_ACCOUNT_RE = re.compile(r'<ACCTID>([^<\r\n]+)[<\r\n]', re.I)
+
+
+
+# --- Value Normalization ---
+
+
+
+def standardize_amount(value, decimal_separator='auto'):
+    """
+    Normalizes a statement amount to a plain 'xxxx.xx' string: whitespace and
+    currency symbols are dropped and thousands separators removed.
+
+    With decimal_separator 'auto' the last of ',' and '.' is the decimal
+    separator ('1.234,56' and '1,234.56' both give '1234.56'); a lone ',' is
+    treated as decimal comma, as in the transaction routes.
+    """
+    amount_str = re.sub(r'\s', '', str(value or ''))
+    if decimal_separator == ',':
+        amount_str = amount_str.replace('.', '').replace(',', '.')
+    elif decimal_separator == '.':
+        amount_str = amount_str.replace(',', '')
+    else:
+        last_comma = amount_str.rfind(',')
+        last_dot = amount_str.rfind('.')
+        if last_comma > -1 and last_dot > -1:
+            if last_comma > last_dot:
+                amount_str = amount_str.replace('.', '').replace(',', '.')
+            else:
+                amount_str = amount_str.replace(',', '')
+        elif last_comma > -1:
+            amount_str = amount_str.replace(',', '.')
+    return re.sub(r'[^0-9.\-]', '', amount_str)
+
+
+def standardize_date(value, date_format):
+    """Converts a statement date in `date_format` to YYYY-MM-DD. Raises ValueError."""
+    value = (value or '').strip()
+    try:
+        return datetime.strptime(value, DATE_FORMATS[date_format]).date().isoformat()
+    except ValueError:
+        raise ValueError(f"Invalid date '{value}' for format {date_format}.")
+
+
+def column_index(column):
+    """Converts a spreadsheet column letter ('A', 'F', 'AB') to a 0-based index, else None."""
+    if not re.fullmatch(r'[A-Za-z]{1,3}', column or ''):
+        return None
+    index = 0
+    for letter in column.upper():
+        index = index * 26 + (ord(letter) - ord('A') + 1)
+    return index - 1
+
+
+
+# --- Import Options ---
+
+
+
+def parse_positive_int_option(values, name, default=None):
+    """Parses an optional positive integer option, aborting with 400 on bad input."""
+    value = values.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        number = int(value)
+    except (ValueError, TypeError):
+        abort(400, description=f"'{name}' must be a valid integer.")
+    if number <= 0:
+        abort(400, description=f"'{name}' must be a positive integer.")
+    return number
+
+
+def parse_import_options(values, filename=None):
+    """
+    Reads the statement import options from `values` (request.values), aborting
+    with 400 on bad input.
+
+        format                      'csv' or 'ofx' (default: from the file extension, else csv)
+        encoding                    text encoding of the file (default windows-1252)
+        delimiter                   CSV field delimiter (default ',')
+        has_header                  whether the first CSV line holds column names (default true)
+        date_column                 column letter or header name (default 'A')
+        description_column          column letter or header name (default 'C')
+        amount_column               column letter or header name (default 'F')
+        date_format                 one of DATE_FORMATS (default 'DD/MM/YYYY')
+        decimal_separator           'auto', ',' or '.' (default 'auto')
+        first_row, last_row         1-based range of data rows to import (default: all)
+        key_prefix                  when set, CSV rows get idempotency key '<key_prefix>:<row>'
+    """
+    statement_format = (values.get('format') or '').lower()
+    if not statement_format:
+        extension = (filename or '').rsplit('.', 1)[-1].lower()
+        statement_format = 'ofx' if extension in ('ofx', 'qfx') else 'csv'
+    if statement_format not in STATEMENT_FORMATS:
+        abort(400, description=f"'format' must be one of {', '.join(STATEMENT_FORMATS)}.")
+
+    encoding = values.get('encoding') or DEFAULT_ENCODING
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        abort(400, description=f"Unknown 'encoding': {encoding}.")
+
+    delimiter = values.get('delimiter') or ','
+    if delimiter == '\\t':
+        delimiter = '\t'
+    if len(delimiter) != 1:
+        abort(400, description="'delimiter' must be a single character.")
+
+    date_format = (values.get('date_format') or 'DD/MM/YYYY').upper()
+    if date_format not in DATE_FORMATS:
+        abort(400, description=f"'date_format' must be one of {', '.join(DATE_FORMATS)}.")
+
+    decimal_separator = values.get('decimal_separator') or 'auto'
+    if decimal_separator not in DECIMAL_SEPARATORS:
+        abort(400, description="'decimal_separator' must be 'auto', ',' or '.'.")
+
+    first_row = parse_positive_int_option(values, 'first_row', default=1)
+    last_row = parse_positive_int_option(values, 'last_row')
+    if last_row is not None and last_row < first_row:
+        abort(400, description="'last_row' cannot be before 'first_row'.")
+
+    has_header = True
+    if values.get('has_header'):
+        has_header = parse_bool_arg(values['has_header'], 'has_header')
+
+    return {
+        'format': statement_format,
+        'encoding': encoding,
+        'delimiter': delimiter,
+        'has_header': has_header,
+        'date_column': values.get('date_column') or 'A',
+        'description_column': values.get('description_column') or 'C',
+        'amount_column': values.get('amount_column') or 'F',
+        'date_format': date_format,
+        'decimal_separator': decimal_separator,
+        'first_row': first_row,
+        'last_row': last_row,
+        'key_prefix': values.get('key_prefix') or None,
+    }
+
+
+
+# --- Streaming Parsers ---
+
+
+
+def open_text_stream(binary_stream, encoding):
+    """Wraps a binary upload stream for incremental decoding (a BOM is skipped)."""
+    if codecs.lookup(encoding).name == 'utf-8':
+        encoding = 'utf-8-sig'
+    return io.TextIOWrapper(binary_stream, encoding=encoding, errors='replace', newline='')
+
+
+def resolve_columns(options, header):
+    """Maps the date/description/amount column options to 0-based indexes."""
+    positions = {name.strip(): index for index, name in enumerate(header or [])}
+    columns = {}
+    for key in ('date', 'description', 'amount'):
+        column = options[f'{key}_column']
+        if column in positions:
+            columns[key] = positions[column]
+        elif column_index(column) is not None:
+            columns[key] = column_index(column)
+        else:
+            raise ValueError(f"Column '{column}' not found in the file header.")
+    return columns
+
+
+def iter_csv_rows(text_stream, options):
+    """
+    Yields (row_number, row, error) for every data row of a CSV stream, using
+    the column mapping, date format and decimal separator of `options`.
+    Blank lines are skipped; row numbers count data rows from 1, as in the
+    import screen.
+    """
+    reader = csv.reader(text_stream, delimiter=options['delimiter'])
+    header = None
+    if options['has_header']:
+        header = next((line for line in reader if any(cell.strip() for cell in line)), None)
+        if header is None:
+            return
+    columns = resolve_columns(options, header)
+    needed = max(columns.values())
+
+    row_number = 0
+    for line in reader:
+        if not any(cell.strip() for cell in line):
+            continue
+        row_number += 1
+        if row_number < options['first_row']:
+            continue
+        if options['last_row'] is not None and row_number > options['last_row']:
+            break
+        if len(line) <= needed:
+            yield row_number, None, f"Expected at least {needed + 1} columns, found {len(line)}."
+            continue
+        try:
+            row = {
+                'date': standardize_date(line[columns['date']], options['date_format']),
+                'amount': standardize_amount(line[columns['amount']], options['decimal_separator']),
+                'description': line[columns['description']].strip(),
+            }
+        except ValueError as e:
+            yield row_number, None, str(e)
+            continue
+        if options['key_prefix']:
+            row['idempotency_key'] = f"{options['key_prefix']}:{row_number}"
+        yield row_number, row, None
+
+
+def iter_ofx_records(text_stream, block_size=OFX_BLOCK_SIZE):
+    """
+    Yields (account_id, fields) for every <STMTTRN> block of an OFX stream
+    (SGML or XML flavour). The stream is read in blocks and only the part after
+    the last complete transaction is kept between reads.
+    """
+    buffer = ''
+    account_id = None
+    while True:
+        block = text_stream.read(block_size)
+        buffer += block
+        if account_id is None:
+            account_match = OFX_ACCOUNT_RE.search(buffer)
+            if account_match:
+                account_id = account_match.group(1).strip()
+
+        last_end = 0
+        for match in OFX_TRANSACTION_RE.finditer(buffer):
+            fields = {name.upper(): value.strip() for name, value in OFX_FIELD_RE.findall(match.group(1))}
+            yield account_id, fields
+            last_end = match.end()
+        buffer = buffer[last_end:]
+        if not block:
+            return
+
+        start = buffer.upper().rfind('<STMTTRN>')
+        buffer = buffer[start:] if start != -1 else buffer[-256:]
+        if len(buffer) > MAX_OFX_RECORD_SIZE:
+            raise ValueError("OFX transaction block is too large.")
+
+
+def ofx_idempotency_key(account_id, fitid):
+    """
+    'ofx:' and the sha256 of the account and FITID: banks send FITIDs of up
+    to 255 characters, more than an idempotency key holds.
+    """
+    return 'ofx:' + hashlib.sha256(f"{account_id or ''}:{fitid}".encode()).hexdigest()
+
+
+def iter_ofx_rows(text_stream, options):
+    """Yields (row_number, row, error) for every transaction of an OFX stream."""
+    row_number = 0
+    for account_id, fields in iter_ofx_records(text_stream):
+        row_number += 1
+        if row_number < options['first_row']:
+            continue
+        if options['last_row'] is not None and row_number > options['last_row']:
+            break
+        posted = fields.get('DTPOSTED', '')
+        try:
+            date = datetime.strptime(posted[:8], '%Y%m%d').date().isoformat()
+        except ValueError:
+            yield row_number, None, f"Invalid DTPOSTED '{posted}'."
+            continue
+        row = {
+            'date': date,
+            'amount': standardize_amount(fields.get('TRNAMT'), options['decimal_separator']),
+            'description': fields.get('MEMO') or fields.get('NAME') or '',
+        }
+        # FITID is the bank's own unique id for the transaction
+        if fields.get('FITID'):
+            row['idempotency_key'] = ofx_idempotency_key(account_id, fields['FITID'])
+        yield row_number, row, None
+
+
+def iter_statement_rows(binary_stream, options):
+    """Yields (row_number, row, error) for a CSV or OFX upload stream."""
+    text_stream = open_text_stream(binary_stream, options['encoding'])
+    if options['format'] == 'ofx':
+        return iter_ofx_rows(text_stream, options)
+    return iter_csv_rows(text_stream, options)
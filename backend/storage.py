@@ -0,0 +1,636 @@
+# File path: backend/storage.py
+
+from app import app, db
+from models import Document, DocumentBlob, Transaction, UploadSession
+from sqlalchemy import select, update, delete, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from datetime import datetime, timedelta, timezone
+import contextlib
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError: # Not on Windows; chunk writes are then only serialized within a process
+    fcntl = None
+
+
+# Content-addressed document storage.
+#
+# Uploaded files are hashed while they are streamed to a temporary file in
+# UPLOAD_FOLDER and then kept once per distinct content, as a DocumentBlob named
+# after its sha256. Every Document pointing at a blob counts as one reference;
+# the file is unlinked only when the last reference goes, and only after the DB
+# transaction that dropped it has been committed. By then an upload of the same
+# content may have created the blob again, at the same path: new blob files are
+# moved into place under blob_file_lock(), and a released file is unlinked
+# under it only if no blob row points at it and it is still the file that was
+# released.
+#
+# Documents uploaded before blobs existed have no blob_sha256 and keep their
+# own file under Document.stored_filename; documents backed by a blob leave it
+# empty.
+#
+# Blob files are fanned out over two levels of directories named after the
+# first hex digits of their hash ('ab/cd/abcd....pdf'), so no directory grows
+# past a few thousand entries. Files stored flat by earlier versions are moved
+# by migrate_layout(), which can run while the app serves requests: a file is
+# hard-linked at its new path before the row is updated, and the old path is
+# unlinked only a batch later. Lookups fall back to the other layout, so a
+# request that read a row just before it was updated still finds the file.
+
+
+BLOB_CHUNK_SIZE = 1024 * 1024
+INCOMING_PREFIX = '.incoming-'
+BLOB_LOCK_FILENAME = '.blob-lock'
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2
+LAYOUT_BATCH_SIZE = 500
+LAYOUT_GRACE_SECONDS = 5
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024 # Suggested to clients; any chunk size is accepted
+UPLOAD_SESSION_TTL = timedelta(days=1)
+CONTENT_SIGNATURES = {
+    'pdf': (b'%PDF-',),
+    'png': (b'\x89PNG\r\n\x1a\n',),
+    'jpg': (b'\xff\xd8\xff',),
+    'jpeg': (b'\xff\xd8\xff',),
+    'gif': (b'GIF87a', b'GIF89a'),
+}
+
+
+
+def sharded_name(filename):
+    """Fan-out path of a flat filename: 'abcdef.pdf' -> 'ab/cd/abcdef.pdf'."""
+    prefixes = [filename[level * SHARD_WIDTH:(level + 1) * SHARD_WIDTH] for level in range(SHARD_LEVELS)]
+    return '/'.join(prefixes + [filename])
+
+
+def resolve_storage_name(name):
+    """
+    Returns `name`, or its counterpart in the other layout when only that one
+    exists on disk (a file being moved by migrate_layout()).
+    """
+    upload_folder = app.config['UPLOAD_FOLDER']
+    if os.path.exists(os.path.join(upload_folder, name)):
+        return name
+    other = os.path.basename(name) if '/' in name else sharded_name(name)
+    if os.path.exists(os.path.join(upload_folder, other)):
+        return other
+    return name
+
+
+def document_storage_name(document):
+    """Path of a document's file relative to UPLOAD_FOLDER."""
+    if document.blob_sha256 is not None:
+        return resolve_storage_name(document.blob.stored_filename)
+    return resolve_storage_name(document.stored_filename)
+
+
+def document_file_path(document):
+    """Absolute path of a document's file."""
+    return os.path.join(app.config['UPLOAD_FOLDER'], document_storage_name(document))
+
+
+def blob_filename(sha256, extension):
+    """Name of a new blob's file; the extension of its first upload is kept for convenience."""
+    return sharded_name(f"{sha256}.{extension}" if extension else sha256)
+
+
+def move_into_place(source_path, stored_filename, upload_folder=None):
+    """Moves a file to `stored_filename` under UPLOAD_FOLDER, creating its shard directories."""
+    target_path = os.path.join(upload_folder or app.config['UPLOAD_FOLDER'], stored_filename)
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    os.replace(source_path, target_path)
+    return target_path
+
+
+def hash_file(path):
+    """sha256 hex digest and size of a file, read BLOB_CHUNK_SIZE bytes at a time."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as source:
+        while True:
+            chunk = source.read(BLOB_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def spool_and_hash(stream, upload_folder):
+    """
+    Copies a binary stream to a temporary file in `upload_folder`, hashing it
+    on the way. Returns (temp_path, sha256, size).
+    """
+    temp_path = os.path.join(upload_folder, f"{INCOMING_PREFIX}{uuid.uuid4()}")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(temp_path, 'wb') as target:
+            while True:
+                chunk = stream.read(BLOB_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                target.write(chunk)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return temp_path, digest.hexdigest(), size
+
+
+blob_files_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def blob_file_lock():
+    """
+    Serializes placing new blob files and unlinking released ones, across
+    threads and (with flock) the processes sharing UPLOAD_FOLDER.
+    """
+    with blob_files_lock:
+        if fcntl is None:
+            yield
+            return
+        upload_folder = app.config['UPLOAD_FOLDER']
+        os.makedirs(upload_folder, exist_ok=True)
+        with open(os.path.join(upload_folder, BLOB_LOCK_FILENAME), 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def file_identity(path):
+    """(device, inode) of a file, None if it does not exist; tells a file from its replacement."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_dev, stat.st_ino)
+
+
+def upsert_for(dialect_name):
+    """The INSERT construct with ON CONFLICT support for a dialect (SQLite or PostgreSQL)."""
+    return postgresql.insert if dialect_name == 'postgresql' else sqlite.insert
+
+
+def insert_blob(sha256, stored_filename, size):
+    """
+    Inserts the row of a new blob whose file is already at `stored_filename`.
+    A concurrent upload of the same content may have inserted it first: the
+    row then gains a reference instead of the insert failing, and the file is
+    dropped if the winner named its own differently. Returns the DocumentBlob.
+    Does not commit.
+    """
+    statement = upsert_for(db.session.get_bind().dialect.name)(DocumentBlob).values(
+        sha256=sha256, stored_filename=stored_filename, size=size, ref_count=1)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[DocumentBlob.sha256], set_={'ref_count': DocumentBlob.ref_count + 1}))
+    blob = db.session.get(DocumentBlob, sha256, populate_existing=True)
+    if blob.stored_filename != stored_filename:
+        with blob_file_lock():
+            if db.session.execute(select(DocumentBlob.sha256).where(DocumentBlob.stored_filename == stored_filename)).first() is None:
+                remove_files([os.path.join(app.config['UPLOAD_FOLDER'], stored_filename)])
+    return blob
+
+
+def adopt_blob(temp_path, sha256, size, extension):
+    """
+    Turns a hashed temporary file into a reference to the blob with that
+    content: the file becomes the blob if it is new, otherwise it is dropped
+    and the existing blob gains a reference. Returns the DocumentBlob.
+    Does not commit.
+    """
+    blob = db.session.get(DocumentBlob, sha256)
+    if blob is not None:
+        os.remove(temp_path)
+        db.session.execute(
+            update(DocumentBlob)
+            .where(DocumentBlob.sha256 == sha256)
+            .values(ref_count=DocumentBlob.ref_count + 1)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.refresh(blob)
+        return blob
+
+    stored_filename = blob_filename(sha256, extension)
+    with blob_file_lock():
+        move_into_place(temp_path, stored_filename)
+    return insert_blob(sha256, stored_filename, size)
+
+
+def store_upload(stream, extension):
+    """Stores an upload stream as a blob reference. Returns the DocumentBlob. Does not commit."""
+    temp_path, sha256, size = spool_and_hash(stream, app.config['UPLOAD_FOLDER'])
+    try:
+        return adopt_blob(temp_path, sha256, size, extension)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def release_documents(documents):
+    """
+    Drops the file references of documents that have been deleted in this
+    session (the deletion is flushed first, so no row still points at a blob
+    being removed). Returns the files to unlink once the deletion has been
+    committed, as (path, identity) pairs for remove_released_files().
+    Does not commit.
+    """
+    db.session.flush()
+    paths = []
+    released = {}
+    for document in documents:
+        if document.blob_sha256 is None:
+            paths.append(os.path.join(app.config['UPLOAD_FOLDER'], document.stored_filename))
+        else:
+            released[document.blob_sha256] = released.get(document.blob_sha256, 0) + 1
+
+    for sha256, count in released.items():
+        db.session.execute(
+            update(DocumentBlob)
+            .where(DocumentBlob.sha256 == sha256)
+            .values(ref_count=DocumentBlob.ref_count - count)
+            .execution_options(synchronize_session=False)
+        )
+    if released:
+        orphaned = db.session.execute(
+            select(DocumentBlob.sha256, DocumentBlob.stored_filename)
+            .where(DocumentBlob.sha256.in_(released), DocumentBlob.ref_count <= 0)
+        ).all()
+        if orphaned:
+            db.session.execute(
+                delete(DocumentBlob)
+                .where(DocumentBlob.sha256.in_([sha256 for sha256, _ in orphaned]))
+                .execution_options(synchronize_session=False)
+            )
+            paths.extend(os.path.join(app.config['UPLOAD_FOLDER'], stored_filename) for _, stored_filename in orphaned)
+    return [(path, file_identity(path)) for path in paths]
+
+
+def remove_released_files(released):
+    """
+    Unlinks the files returned by release_documents(), after the commit. A file
+    is kept if a blob row points at it again or if it was replaced since it was
+    released: an upload of the same content recreated the blob meanwhile, and
+    may not have committed yet.
+    """
+    if not released:
+        return
+    upload_folder = app.config['UPLOAD_FOLDER']
+    names = {os.path.relpath(path, upload_folder): (path, identity) for path, identity in released}
+    with blob_file_lock():
+        referenced = set(db.session.execute(
+            select(DocumentBlob.stored_filename).where(DocumentBlob.stored_filename.in_(list(names)))
+        ).scalars())
+        remove_files([path for name, (path, identity) in names.items()
+                      if name not in referenced and file_identity(path) == identity])
+
+
+def discard_uncommitted_blob(sha256, stored_filename):
+    """After a rollback, removes the file of a blob whose row was never committed."""
+    with blob_file_lock():
+        if db.session.get(DocumentBlob, sha256) is None:
+            remove_files([os.path.join(app.config['UPLOAD_FOLDER'], stored_filename)])
+
+
+def remove_files(paths):
+    """Unlinks files whose last reference is gone; failures are logged, not raised."""
+    for path in paths:
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except OSError as e:
+            app.logger.error(f"Error deleting file {path}: {e}")
+
+
+def family_documents(transaction):
+    """Documents of a transaction and, for a split parent, of its children."""
+    return Document.query.join(Transaction, Transaction.id == Document.transaction_id).filter(
+        or_(Transaction.id == transaction.id, Transaction.parent_id == transaction.id)
+    ).all()
+
+
+def documents_with_content(sha256, exclude_document_id=None):
+    """Other documents holding the same content (an index lookup on blob_sha256)."""
+    query = Document.query.filter(Document.blob_sha256 == sha256)
+    if exclude_document_id is not None:
+        query = query.filter(Document.id != exclude_document_id)
+    return query.order_by(Document.id.asc()).all()
+
+
+
+# --- Chunked Uploads ---
+
+
+
+# Running sha256 of uploads in progress, {session_id: (digest, offset)}, so
+# completing an upload does not read the file again. Lost on restart, in
+# which case the file is hashed on completion.
+upload_digests = {}
+upload_digests_lock = threading.Lock()
+
+
+def upload_session_path(session_id):
+    """The file chunks of an upload session are appended to, inside UPLOAD_FOLDER."""
+    return os.path.join(app.config['UPLOAD_FOLDER'], f"{INCOMING_PREFIX}{session_id}")
+
+
+def upload_extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+
+def sync_received_size(upload):
+    """
+    Sets received_size from the file on disk, which is authoritative: a chunk
+    cut off by a dropped connection still counts up to its last full write.
+    """
+    path = upload_session_path(upload.id)
+    upload.received_size = os.path.getsize(path) if os.path.exists(path) else 0
+    return upload.received_size
+
+
+class UploadConflict(ValueError):
+    """A chunk that cannot be written now: wrong offset, or another chunk of the upload is being written."""
+
+
+# Uploads with a chunk being written by this process (flock() alone does not
+# exclude two threads that opened the file separately on every platform)
+writing_uploads = set()
+
+
+@contextlib.contextmanager
+def upload_write_lock(session_id, target):
+    """
+    Holds an upload's file exclusively while one chunk is checked and written,
+    across threads and (with flock) processes. Raises UploadConflict at once
+    if another request holds it: that request may still be streaming the very
+    chunk a client retried.
+    """
+    with upload_digests_lock:
+        if session_id in writing_uploads:
+            raise UploadConflict("Another chunk of this upload is being written.")
+        writing_uploads.add(session_id)
+    try:
+        if fcntl is not None:
+            try:
+                fcntl.flock(target.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadConflict("Another chunk of this upload is being written.")
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(target.fileno(), fcntl.LOCK_UN)
+    finally:
+        with upload_digests_lock:
+            writing_uploads.discard(session_id)
+
+
+def append_chunk(upload, stream, offset):
+    """
+    Appends a chunk read from `stream` at `offset`, which must be where the
+    previous chunk ended. The offset is checked and the chunk written under
+    upload_write_lock(). Checks the leading bytes of the file against the
+    extension on the first chunk. Raises UploadConflict for a wrong offset or
+    a concurrent write, ValueError for a chunk past the declared size or
+    mismatched content. Does not commit.
+    """
+    path = upload_session_path(upload.id)
+    with open(path, 'ab') as target, upload_write_lock(upload.id, target):
+        received = sync_received_size(upload)
+        if offset != received:
+            raise UploadConflict(f"Expected offset {received}, got {offset}.")
+        signatures = CONTENT_SIGNATURES.get(upload_extension(upload.original_filename)) if offset == 0 else None
+
+        with upload_digests_lock:
+            digest, digest_offset = upload_digests.pop(upload.id, (None, None))
+        if digest is None and offset == 0:
+            digest, digest_offset = hashlib.sha256(), 0
+        if digest_offset != offset:
+            digest = None
+
+        written = 0
+        try:
+            while True:
+                chunk = stream.read(BLOB_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if offset + written + len(chunk) > upload.total_size:
+                    raise ValueError(f"Chunk goes past the declared size of {upload.total_size} bytes.")
+                if signatures is not None:
+                    if not any(chunk.startswith(signature) for signature in signatures):
+                        raise ValueError("File content does not match its extension.")
+                    signatures = None
+                target.write(chunk)
+                written += len(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+        except ValueError:
+            written = 0
+            target.flush()
+            target.truncate(offset)
+            raise
+        finally:
+            target.flush()
+            upload.received_size = offset + written
+    if digest is not None:
+        with upload_digests_lock:
+            upload_digests[upload.id] = (digest, upload.received_size)
+    return written
+
+
+def complete_upload(upload):
+    """
+    Turns a fully received upload into a blob reference (the file is renamed,
+    not copied). Returns the DocumentBlob. Raises ValueError when bytes are
+    missing. Does not commit.
+    """
+    size = sync_received_size(upload)
+    if size != upload.total_size:
+        raise ValueError(f"Upload incomplete: {size} of {upload.total_size} bytes received.")
+    path = upload_session_path(upload.id)
+    with upload_digests_lock:
+        digest, digest_offset = upload_digests.pop(upload.id, (None, None))
+    if digest is not None and digest_offset == size:
+        sha256 = digest.hexdigest()
+    else:
+        sha256, size = hash_file(path)
+    return adopt_blob(path, sha256, size, upload_extension(upload.original_filename))
+
+
+def discard_upload(upload):
+    """Deletes an upload session and its partial file. Does not commit."""
+    with upload_digests_lock:
+        upload_digests.pop(upload.id, None)
+    db.session.delete(upload)
+    return upload_session_path(upload.id)
+
+
+def expire_upload_sessions():
+    """Drops upload sessions untouched for UPLOAD_SESSION_TTL, with their files. Commits."""
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - UPLOAD_SESSION_TTL # naive UTC, like server_default
+    expired = UploadSession.query.filter(UploadSession.updated_at < cutoff).all()
+    paths = [discard_upload(upload) for upload in expired]
+    if paths:
+        db.session.commit()
+        remove_files(paths)
+    return len(paths)
+
+
+# --- Layout Migration ---
+
+
+
+layout_migration_lock = threading.Lock()
+layout_migration_state = {'running': False}
+
+
+def link_or_copy(source_path, stored_filename):
+    """Makes the file at `source_path` also available at `stored_filename` (a hard link where possible)."""
+    target_path = os.path.join(app.config['UPLOAD_FOLDER'], stored_filename)
+    if os.path.exists(target_path):
+        return
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        shutil.copy2(source_path, target_path)
+
+
+def layout_migration_remaining():
+    """Number of flat blobs and legacy documents still to migrate."""
+    flat_blobs = DocumentBlob.query.filter(~DocumentBlob.stored_filename.contains('/')).count()
+    legacy_documents = Document.query.filter(Document.blob_sha256.is_(None)).count()
+    return flat_blobs + legacy_documents
+
+
+def migrate_layout_batch(batch_size=LAYOUT_BATCH_SIZE, after_document_id=0):
+    """
+    Migrates up to `batch_size` files and commits: flat blobs move to their
+    fan-out path, and documents older than content-addressed storage become
+    references to a blob (sharing it when the content is already stored).
+    Legacy documents are visited in id order after `after_document_id`, so
+    ones whose file is missing are not retried within a run.
+
+    Returns a dict with the counts, the old paths to unlink once readers
+    have moved on, and the last document id visited.
+    """
+    upload_folder = app.config['UPLOAD_FOLDER']
+    result = {'blobs': 0, 'documents': 0, 'missing': 0, 'old_paths': [], 'last_document_id': after_document_id}
+
+    blobs = DocumentBlob.query.filter(~DocumentBlob.stored_filename.contains('/')) \
+        .order_by(DocumentBlob.sha256.asc()).limit(batch_size).all()
+    for blob in blobs:
+        old_path = os.path.join(upload_folder, blob.stored_filename)
+        new_name = sharded_name(blob.stored_filename)
+        if os.path.exists(old_path):
+            link_or_copy(old_path, new_name)
+            result['old_paths'].append(old_path)
+        elif not os.path.exists(os.path.join(upload_folder, new_name)):
+            app.logger.warning(f"Blob file not found while migrating: {old_path}")
+            result['missing'] += 1
+        blob.stored_filename = new_name
+        result['blobs'] += 1
+
+    documents = Document.query.filter(Document.blob_sha256.is_(None), Document.id > after_document_id) \
+        .order_by(Document.id.asc()).limit(batch_size - len(blobs)).all()
+    for document in documents:
+        result['last_document_id'] = document.id
+        old_path = os.path.join(upload_folder, document.stored_filename)
+        if not os.path.isfile(old_path):
+            app.logger.warning(f"Document file not found while migrating: {old_path} for document ID {document.id}")
+            result['missing'] += 1
+            continue
+        sha256, size = hash_file(old_path)
+        blob = db.session.get(DocumentBlob, sha256)
+        if blob is not None:
+            db.session.execute(
+                update(DocumentBlob)
+                .where(DocumentBlob.sha256 == sha256)
+                .values(ref_count=DocumentBlob.ref_count + 1)
+                .execution_options(synchronize_session=False)
+            )
+        else:
+            extension = document.stored_filename.rsplit('.', 1)[1] if '.' in document.stored_filename else ''
+            stored_filename = blob_filename(sha256, extension)
+            link_or_copy(old_path, stored_filename)
+            insert_blob(sha256, stored_filename, size)
+        document.blob_sha256 = sha256
+        document.stored_filename = None
+        result['old_paths'].append(old_path)
+        result['documents'] += 1
+
+    db.session.commit()
+    return result
+
+
+def migrate_layout(batch_size=LAYOUT_BATCH_SIZE, grace_seconds=LAYOUT_GRACE_SECONDS, progress=None):
+    """
+    Runs migrate_layout_batch() until nothing is left. Safe to interrupt and
+    run again: every batch is committed on its own and the state lives in the
+    rows themselves. Old paths are unlinked one batch (and finally
+    `grace_seconds`) after the commit that moved them, so requests that read
+    a row just before it changed can still open the file.
+    `progress`, if given, is called with the running totals after each batch.
+    """
+    totals = {'blobs': 0, 'documents': 0, 'missing': 0}
+    pending_paths = []
+    last_document_id = 0
+    while True:
+        result = migrate_layout_batch(batch_size, last_document_id)
+        last_document_id = result['last_document_id']
+        remove_files(pending_paths)
+        pending_paths = result['old_paths']
+        for key in totals:
+            totals[key] += result[key]
+        if progress is not None:
+            progress(totals)
+        if not result['blobs'] and not result['documents'] and not result['missing']:
+            break
+    if pending_paths:
+        time.sleep(grace_seconds)
+        remove_files(pending_paths)
+    return totals
+
+
+def start_layout_migration(batch_size=LAYOUT_BATCH_SIZE):
+    """
+    Starts migrate_layout() in a background thread unless one is running.
+    Returns False if it was already running.
+    """
+    with layout_migration_lock:
+        if layout_migration_state['running']:
+            return False
+        layout_migration_state.clear()
+        layout_migration_state.update(running=True, started_at=time.time(), blobs=0, documents=0, missing=0, error=None)
+
+    def run():
+        with app.app_context():
+            try:
+                migrate_layout(batch_size, progress=layout_migration_state.update)
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"Upload layout migration failed: {e}", exc_info=True)
+                layout_migration_state['error'] = str(e)
+            finally:
+                db.session.remove()
+                layout_migration_state['running'] = False
+
+    threading.Thread(target=run, name='upload-layout-migration', daemon=True).start()
+    return True
+
+
+def layout_migration_status():
+    """Progress of the background layout migration and what is left to migrate."""
+    return dict(layout_migration_state, remaining=layout_migration_remaining())
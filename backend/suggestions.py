@@ -0,0 +1,307 @@
+# File path: backend/suggestions.py
+
+from app import db
+from models import Transaction, Tag, transaction_tags
+from importing import normalize_description
+from sqlalchemy import select, func
+from datetime import timedelta
+import decimal
+import math
+import sys
+import threading
+import time
+
+
+# Tag suggestions learned from the tags already assigned.
+#
+# Every transaction with at least one tag (split parents excluded, their tags
+# live on the children) is a training example. Its features are the words of
+# its normalized description (digits-only words dropped), the pairs of
+# consecutive words, and the sign and order of magnitude of its amount.
+#
+# Each tag group is a multinomial naive Bayes classifier whose classes are the
+# group's tags plus "none of them" (examples without a tag of the group), so a
+# group the transaction does not belong to is not forced onto its likeliest
+# tag. The model only keeps counts, which makes training incremental: each
+# refresh reads the transactions updated since the last one (tag changes bump
+# Transaction.updated_at), takes their old counts out and adds the new ones.
+# The last few seconds are read again in case of rows committed late with an
+# older timestamp; rows read again unchanged are skipped. Deleted transactions
+# are reconciled every MODEL_RECONCILE_SECONDS.
+#
+# The model lives in memory, one per process. Scoring a transaction walks the
+# counts of its ~10-30 features, so it takes well under a millisecond.
+
+
+SMOOTHING = 1.0 # Laplace
+DEFAULT_MIN_CONFIDENCE = 0.3
+DEFAULT_SUGGESTION_LIMIT = 5
+TRAIN_BATCH_SIZE = 5000
+MODEL_REFRESH_SECONDS = 1.0 # Minimum time between two checks for new tagging
+MODEL_RECONCILE_SECONDS = 30.0 # Minimum time between two checks for deleted transactions
+WATERMARK_SLACK = timedelta(seconds=5)
+
+
+def amount_features(amount):
+    """Sign and order of magnitude of an amount, as two features (none for a missing or non-finite amount)."""
+    if amount is None:
+        return ()
+    amount = decimal.Decimal(amount)
+    if not amount.is_finite():
+        return ()
+    sign = '$in' if amount > 0 else '$out'
+    # The exponent of the leading digit, exact for any size (amounts under 1 share magnitude 0)
+    magnitude = max(amount.adjusted(), 0) if amount else -1
+    return (sign, f'{sign}{magnitude}')
+
+
+def extract_features(description, amount):
+    """Features of one transaction (interned, as many examples share them)."""
+    words = [word for word in normalize_description(description).split() if len(word) > 1 and not word.isdigit()]
+    features = words + [f'{first}_{second}' for first, second in zip(words, words[1:])]
+    features.extend(amount_features(amount))
+    return tuple(sys.intern(feature) for feature in features)
+
+
+
+# --- Model ---
+
+
+
+class TagModel:
+    """
+    Counts behind the per-group naive Bayes classifiers. Not thread-safe by
+    itself: the module-level lock guards it.
+    """
+
+    def __init__(self):
+        self.examples = {} # {transaction id: (features, tag ids, tag group ids)}
+        self.tag_groups = {} # {tag id: (tag group id, tag name)}
+        self.seen = {} # {transaction id: updated_at when last read}, to skip rows read again unchanged
+        self.latest = None # Latest updated_at read
+        self.checked_at = 0.0
+        self.reconciled_at = 0.0
+
+        self.all_counts = {} # {feature: occurrences in every example}
+        self.all_total = 0
+        self.tag_docs = {} # {tag id: examples}
+        self.tag_counts = {} # {feature: {tag id: occurrences}}
+        self.tag_total = {} # {tag id: feature occurrences}
+        self.group_docs = {} # {group id: examples with a tag of the group}
+        self.group_counts = {} # {feature: {group id: occurrences}}
+        self.group_total = {}
+
+    def update_counts(self, features, tag_ids, groups, sign):
+        """Adds (sign=1) or removes (sign=-1) one example."""
+        n = len(features) * sign
+        self.all_total += n
+        for tag_id in tag_ids:
+            self.tag_docs[tag_id] = self.tag_docs.get(tag_id, 0) + sign
+            self.tag_total[tag_id] = self.tag_total.get(tag_id, 0) + n
+        for group_id in groups:
+            self.group_docs[group_id] = self.group_docs.get(group_id, 0) + sign
+            self.group_total[group_id] = self.group_total.get(group_id, 0) + n
+        for feature in features:
+            self.all_counts[feature] = self.all_counts.get(feature, 0) + sign
+            for key, per_key in ((tag_ids, self.tag_counts.setdefault(feature, {})),
+                                 (groups, self.group_counts.setdefault(feature, {}))):
+                for item in key:
+                    per_key[item] = per_key.get(item, 0) + sign
+                    if not per_key[item]:
+                        del per_key[item]
+            if not self.all_counts[feature]:
+                del self.all_counts[feature], self.tag_counts[feature], self.group_counts[feature]
+
+    def set_example(self, transaction_id, features, tag_ids):
+        """Replaces what the model knows of a transaction; no tags removes it."""
+        old = self.examples.pop(transaction_id, None)
+        if old is not None:
+            self.update_counts(*old, sign=-1)
+        if tag_ids:
+            tag_ids = tuple(sorted(tag_ids))
+            # Groups are kept with the example so removing it undoes exactly what adding it did
+            groups = tuple({self.tag_groups[tag_id][0] for tag_id in tag_ids if tag_id in self.tag_groups})
+            self.examples[transaction_id] = (features, tag_ids, groups)
+            self.update_counts(features, tag_ids, groups, sign=1)
+
+    def score(self, features, current_tag_ids=(), min_confidence=DEFAULT_MIN_CONFIDENCE):
+        """
+        Suggested tags for a feature tuple: per tag group the likeliest tag, if
+        it beats "none of the group" and reaches `min_confidence`. Groups the
+        transaction already has a tag of are skipped. Best first.
+        """
+        examples = len(self.examples)
+        if not examples:
+            return []
+        features = [feature for feature in features if feature in self.all_counts] # Unseen words say nothing
+        vocabulary_prior = SMOOTHING * len(self.all_counts)
+        log_smoothing = math.log(SMOOTHING)
+        n = len(features)
+
+        group_tags = {}
+        for tag_id, docs in self.tag_docs.items():
+            if docs > 0 and tag_id in self.tag_groups:
+                group_tags.setdefault(self.tag_groups[tag_id][0], []).append(tag_id)
+        taken = {self.tag_groups[tag_id][0] for tag_id in current_tag_ids if tag_id in self.tag_groups}
+
+        # Sparse sums: only the (feature, tag) pairs seen in training differ from the smoothing term
+        tag_sums = {}
+        for feature in features:
+            for tag_id, count in self.tag_counts[feature].items():
+                tag_sums[tag_id] = tag_sums.get(tag_id, 0.0) + math.log(count + SMOOTHING) - log_smoothing
+
+        suggestions = []
+        for group_id, tag_ids in group_tags.items():
+            if group_id in taken:
+                continue
+            none_docs = examples - self.group_docs.get(group_id, 0)
+            # "None of the group" only competes when some examples have no tag of the group
+            classes = len(tag_ids) + (1 if none_docs else 0)
+            scores = {}
+            for tag_id in tag_ids:
+                scores[tag_id] = (
+                    math.log(self.tag_docs[tag_id] + 1) - math.log(examples + classes)
+                    - n * math.log(self.tag_total[tag_id] + vocabulary_prior)
+                    + n * log_smoothing + tag_sums.get(tag_id, 0.0)
+                )
+            if none_docs:
+                none_total = self.all_total - self.group_total.get(group_id, 0)
+                scores[None] = (
+                    math.log(none_docs + 1) - math.log(examples + classes)
+                    - n * math.log(none_total + vocabulary_prior)
+                    + sum(math.log(self.all_counts[f] - self.group_counts[f].get(group_id, 0) + SMOOTHING) for f in features)
+                )
+            best_tag = max(scores, key=scores.get)
+            top = scores[best_tag]
+            confidence = 1.0 / sum(math.exp(score - top) for score in scores.values())
+            if best_tag is not None and confidence >= min_confidence:
+                suggestions.append({
+                    'tag_id': best_tag,
+                    'tag_name': self.tag_groups[best_tag][1],
+                    'tag_group_id': group_id,
+                    'confidence': round(confidence, 4),
+                })
+        suggestions.sort(key=lambda suggestion: -suggestion['confidence'])
+        return suggestions
+
+
+
+# --- Training ---
+
+
+
+model = TagModel()
+model_lock = threading.Lock()
+
+
+def train_rows(rows, database_now):
+    """
+    Feeds (id, description, amount, children_flag, updated_at) rows with their
+    current tags to the model. `database_now` is the database clock when the
+    rows were read.
+    """
+    rows = [row for row in rows if model.seen.get(row.id) != row.updated_at]
+    ids = [row.id for row in rows]
+    tags = {}
+    for start in range(0, len(ids), TRAIN_BATCH_SIZE):
+        for tx_id, tag_id in db.session.execute(
+            select(transaction_tags.c.transaction_id, transaction_tags.c.tag_id)
+            .where(transaction_tags.c.transaction_id.in_(ids[start:start + TRAIN_BATCH_SIZE]))
+        ):
+            tags.setdefault(tx_id, []).append(tag_id)
+    for row in rows:
+        tag_ids = () if row.children_flag else tags.get(row.id, ())
+        features = extract_features(row.description, row.amount) if tag_ids else ()
+        model.set_example(row.id, features, tag_ids)
+        # Timestamps may have a resolution of one second: a row updated in the current
+        # second can change again without a new updated_at, so it is not skipped yet
+        if row.updated_at < database_now:
+            model.seen[row.id] = row.updated_at
+
+
+def refresh_model(force=False):
+    """
+    Brings the model up to date with the tagging committed since the last
+    refresh, at most once per MODEL_REFRESH_SECONDS unless `force`. The first
+    call trains on the whole ledger. Returns the number of rows read.
+    """
+    now = time.monotonic()
+    with model_lock:
+        if not force and now - model.checked_at < MODEL_REFRESH_SECONDS:
+            return 0
+        model.checked_at = now
+        model.tag_groups = {tag_id: (group_id, name) for tag_id, group_id, name in
+                            db.session.execute(select(Tag.id, Tag.tag_group_id, Tag.name))}
+
+        database_now = db.session.execute(select(func.now())).scalar().replace(microsecond=0)
+        query = select(Transaction.id, Transaction.description, Transaction.amount,
+                       Transaction.children_flag, Transaction.updated_at).order_by(Transaction.id.asc())
+        if model.latest is not None:
+            query = query.where(Transaction.updated_at >= model.latest - WATERMARK_SLACK)
+        read = 0
+        last_id = 0
+        while True:
+            rows = db.session.execute(query.where(Transaction.id > last_id).limit(TRAIN_BATCH_SIZE)).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            read += len(rows)
+            train_rows(rows, database_now)
+            batch_latest = max(row.updated_at for row in rows)
+            model.latest = batch_latest if model.latest is None else max(model.latest, batch_latest)
+
+        if force or now - model.reconciled_at >= MODEL_RECONCILE_SECONDS:
+            model.reconciled_at = now
+            reconcile_deleted()
+        return read
+
+
+def reconcile_deleted():
+    """Drops the transactions that were deleted (deletions leave no updated_at behind)."""
+    existing = set(db.session.execute(select(Transaction.id)).scalars())
+    for tx_id in [tx_id for tx_id in model.examples if tx_id not in existing]:
+        model.set_example(tx_id, (), ())
+    for tx_id in [tx_id for tx_id in model.seen if tx_id not in existing]:
+        del model.seen[tx_id]
+
+
+def reset_model():
+    """Forgets everything; the next refresh retrains from scratch (after a restore, for instance)."""
+    global model
+    with model_lock:
+        model = TagModel()
+
+
+
+# --- Suggestions ---
+
+
+
+def suggest_tags(description, amount, current_tag_ids=(), min_confidence=DEFAULT_MIN_CONFIDENCE,
+                 limit=DEFAULT_SUGGESTION_LIMIT):
+    """Suggested tags for one transaction (which need not be saved yet)."""
+    refresh_model()
+    features = extract_features(description, amount)
+    with model_lock:
+        return model.score(features, current_tag_ids, min_confidence)[:limit]
+
+
+def suggest_tags_batch(items, min_confidence=DEFAULT_MIN_CONFIDENCE, limit=DEFAULT_SUGGESTION_LIMIT):
+    """
+    Suggestions for many (description, amount, current tag ids) items at once,
+    such as an import batch: one refresh and one lock for the whole batch.
+    """
+    refresh_model()
+    features = [extract_features(description, amount) for description, amount, _ in items]
+    with model_lock:
+        return [model.score(item_features, current_tag_ids, min_confidence)[:limit]
+                for item_features, (_, _, current_tag_ids) in zip(features, items)]
+
+
+def model_status():
+    with model_lock:
+        return {
+            'examples': len(model.examples),
+            'features': len(model.all_counts),
+            'tags': sum(1 for docs in model.tag_docs.values() if docs > 0),
+        }
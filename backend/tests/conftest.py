@@ -0,0 +1,114 @@
+# File path: backend/tests/conftest.py
+
+import functools
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The backend is a flat set of modules (app, models, routes, ...), so tests
+# import them the same way wsgi.py does. The database and upload folder must
+# point at a scratch location *before* `app` is imported, because app.py
+# creates the schema at import time.
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND_DIR)
+
+_scratch_dir = tempfile.mkdtemp(prefix='categorization_tests_')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_scratch_dir, 'test.db')
+os.environ['UPLOAD_FOLDER'] = os.path.join(_scratch_dir, 'uploads')
+
+from app import app as flask_app, db  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+class StatementRecorder:
+    """
+    Base of the recorders below: hands every SQL statement executed on the
+    engine while active to record(), just before it runs.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def record(self, cursor, statement, parameters, executemany):
+        raise NotImplementedError
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.record(cursor, statement, parameters, executemany)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+
+
+class QueryCounter(StatementRecorder):
+    """Records every SQL statement executed on the engine while active."""
+
+    def __init__(self, engine):
+        super().__init__(engine)
+        self.statements = []
+
+    def record(self, cursor, statement, parameters, executemany):
+        self.statements.append(statement)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+class QueryPlanRecorder(StatementRecorder):
+    """
+    Records the SQLite query plan (EXPLAIN QUERY PLAN) of every SELECT, UPDATE
+    and DELETE executed on the engine while active, as (statement, [plan lines]).
+    Plans are taken just before the statement runs, so temporary tables it
+    reads still exist.
+    """
+
+    EXPLAINED = ('SELECT', 'UPDATE', 'DELETE')
+
+    def __init__(self, engine):
+        super().__init__(engine)
+        self.plans = []
+
+    def record(self, cursor, statement, parameters, executemany):
+        if executemany or not statement.lstrip().upper().startswith(self.EXPLAINED):
+            return
+        explain_cursor = cursor.connection.cursor()
+        try:
+            explain_cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+            self.plans.append((statement, [row[3] for row in explain_cursor.fetchall()]))
+        finally:
+            explain_cursor.close()
+
+
+# Each recorder fixture returns a factory, so a test can record several
+# separate stretches: `with count_queries() as counter: ...`
+
+
+@pytest.fixture
+def count_queries(app):
+    return functools.partial(QueryCounter, db.engine)
+
+
+@pytest.fixture
+def record_query_plans(app):
+    return functools.partial(QueryPlanRecorder, db.engine)
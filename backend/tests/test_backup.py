@@ -0,0 +1,134 @@
+# File path: backend/tests/test_backup.py
+
+import datetime
+import decimal
+import io
+import json
+import os
+import threading
+import zipfile
+
+import restore as restore_module
+from app import app, db
+from models import Document, Transaction, Tag, TagGroup
+from storage import INCOMING_PREFIX
+
+
+# Full and incremental archives restore to the ledger they were taken from. An
+# incremental packs what was written after its base's snapshot, whatever the
+# timestamps of the rows say. A restore that fails leaves neither rows nor
+# files behind.
+
+
+def seed_ledger():
+    group = TagGroup(name='Spending')
+    tag = Tag(name='Groceries', tag_group=group)
+    db.session.add_all([group, tag] + [
+        Transaction(date=datetime.date(2024, 1, day), amount=decimal.Decimal(f'-{day}.50'), description=f'Shop {day}')
+        for day in range(1, 4)
+    ])
+    db.session.commit()
+    return tag.id, [tx.id for tx in Transaction.query.order_by(Transaction.id)]
+
+
+def ledger_state():
+    return {
+        tx.id: (str(tx.amount), tx.description, sorted(tag.name for tag in tx.tags))
+        for tx in Transaction.query.order_by(Transaction.id)
+    }
+
+
+def restore(client, *archives):
+    return client.post('/api/backup/restore', data={
+        'replace': 'true',
+        'file': [(io.BytesIO(archive), f'backup_{position}.zip') for position, archive in enumerate(archives)],
+    })
+
+
+def test_full_and_incremental_restore_the_ledger(client):
+    tag_id, (first, second, third) = seed_ledger()
+    full = client.get('/api/backup/all').data
+
+    client.patch(f'/api/transactions/update/{first}', json={'amount': '-99.00'})
+    client.post(f'/api/transactions/{third}/tags', json={'tag_id': tag_id})
+    client.delete(f'/api/transactions/delete/{second}')
+    client.post('/api/transactions/new', json={'date': '2024-01-09', 'amount': '250.00', 'description': 'Refund'})
+    # Written after the full backup with a timestamp from before it, as a long
+    # import that started earlier and committed late would leave it
+    with db.engine.begin() as connection:
+        connection.execute(Transaction.__table__.insert().values(
+            date=datetime.date(2024, 1, 10), amount=decimal.Decimal('-7.00'), description='Late import',
+            updated_at=datetime.datetime(2000, 1, 1), created_at=datetime.datetime(2000, 1, 1)))
+    expected = ledger_state()
+
+    incremental = client.get('/api/backup/incremental?base=latest').data
+    packed = json.loads(zipfile.ZipFile(io.BytesIO(incremental)).read('transactions.json'))
+    assert {tx['description'] for tx in packed} == {'Shop 1', 'Shop 3', 'Refund', 'Late import'}
+
+    # A third archive chains onto the incremental and holds only what changed since
+    client.patch(f'/api/transactions/update/{third}', json={'description': 'Corner shop'})
+    expected_after = ledger_state()
+    again = client.get('/api/backup/incremental?base=latest').data
+    packed = json.loads(zipfile.ZipFile(io.BytesIO(again)).read('transactions.json'))
+    assert [tx['description'] for tx in packed] == ['Corner shop']
+
+    response = restore(client, full, incremental)
+    assert response.status_code == 200, response.get_json()
+    db.session.expire_all()
+    assert ledger_state() == expected
+
+    response = restore(client, again, full, incremental)
+    assert response.status_code == 200, response.get_json()
+    db.session.expire_all()
+    assert ledger_state() == expected_after
+
+
+def test_a_chain_missing_a_listed_transaction_is_refused(client):
+    seed_ledger()
+    full = client.get('/api/backup/all').data
+    client.post('/api/transactions/new', json={'date': '2024-01-09', 'amount': '250.00', 'description': 'Refund'})
+    incremental = zipfile.ZipFile(io.BytesIO(client.get('/api/backup/incremental?base=latest').data))
+
+    # The incremental still lists the new row in its manifest but lost its content
+    damaged = io.BytesIO()
+    with zipfile.ZipFile(damaged, 'w') as archive:
+        for name in incremental.namelist():
+            content = b'[]' if name == 'transactions.json' else incremental.read(name)
+            archive.writestr(name, content)
+
+    response = restore(client, full, damaged.getvalue())
+    assert response.status_code == 400
+    assert 'none of the archives' in response.get_json()['error']
+    assert Transaction.query.count() == 4
+
+
+def test_a_failed_document_extraction_leaves_no_files(client, monkeypatch):
+    _, (first, second, _) = seed_ledger()
+    for tx_id, content in ((first, b'%PDF-1.4 one'), (second, b'%PDF-1.4 two')):
+        response = client.post(f'/api/transactions/{tx_id}/documents',
+                               data={'file': (io.BytesIO(content), 'receipt.pdf')})
+        assert response.status_code == 201
+    full = client.get('/api/backup/all').data
+
+    real_spool_and_hash = restore_module.spool_and_hash
+    calls = []
+    lock = threading.Lock()
+
+    def spool_and_hash(stream, upload_folder):
+        with lock:
+            calls.append(stream)
+            failing = len(calls) == 2
+        if failing:
+            raise OSError("No space left on device")
+        return real_spool_and_hash(stream, upload_folder)
+
+    monkeypatch.setattr(restore_module, 'spool_and_hash', spool_and_hash)
+    response = restore(client, full)
+    assert response.status_code == 500
+    assert len(calls) == 2
+
+    upload_folder = app.config['UPLOAD_FOLDER']
+    leftovers = [name for _, _, names in os.walk(upload_folder) for name in names
+                 if name.startswith(INCOMING_PREFIX)]
+    assert leftovers == []
+    assert Document.query.count() == 2
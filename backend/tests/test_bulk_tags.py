@@ -0,0 +1,60 @@
+# File path: backend/tests/test_bulk_tags.py
+
+import datetime
+import decimal
+
+from app import db
+from models import Transaction, Tag, TagGroup
+
+
+# Bulk retagging: by ids or by filter, with the changed transactions' updated_at
+# bumped. A filter is resolved once, before the links it filters on change.
+
+
+def seed_tagged(num_transactions=5):
+    group = TagGroup(name='Categories')
+    old, new, other = (Tag(name=name, tag_group=group) for name in ('Old', 'New', 'Other'))
+    db.session.add_all([group, old, new, other])
+    db.session.add_all([
+        Transaction(date=datetime.date(2024, 1, 1) + datetime.timedelta(days=i), amount=decimal.Decimal('-5.00'),
+                    description=f'Shop {i}', tags=[old])
+        for i in range(num_transactions)
+    ] + [Transaction(date=datetime.date(2024, 2, 1), amount=decimal.Decimal('-1.00'), description='Other', tags=[other])])
+    db.session.commit()
+    return old.id, new.id, other.id
+
+
+def tag_names():
+    return sorted((tx.description, [tag.name for tag in tx.tags]) for tx in Transaction.query.all())
+
+
+def test_retagging_by_filter_moves_the_links(client):
+    old, new, other = seed_tagged()
+
+    response = client.post('/api/transactions/tags/bulk', json={'filter': {'tag_ids': [old]}, 'add': [new], 'remove': [old]})
+
+    assert response.status_code == 200
+    assert response.get_json() == {'transactions': 5, 'changed': 5, 'added': 5, 'removed': 5}
+    assert db.session.get(Tag, old).transactions.count() == 0
+    assert db.session.get(Tag, new).transactions.count() == 5
+    assert db.session.get(Tag, other).transactions.count() == 1
+
+
+def test_retagging_by_ids_skips_links_already_there(client):
+    old, new, _ = seed_tagged()
+    ids = [tx.id for tx in db.session.get(Tag, old).transactions]
+    client.post('/api/transactions/tags/bulk', json={'transaction_ids': ids[:2], 'add': [new]})
+
+    response = client.post('/api/transactions/tags/bulk', json={'transaction_ids': ids, 'add': [new]})
+
+    assert response.get_json() == {'transactions': 5, 'changed': 3, 'added': 3, 'removed': 0}
+    assert db.session.get(Tag, new).transactions.count() == 5
+
+
+def test_bulk_retagging_rejects_bad_requests(client):
+    old, new, _ = seed_tagged(1)
+
+    assert client.post('/api/transactions/tags/bulk', json={'filter': {}, 'add': [new]}).status_code == 400
+    assert client.post('/api/transactions/tags/bulk', json={'transaction_ids': [1], 'add': [new], 'remove': [new]}).status_code == 400
+    assert client.post('/api/transactions/tags/bulk', json={'transaction_ids': [1], 'add': [999]}).status_code == 404
+    assert db.session.get(Tag, old).transactions.count() == 1
@@ -0,0 +1,46 @@
+# File path: backend/tests/test_bulk_transactions.py
+
+from models import Transaction
+
+
+# Amounts that Transaction.amount (Numeric(10, 2)) cannot hold are per-row
+# errors, never stored rows that break the balances afterwards.
+
+
+BAD_AMOUNTS = ['Infinity', '-Infinity', 'NaN', 'sNaN', '123456789012', '99999999.995', 'abc']
+
+
+def test_out_of_range_amounts_are_row_errors(client):
+    rows = [{'date': '2024-01-02', 'amount': '12,345', 'description': 'Bakery'}] + [
+        {'date': '2024-01-02', 'amount': amount, 'description': f'Bad {amount}'} for amount in BAD_AMOUNTS
+    ]
+
+    response = client.post('/api/transactions/bulk', json={'transactions': rows, 'atomic': False})
+
+    assert response.status_code == 201
+    body = response.get_json()
+    assert body['created'] == 1 and body['failed'] == len(BAD_AMOUNTS)
+    assert [result['status'] for result in body['results']] == ['created'] + ['error'] * len(BAD_AMOUNTS)
+    assert str(Transaction.query.one().amount) == '12.35' # Rounded to the cent
+    assert client.get('/api/transactions/daily-balances').status_code == 200
+    assert client.get('/api/transactions/balance').status_code == 200
+
+
+def test_an_atomic_batch_with_a_bad_amount_imports_nothing(client):
+    rows = [{'date': '2024-01-02', 'amount': '-4.20'}, {'date': '2024-01-03', 'amount': 'Infinity'}]
+
+    response = client.post('/api/transactions/bulk', json={'transactions': rows})
+
+    assert response.status_code == 400
+    assert [result['index'] for result in response.get_json()['results']] == [1]
+    assert Transaction.query.count() == 0
+
+
+def test_single_transaction_routes_refuse_bad_amounts(client):
+    for amount in BAD_AMOUNTS:
+        response = client.post('/api/transactions/new', json={'date': '2024-01-02', 'amount': amount})
+        assert response.status_code == 400, amount
+
+    tx_id = client.post('/api/transactions/new', json={'date': '2024-01-02', 'amount': '-1.005'}).get_json()['id']
+    assert client.patch(f'/api/transactions/update/{tx_id}', json={'amount': 'NaN'}).status_code == 400
+    assert str(Transaction.query.one().amount) == '-1.01'
@@ -0,0 +1,41 @@
+# File path: backend/tests/test_catalog.py
+
+from app import db
+from models import Counter, Tag, TagGroup
+from sqlalchemy import update
+
+
+# The catalog version is a database row, so a change committed by another
+# process is seen by the next request here even though the bodies are cached
+# in this one.
+
+
+def test_catalog_is_revalidated_against_the_committed_version(client):
+    group_id = client.post('/api/tag-groups', json={'name': 'Spending'}).get_json()['id']
+    client.post('/api/tags', json={'name': 'Coffee', 'tag_group_id': group_id})
+
+    response = client.get('/api/tag-groups')
+    etag = response.headers['ETag']
+    assert [tag['name'] for tag in response.get_json()[0]['tags']] == ['Coffee']
+    assert client.get('/api/tag-groups', headers={'If-None-Match': etag}).status_code == 304
+
+    client.post('/api/tags', json={'name': 'Bakery', 'tag_group_id': group_id})
+    response = client.get('/api/tag-groups', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert {tag['name'] for tag in response.get_json()[0]['tags']} == {'Bakery', 'Coffee'}
+
+
+def test_a_change_committed_elsewhere_drops_the_cached_body(client):
+    group_id = client.post('/api/tag-groups', json={'name': 'Spending'}).get_json()['id']
+    etag = client.get('/api/tags').headers['ETag']
+
+    # Another process adds a tag and bumps the version in the same commit
+    with db.engine.begin() as connection:
+        connection.execute(Tag.__table__.insert().values(name='Rent', tag_group_id=group_id))
+        connection.execute(update(Counter).where(Counter.name == 'catalog').values(value=Counter.value + 1))
+
+    response = client.get('/api/tags', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert [tag['name'] for tag in response.get_json()] == ['Rent']
+    assert TagGroup.query.count() == 1
@@ -0,0 +1,183 @@
+# File path: backend/tests/test_jobs.py
+
+import datetime
+import decimal
+import io
+import os
+import time
+import zipfile
+
+import jobs
+import statements
+from app import db
+from models import Transaction, Tag, TagGroup, CategorizationRule, Job
+from sqlalchemy import update
+
+
+# Jobs run in the thread pool of the test process and are followed through the
+# API, as the frontend does. Cancellation is checked with jobs run by hand,
+# where its timing can be controlled. Recovery resubmits only the queued jobs
+# no live process has accepted.
+
+
+def seed_rule_ledger(num_transactions=30):
+    group = TagGroup(name='Spending')
+    tag = Tag(name='Coffee', tag_group=group)
+    db.session.add_all([group, tag, CategorizationRule(tag=tag, pattern='coffee', match_type='contains')])
+    db.session.add_all([
+        Transaction(date=datetime.date(2024, 1, 1) + datetime.timedelta(days=i),
+                    amount=decimal.Decimal('-3.50'), description=f'Coffee shop {i}')
+        for i in range(num_transactions)
+    ])
+    db.session.commit()
+    return tag
+
+
+def wait_for_job(client, job_id, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(f'/api/jobs/{job_id}').get_json()
+        if job['status'] in jobs.FINISHED_STATUSES:
+            return job
+        assert time.monotonic() < deadline, job
+        time.sleep(0.05)
+
+
+class HeldExecutor:
+    """Stands in for the thread pool so that queued jobs stay queued."""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        self.submitted.append(args)
+
+
+def test_rule_run_job_reports_like_the_synchronous_route(client):
+    tag = seed_rule_ledger()
+
+    response = client.post('/api/jobs/apply-rules', json={'start_date': '2024-01-01'})
+    assert response.status_code == 202
+    assert response.get_json()['kind'] == 'apply_rules'
+
+    job = wait_for_job(client, response.get_json()['id'])
+    assert job['status'] == 'succeeded', job
+    assert job['result']['tagged'] == 30
+    assert client.get(f"/api/jobs/{job['id']}/result").get_json()['tagged'] == 30
+    assert tag.transactions.count() == 30
+
+
+def test_backup_job_result_is_the_archive(client):
+    seed_rule_ledger(3)
+
+    job = wait_for_job(client, client.post('/api/jobs/backup', json={}).get_json()['id'])
+    assert job['status'] == 'succeeded', job
+    assert job['has_result_file']
+
+    response = client.get(f"/api/jobs/{job['id']}/result")
+    assert response.status_code == 200
+    assert 'attachment; filename=categorization_backup_' in response.headers['Content-Disposition']
+    assert zipfile.ZipFile(io.BytesIO(response.data)).testzip() is None
+    assert job['result']['size'] == len(response.data)
+
+
+def test_import_job_imports_the_uploaded_statement(client):
+    statement = b'Date,Ref,Description,x,y,Amount\n01/02/2024,1,Bakery,,,-4.20\n02/02/2024,2,Salary,,,1500.00\n'
+
+    response = client.post('/api/jobs/import', data={'file': (io.BytesIO(statement), 'statement.csv')})
+    assert response.status_code == 202
+    job = wait_for_job(client, response.get_json()['id'])
+
+    assert job['status'] == 'succeeded', job
+    assert job['result']['created'] == 2
+    assert job['params']['filename'] == 'statement.csv'
+    assert Transaction.query.count() == 2
+    assert not any(os.path.exists(jobs.job_file_path(job['id'], suffix)) for suffix in ('input', 'result'))
+
+
+def test_cancelling_a_queued_job_keeps_it_from_running(client, monkeypatch):
+    executor = HeldExecutor()
+    monkeypatch.setitem(jobs.job_executor_state, 'executor', executor)
+    monkeypatch.setitem(jobs.job_executor_state, 'pid', os.getpid())
+    seed_rule_ledger()
+
+    job_id = client.post('/api/jobs/apply-rules', json={}).get_json()['id']
+    assert client.get(f'/api/jobs/{job_id}').get_json()['status'] == 'queued'
+    assert client.get(f'/api/jobs/{job_id}/result').status_code == 409
+
+    response = client.post(f'/api/jobs/{job_id}/cancel')
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'cancelled'
+    assert client.post(f'/api/jobs/{job_id}/cancel').status_code == 409
+
+    jobs.run_job(*executor.submitted[0]) # The worker finds it no longer queued
+    assert client.get(f'/api/jobs/{job_id}').get_json()['status'] == 'cancelled'
+    assert Tag.query.one().transactions.count() == 0
+
+
+def test_running_job_stops_at_its_next_progress_report(client, monkeypatch):
+    executor = HeldExecutor()
+    monkeypatch.setitem(jobs.job_executor_state, 'executor', executor)
+    monkeypatch.setitem(jobs.job_executor_state, 'pid', os.getpid())
+    monkeypatch.setattr(jobs, 'JOB_PERSIST_SECONDS', 0)
+    seed_rule_ledger()
+
+    job_id = client.post('/api/jobs/apply-rules', json={}).get_json()['id']
+    # A cancellation requested by another process once this one has claimed the job
+    original_apply_rules = jobs.apply_rules
+
+    def apply_rules_cancelled_meanwhile(*args, **kwargs):
+        with db.engine.begin() as connection:
+            connection.execute(update(Job).where(Job.id == job_id).values(cancel_requested=True))
+        return original_apply_rules(*args, **kwargs)
+
+    monkeypatch.setattr(jobs, 'apply_rules', apply_rules_cancelled_meanwhile)
+    jobs.run_job(job_id)
+
+    job = client.get(f'/api/jobs/{job_id}').get_json()
+    assert job['status'] == 'cancelled'
+    assert Tag.query.one().transactions.count() == 0 # The partial run was rolled back
+
+
+def test_import_job_fails_with_the_summary_of_a_partly_read_statement(client, monkeypatch):
+    monkeypatch.setattr(statements, 'MAX_OFX_RECORD_SIZE', 1024)
+    statement = (b'<OFX><STMTTRN><DTPOSTED>20240301<TRNAMT>-4.20<FITID>A<MEMO>Bakery</STMTTRN>'
+                 b'<STMTTRN><MEMO>' + b'x' * 70 * 1024)
+
+    response = client.post('/api/jobs/import', data={'file': (io.BytesIO(statement), 'statement.ofx')})
+    job = wait_for_job(client, response.get_json()['id'])
+
+    assert job['status'] == 'failed'
+    assert 'too large' in job['error']
+    assert job['result']['created'] == 1
+    assert Transaction.query.count() == 1
+
+
+def test_recovery_leaves_queued_jobs_a_live_process_has_accepted(client, monkeypatch):
+    executor = HeldExecutor()
+    monkeypatch.setitem(jobs.job_executor_state, 'executor', executor)
+    monkeypatch.setitem(jobs.job_executor_state, 'pid', os.getpid())
+    monkeypatch.setattr(jobs, 'queued_jobs', set())
+    seed_rule_ledger()
+
+    own_id = client.post('/api/jobs/apply-rules', json={}).get_json()['id']
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    long_ago = now - datetime.timedelta(seconds=jobs.JOB_STALE_SECONDS + 60)
+    db.session.add_all([
+        Job(id='elsewhere-live', kind='apply_rules', status='queued', params='{}', worker='elsewhere:1', heartbeat_at=now),
+        Job(id='elsewhere-gone', kind='apply_rules', status='queued', params='{}', worker='elsewhere:2', heartbeat_at=long_ago),
+        Job(id='unaccepted', kind='apply_rules', status='queued', params='{}'),
+    ])
+    db.session.commit()
+    # All of them have waited longer than a recovery pass
+    with db.engine.begin() as connection:
+        connection.execute(update(Job).values(created_at=long_ago))
+
+    jobs.maintain_jobs(force=True)
+    assert sorted(job_id for job_id, in executor.submitted) == sorted([own_id, 'elsewhere-gone', 'unaccepted'])
+    db.session.expire_all()
+    assert db.session.get(Job, 'elsewhere-gone').worker == jobs.worker_id()
+
+    # Nothing is resubmitted while it waits in this process's queue
+    jobs.maintain_jobs(force=True)
+    assert len(executor.submitted) == 3
@@ -0,0 +1,47 @@
+# File path: backend/tests/test_listing.py
+
+import datetime
+import decimal
+
+from app import db
+from models import Transaction
+
+
+# GET /api/transactions lists a filter's rows in the same (date, id) order
+# whether or not it is paginated, and rejects malformed filter ids with a 400.
+
+
+def seed_same_days(num_transactions=12):
+    db.session.add_all([
+        Transaction(date=datetime.date(2024, 1, 1) + datetime.timedelta(days=i % 3),
+                    amount=decimal.Decimal('-1.00'), description=f'Row {i}')
+        for i in range(num_transactions)
+    ])
+    db.session.commit()
+
+
+def paged_ids(client, query_string):
+    ids, cursor = [], None
+    while True:
+        url = f'/api/transactions?limit=5&{query_string}' + (f'&cursor={cursor}' if cursor else '')
+        page = client.get(url).get_json()
+        ids += [tx['id'] for tx in page['transactions']]
+        if not page['has_more']:
+            return ids
+        cursor = page['next_cursor']
+
+
+def test_unpaginated_listing_uses_the_page_order(client):
+    seed_same_days()
+
+    for query_string in ('', 'order=asc', 'min_amount=-5'):
+        listed = [tx['id'] for tx in client.get(f'/api/transactions?{query_string}').get_json()]
+        assert listed == paged_ids(client, query_string)
+
+
+def test_empty_single_id_filters_are_rejected(client):
+    seed_same_days(1)
+
+    for query_string in ('tag_group_id=,', 'parent_id=,', 'parent_id=1,2', 'tag_group_id=x'):
+        response = client.get(f'/api/transactions?{query_string}')
+        assert response.status_code == 400, query_string
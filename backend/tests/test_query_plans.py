@@ -0,0 +1,110 @@
+# File path: backend/tests/test_query_plans.py
+
+import datetime
+import decimal
+import re
+
+from app import db
+from models import Transaction, Tag, TagGroup
+from importing import find_duplicates
+from sqlalchemy import select, text
+
+
+# The hot query shapes must be answered from indexes. Every statement a flow
+# runs is EXPLAINed as it executes, and none may scan the transaction or
+# transaction_tags tables in full. The ledger is ANALYZEd, as a real one would
+# be, so the planner works from statistics: with every parent_id NULL, a plain
+# parent_id index looks useless to it.
+
+# 'SCAN t' reads a whole table; 'SCAN t USING INDEX i' walks an index in order (and stops at LIMIT)
+FULL_SCAN = re.compile(r'^SCAN (TABLE )?(transaction|transaction_tags)\b(?!.*\bINDEX\b)')
+
+
+def seed_ledger(num_transactions=400):
+    groups = [TagGroup(name=f'Group {i}') for i in range(2)]
+    tags = [Tag(name=f'Tag {i}', tag_group=groups[i % 2]) for i in range(8)]
+    db.session.add_all(groups + tags)
+    db.session.add_all([
+        Transaction(
+            date=datetime.date(2024, 1, 1) + datetime.timedelta(days=i % 90),
+            amount=decimal.Decimal(i % 150) + decimal.Decimal('0.99'),
+            description=f'Store {i % 40}',
+            tags=[tags[i % 8]],
+        )
+        for i in range(num_transactions)
+    ])
+    db.session.commit()
+    db.session.execute(text('ANALYZE'))
+    db.session.commit()
+
+
+def full_scans(recorder):
+    return [(statement, line) for statement, plan in recorder.plans for line in plan if FULL_SCAN.match(line)]
+
+
+def plans_using(recorder, index_name):
+    return [(statement, plan) for statement, plan in recorder.plans
+            if any(index_name in line for line in plan)]
+
+
+def test_listing_pages_walk_the_date_id_index(client, record_query_plans):
+    seed_ledger()
+
+    cursor = client.get('/api/transactions?limit=50').get_json()['next_cursor']
+    for query_string in ('limit=50', f'limit=50&cursor={cursor}',
+                        'limit=50&order=asc&start_date=2024-02-01&end_date=2024-02-15'):
+        with record_query_plans() as recorder:
+            assert client.get(f'/api/transactions?{query_string}').status_code == 200
+
+        assert full_scans(recorder) == []
+        page_statement, page_plan = recorder.plans[0]
+        assert any('ix_transaction_date_id' in line for line in page_plan), page_plan
+        # The index yields rows in page order, so LIMIT stops the walk early
+        assert not any('TEMP B-TREE FOR ORDER BY' in line for line in page_plan), page_plan
+
+
+def test_tag_filters_read_only_the_tag_index(client, record_query_plans):
+    seed_ledger()
+    tag = Tag.query.first()
+
+    for query_string in (f'limit=50&tag_ids={tag.id}', f'limit=50&tag_group_id={tag.tag_group_id}'):
+        with record_query_plans() as recorder:
+            assert client.get(f'/api/transactions?{query_string}').status_code == 200
+        assert full_scans(recorder) == []
+        assert plans_using(recorder, 'COVERING INDEX ix_transaction_tags_tag_id_transaction_id')
+
+    with record_query_plans() as recorder:
+        assert tag.transactions.all()
+    assert full_scans(recorder) == []
+    assert plans_using(recorder, 'ix_transaction_tags_tag_id_transaction_id')
+
+
+def test_duplicate_check_searches_amount_then_date(app, record_query_plans):
+    seed_ledger()
+    incoming = {'date': datetime.date(2024, 1, 10), 'amount': decimal.Decimal('9.99'), 'description': 'Store 9'}
+
+    with record_query_plans() as recorder:
+        matches = find_duplicates([(0, incoming, None)], date_window_days=3)
+
+    assert matches
+    assert full_scans(recorder) == []
+    plans = plans_using(recorder, 'ix_transaction_amount_date_description (amount=? AND date>? AND date<?)')
+    assert plans, recorder.plans
+
+
+def test_delete_transaction_finds_children_through_the_partial_index(client, record_query_plans):
+    seed_ledger()
+    # Split after ANALYZE, as a ledger is mostly imported, then split now and then
+    parent_ids = db.session.execute(select(Transaction.id).limit(2)).scalars().all()
+    for parent_id in parent_ids:
+        assert client.post(f'/api/transactions/{parent_id}/split', json={'num_children': 2}).status_code == 201
+    child_id = db.session.execute(
+        select(Transaction.id).where(Transaction.parent_id == parent_ids[0])
+    ).scalars().first()
+
+    for transaction_id in (child_id, parent_ids[1]):
+        with record_query_plans() as recorder:
+            assert client.delete(f'/api/transactions/delete/{transaction_id}').status_code == 200
+
+        assert full_scans(recorder) == []
+        assert plans_using(recorder, 'ix_transaction_children (parent_id=?)')
@@ -0,0 +1,79 @@
+# File path: backend/tests/test_serialization_queries.py
+
+import datetime
+import decimal
+
+import pytest
+
+from app import db
+from models import Transaction, Tag, TagGroup, Document
+
+
+# transactions + tag links + tags (joined with groups) + documents
+EXPECTED_LISTING_QUERIES = 4
+
+
+def seed_ledger(num_transactions):
+    groups = [TagGroup(name=f'Group {i}') for i in range(3)]
+    tags = [Tag(name=f'Tag {i}', tag_group=groups[i % 3]) for i in range(6)]
+    db.session.add_all(groups + tags)
+
+    for i in range(num_transactions):
+        tx = Transaction(
+            date=datetime.date(2024, 1, 1) + datetime.timedelta(days=i % 30),
+            amount=decimal.Decimal(i) + decimal.Decimal('0.50'),
+            description=f'Transaction {i}',
+            tags=[tags[i % 6], tags[(i + 1) % 6]],
+        )
+        tx.documents.append(Document(
+            original_filename=f'receipt_{i}.pdf',
+            stored_filename=f'stored_{i}.pdf',
+            mimetype='application/pdf',
+        ))
+        if i % 5 == 0:
+            tx.children_flag = True
+            tx.children.append(Transaction(
+                date=tx.date,
+                amount=decimal.Decimal('0.25'),
+                description=f'Sub-item: Transaction {i}',
+                tags=[tags[i % 6]],
+            ))
+        db.session.add(tx)
+    db.session.commit()
+    db.session.expunge_all()
+
+
+@pytest.mark.parametrize('num_transactions', [5, 60])
+def test_listing_uses_fixed_number_of_queries(client, count_queries, num_transactions):
+    seed_ledger(num_transactions)
+
+    with count_queries() as counter:
+        response = client.get('/api/transactions')
+
+    assert response.status_code == 200
+    assert len(response.get_json()) == num_transactions + len(range(0, num_transactions, 5))
+    assert counter.count == EXPECTED_LISTING_QUERIES, counter.statements
+
+
+@pytest.mark.parametrize('num_transactions', [5, 60])
+def test_paginated_listing_uses_fixed_number_of_queries(client, count_queries, num_transactions):
+    seed_ledger(num_transactions)
+
+    with count_queries() as counter:
+        response = client.get('/api/transactions?limit=50')
+
+    assert response.status_code == 200
+    assert counter.count == EXPECTED_LISTING_QUERIES, counter.statements
+
+
+def test_bulk_serialization_matches_to_json(client):
+    seed_ledger(12)
+
+    listed = {tx['id']: tx for tx in client.get('/api/transactions').get_json()}
+    for tx in Transaction.query.all():
+        expected = tx.to_json(include_tags=True, include_documents=True)
+        actual = listed[tx.id]
+        assert sorted(actual['tags'], key=lambda t: t['id']) == sorted(expected['tags'], key=lambda t: t['id'])
+        assert actual['documents'] == expected['documents']
+        assert {k: v for k, v in actual.items() if k not in ('tags', 'documents')} == \
+            {k: v for k, v in expected.items() if k not in ('tags', 'documents')}
@@ -0,0 +1,145 @@
+# File path: backend/tests/test_splits.py
+
+import datetime
+import decimal
+
+from app import db
+from models import Transaction, Tag, TagGroup, Document
+from balances import ledger_daily_balances, rebuild_daily_balances
+
+
+# A split, re-split or merge is one request and one commit: the children carry
+# their amounts, descriptions and tags from the start, and the materialized
+# daily balances match a recomputation from the ledger afterwards.
+
+
+def seed_invoice(amount='-100.00'):
+    group = TagGroup(name='Spending')
+    tags = [Tag(name=name, tag_group=group) for name in ('Groceries', 'Household', 'Invoice')]
+    parent = Transaction(date=datetime.date(2024, 3, 5), amount=decimal.Decimal(amount),
+                         description='Supermarket', tags=[tags[2]])
+    db.session.add_all([group, parent] + tags)
+    db.session.flush()
+    rebuild_daily_balances()
+    db.session.commit()
+    return parent.id, [tag.id for tag in tags]
+
+
+def assert_balances_consistent():
+    materialized = ledger_daily_balances()
+    rebuild_daily_balances()
+    db.session.flush()
+    assert ledger_daily_balances() == materialized
+    db.session.rollback()
+
+
+def amounts(body):
+    return [child['amount'] for child in body['children']]
+
+
+def test_equal_shares_give_the_remainder_cents_to_the_first_children(client):
+    parent_id, _ = seed_invoice()
+
+    response = client.post(f'/api/transactions/{parent_id}/split', json={'allocation': 'equal', 'num_children': 3})
+
+    assert response.status_code == 201
+    body = response.get_json()
+    assert amounts(body) == ['-33.34', '-33.33', '-33.33']
+    assert body['unallocated'] == '0.00'
+    assert body['parent']['children_flag'] and body['parent']['tags'] == []
+    assert all(child['tags'][0]['name'] == 'Invoice' for child in body['children'])
+    assert_balances_consistent()
+
+
+def test_percentages_use_largest_remainder(client):
+    parent_id, _ = seed_invoice('-10.00')
+
+    response = client.post(f'/api/transactions/{parent_id}/split', json={
+        'allocation': 'percentages',
+        'children': [{'percentage': 33.333}, {'percentage': '33,333'}, {'percentage': 16.667}],
+    })
+
+    body = response.get_json()
+    assert amounts(body) == ['-3.33', '-3.33', '-1.67']
+    assert body['unallocated'] == '-1.67'
+    assert_balances_consistent()
+
+
+def test_an_invoice_is_split_with_its_lines_in_one_request(client):
+    parent_id, (groceries, household, _) = seed_invoice('-125.00')
+    lines = [{'amount': '-2.50', 'description': f'Line {i}', 'tag_ids': [groceries if i % 2 else household]}
+             for i in range(50)]
+
+    response = client.post(f'/api/transactions/{parent_id}/split', json={'children': lines})
+
+    assert response.status_code == 201
+    body = response.get_json()
+    assert len(body['children']) == 50
+    assert body['unallocated'] == '0.00'
+    assert [child['description'] for child in body['children']] == [f'Line {i}' for i in range(50)]
+    assert [child['tags'][0]['id'] for child in body['children'][:2]] == [household, groceries]
+    assert_balances_consistent()
+
+
+def test_a_split_that_does_not_fit_changes_nothing(client):
+    parent_id, (groceries, _, _) = seed_invoice()
+
+    for payload in (
+        {'children': [{'amount': '-60'}, {'amount': '-60'}]},
+        {'children': [{'amount': '10'}]},
+        {'children': [{'amount': '-10', 'tag_ids': [groceries, 999]}]},
+        {'allocation': 'percentages', 'children': [{'percentage': 60}, {'percentage': 41}]},
+        {'children': [{'id': parent_id, 'amount': '-10'}]},
+    ):
+        response = client.post(f'/api/transactions/{parent_id}/split', json=payload)
+        assert response.status_code == 400, payload
+
+    assert Transaction.query.count() == 1
+    assert not db.session.get(Transaction, parent_id).children_flag
+
+
+def test_resplit_reallocates_kept_children_and_merges_the_others(client):
+    parent_id, (groceries, household, _) = seed_invoice()
+    children = client.post(f'/api/transactions/{parent_id}/split', json={'allocation': 'equal', 'num_children': 4}
+                           ).get_json()['children']
+    kept, dropped = children[0]['id'], children[1]['id']
+    db.session.add(Document(original_filename='receipt.pdf', stored_filename='receipt.pdf',
+                            mimetype='application/pdf', transaction_id=dropped))
+    db.session.commit()
+
+    response = client.post(f'/api/transactions/{parent_id}/split', json={'replace': True, 'children': [
+        {'id': kept, 'amount': '-70.00', 'tag_ids': [household]},
+        {'amount': '-30.00', 'description': 'Detergent', 'tag_ids': [groceries]},
+    ]})
+
+    assert response.status_code == 201
+    body = response.get_json()
+    assert [child['id'] for child in body['children']][0] == kept
+    assert amounts(body) == ['-70.00', '-30.00']
+    assert body['children'][1]['description'] == 'Detergent'
+    assert body['children'][0]['tags'][0]['id'] == household
+    assert [document['original_filename'] for document in body['parent']['documents']] == ['receipt.pdf']
+    assert body['parent']['doc_flag']
+    assert db.session.get(Transaction, dropped) is None
+    assert_balances_consistent()
+
+
+def test_merging_every_child_restores_a_plain_transaction(client):
+    parent_id, (groceries, household, _) = seed_invoice()
+    client.post(f'/api/transactions/{parent_id}/split', json={'children': [
+        {'amount': '-40', 'tag_ids': [groceries]}, {'amount': '-35', 'tag_ids': [household]}, {'amount': '-25'},
+    ]})
+    first_id = Transaction.query.filter_by(parent_id=parent_id).order_by(Transaction.id).first().id
+
+    response = client.post(f'/api/transactions/{parent_id}/merge', json={'child_ids': [first_id]})
+    assert response.status_code == 200
+    assert amounts(response.get_json()) == ['-35.00', '-25.00']
+    assert response.get_json()['unallocated'] == '-40.00'
+
+    response = client.post(f'/api/transactions/{parent_id}/merge')
+    body = response.get_json()
+    assert body['children'] == [] and body['unallocated'] == '-100.00'
+    assert not body['parent']['children_flag']
+    assert {tag['name'] for tag in body['parent']['tags']} == {'Household', 'Invoice'}
+    assert client.post(f'/api/transactions/{parent_id}/merge').status_code == 400
+    assert_balances_consistent()
@@ -0,0 +1,64 @@
+# File path: backend/tests/test_statement_import.py
+
+import io
+
+import pytest
+
+import statements
+from models import Transaction
+
+
+# A statement that turns unreadable part way through: the rows before the
+# break are imported (or, atomic, rolled back) and the response says so. OFX
+# rows are keyed by their FITID, however long, so a statement is imported once.
+
+
+def ofx_statement(num_transactions, trailing_garbage=70 * 1024):
+    blocks = ''.join(
+        f'<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>2024030{i + 1}<TRNAMT>-1{i}.00<FITID>F{i}<MEMO>Shop {i}</STMTTRN>'
+        for i in range(num_transactions)
+    )
+    return f'<OFX><BANKACCTFROM><ACCTID>123</BANKACCTFROM>{blocks}<STMTTRN><MEMO>{"x" * trailing_garbage}'.encode()
+
+
+@pytest.fixture
+def small_ofx_records(monkeypatch):
+    monkeypatch.setattr(statements, 'MAX_OFX_RECORD_SIZE', 1024)
+
+
+def import_file(client, content, **fields):
+    return client.post('/api/transactions/import',
+                       data={'file': (io.BytesIO(content), 'statement.ofx'), 'chunk_size': '2', **fields})
+
+
+def test_rows_before_an_unreadable_part_are_kept_and_reported(client, small_ofx_records):
+    response = import_file(client, ofx_statement(3))
+
+    assert response.status_code == 400
+    summary = response.get_json()
+    assert summary['created'] == 3 and summary['rows'] == 3
+    assert 'too large' in summary['error']
+    assert not summary['rolled_back']
+    assert Transaction.query.count() == 3
+
+
+def test_an_atomic_import_of_an_unreadable_file_keeps_nothing(client, small_ofx_records):
+    response = import_file(client, ofx_statement(3), atomic='true')
+
+    assert response.status_code == 400
+    summary = response.get_json()
+    assert summary['rolled_back'] and summary['created'] == 0
+    assert summary['error']
+    assert Transaction.query.count() == 0
+
+
+def test_a_long_fitid_still_keys_its_row(client):
+    fitid = 'F' * 255
+    content = (f'<OFX><BANKACCTFROM><ACCTID>123</BANKACCTFROM><STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240301'
+               f'<TRNAMT>-10.00<FITID>{fitid}<MEMO>Shop</STMTTRN></OFX>').encode()
+
+    first = import_file(client, content, skip_duplicates='false').get_json()
+    assert first['created'] == 1 and first['failed'] == 0
+    again = import_file(client, content, skip_duplicates='false').get_json()
+    assert again['created'] == 0 and again['existing'] == 1
+    assert Transaction.query.count() == 1
@@ -0,0 +1,91 @@
+# File path: backend/tests/test_suggestions.py
+
+import datetime
+import decimal
+
+import pytest
+
+import suggestions
+from app import db
+from models import Transaction, Tag, TagGroup
+
+
+# The scorer is trained on the tags already assigned; the routes score saved
+# transactions and rows not imported yet, and refuse input the scorer cannot use.
+
+
+@pytest.fixture(autouse=True)
+def fresh_model():
+    suggestions.reset_model()
+    yield
+    suggestions.reset_model()
+
+
+def seed_tagged_ledger():
+    group = TagGroup(name='Spending')
+    coffee, rent = Tag(name='Coffee', tag_group=group), Tag(name='Rent', tag_group=group)
+    db.session.add_all([group, coffee, rent])
+    db.session.add_all([
+        Transaction(date=datetime.date(2024, 1, 1) + datetime.timedelta(days=i), amount=decimal.Decimal('-3.50'),
+                    description=f'Coffee shop {i}', tags=[coffee])
+        for i in range(10)
+    ] + [
+        Transaction(date=datetime.date(2024, 1, 1) + datetime.timedelta(days=i), amount=decimal.Decimal('-950.00'),
+                    description='Monthly rent landlord', tags=[rent])
+        for i in range(10)
+    ])
+    untagged = Transaction(date=datetime.date(2024, 2, 1), amount=decimal.Decimal('-4.10'), description='Coffee shop 99')
+    db.session.add(untagged)
+    db.session.commit()
+    return coffee.id, rent.id, untagged.id
+
+
+def test_amount_features_give_sign_and_magnitude():
+    assert suggestions.amount_features(decimal.Decimal('-950.00')) == ('$out', '$out2')
+    assert suggestions.amount_features(decimal.Decimal('0.50')) == ('$in', '$in0')
+    assert suggestions.amount_features(decimal.Decimal('1E+400')) == ('$in', '$in400')
+    assert suggestions.amount_features(decimal.Decimal('NaN')) == ()
+    assert suggestions.amount_features(decimal.Decimal('-Infinity')) == ()
+    assert suggestions.amount_features(None) == ()
+
+
+def test_scorer_suggests_the_tag_of_similar_transactions(app):
+    coffee, rent, _ = seed_tagged_ledger()
+
+    best = suggestions.suggest_tags('Coffee shop 42', decimal.Decimal('-3.20'))
+    assert best[0]['tag_id'] == coffee
+    assert suggestions.suggest_tags('Coffee shop 42', decimal.Decimal('-3.20'), current_tag_ids=[rent]) == []
+
+
+def test_suggestion_routes(client):
+    coffee, _, untagged = seed_tagged_ledger()
+
+    response = client.get(f'/api/transactions/{untagged}/tag-suggestions')
+    assert response.status_code == 200
+    assert response.get_json()['suggestions'][0]['tag_id'] == coffee
+
+    response = client.post('/api/transactions/tag-suggestions', json={'transaction_ids': [untagged]})
+    assert response.status_code == 200
+    assert response.get_json()['results'][0]['suggestions'][0]['tag_id'] == coffee
+
+    response = client.post('/api/transactions/tag-suggestions', json={'transactions': [
+        {'description': 'Coffee shop 7', 'amount': '-3,80'}, {'description': 'Coffee shop 8', 'tag_ids': [coffee]},
+    ]})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert results[0]['suggestions'][0]['tag_id'] == coffee
+    assert results[1]['suggestions'] == []
+
+
+@pytest.mark.parametrize('row', [
+    {'description': 'Coffee', 'amount': 'NaN'},
+    {'description': 'Coffee', 'amount': 'Infinity'},
+    {'description': 'Coffee', 'amount': '-inf'},
+    {'description': 'Coffee', 'amount': 'abc'},
+    {'description': 'Coffee', 'tag_ids': ['x']},
+    {'description': 'Coffee', 'tag_ids': 3},
+    {'description': 42},
+])
+def test_batch_suggestions_refuse_rows_the_scorer_cannot_use(client, row):
+    response = client.post('/api/transactions/tag-suggestions', json={'transactions': [row]})
+    assert response.status_code == 400
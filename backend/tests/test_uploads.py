@@ -0,0 +1,123 @@
+# File path: backend/tests/test_uploads.py
+
+import datetime
+import decimal
+import hashlib
+import io
+import os
+
+from app import app, db
+from models import Document, DocumentBlob, Transaction, UploadSession
+from storage import (upload_session_path, upload_write_lock, release_documents, remove_released_files,
+                     document_file_path, blob_filename, insert_blob)
+
+
+# Chunked uploads: a client retry that arrives while the first request is still
+# streaming the same chunk must not append it a second time. Deleting the last
+# document of a content must not take the file of an upload that brought the
+# same content back meanwhile. Two uploads of one new content racing to
+# insert its blob both succeed, as two references.
+
+
+def start_upload(client, size):
+    tx = Transaction(date=datetime.date(2024, 1, 1), amount=decimal.Decimal('-1.00'), description='Receipt')
+    db.session.add(tx)
+    db.session.commit()
+    response = client.post(f'/api/transactions/{tx.id}/uploads', json={'filename': 'receipt.txt', 'size': size})
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+
+def test_a_chunk_is_refused_while_another_is_being_written(client):
+    data = b'0123456789' * 100
+    upload_id = start_upload(client, len(data))
+
+    # The first request holds the lock while it streams its chunk
+    with open(upload_session_path(upload_id), 'ab') as target, upload_write_lock(upload_id, target):
+        target.write(data[:500])
+        target.flush()
+        retry = client.put(f'/api/uploads/{upload_id}?offset=0', data=data)
+    assert retry.status_code == 409
+    assert os.path.getsize(upload_session_path(upload_id)) == 500
+
+    assert client.put(f'/api/uploads/{upload_id}?offset=500', data=data[500:]).status_code == 200
+    # Once received, the same offset is refused rather than appended again
+    assert client.put(f'/api/uploads/{upload_id}?offset=500', data=data[500:]).status_code == 409
+    assert os.path.getsize(upload_session_path(upload_id)) == len(data)
+
+    response = client.post(f'/api/uploads/{upload_id}/complete')
+    assert response.status_code == 201, response.get_json()
+    assert db.session.get(UploadSession, upload_id) is None
+
+
+def upload_document(client, transaction_id, content):
+    response = client.post(f'/api/transactions/{transaction_id}/documents',
+                           data={'file': (io.BytesIO(content), 'receipt.pdf')})
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['id']
+
+
+def test_a_released_file_recreated_by_an_upload_is_kept(client):
+    content = b'%PDF-1.4 receipt'
+    start_upload(client, 1)
+    tx_id = Transaction.query.one().id
+    document = db.session.get(Document, upload_document(client, tx_id, content))
+
+    db.session.delete(document)
+    released = release_documents([document])
+    db.session.commit()
+    # The same content is uploaded again before the deleting request unlinks its file
+    again = db.session.get(Document, upload_document(client, tx_id, content))
+    remove_released_files(released)
+
+    assert os.path.exists(document_file_path(again))
+    assert client.get(f'/api/documents/{again.id}/download').status_code == 200
+
+
+def test_a_released_file_replaced_by_an_uncommitted_upload_is_kept(client):
+    content = b'%PDF-1.4 invoice'
+    start_upload(client, 1)
+    tx_id = Transaction.query.one().id
+    document = db.session.get(Document, upload_document(client, tx_id, content))
+    path = document_file_path(document)
+
+    db.session.delete(document)
+    released = release_documents([document])
+    db.session.commit()
+    # Another request has moved its file into place but not committed its blob yet
+    incoming = path + '.incoming'
+    with open(incoming, 'wb') as target:
+        target.write(content)
+    os.replace(incoming, path)
+    remove_released_files(released)
+    assert os.path.exists(path)
+
+    # Without a concurrent upload the file goes with its last reference
+    document = db.session.get(Document, upload_document(client, tx_id, b'%PDF-1.4 statement'))
+    path = document_file_path(document)
+    assert client.delete(f'/api/documents/{document.id}').status_code == 200
+    assert not os.path.exists(path)
+
+
+def test_an_upload_losing_the_race_for_a_new_blob_becomes_a_reference(client):
+    content = b'%PDF-1.4 shared'
+    sha256 = hashlib.sha256(content).hexdigest()
+    start_upload(client, 1)
+    tx_id = Transaction.query.one().id
+    winner = db.session.get(Document, upload_document(client, tx_id, content))
+    assert winner.stored_filename is None
+
+    # The other upload checked for the blob before the winner committed it, and
+    # moved its own file into place under another extension
+    stored_filename = blob_filename(sha256, 'png')
+    path = os.path.join(app.config['UPLOAD_FOLDER'], stored_filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as target:
+        target.write(content)
+    blob = insert_blob(sha256, stored_filename, len(content))
+    db.session.commit()
+
+    assert blob.stored_filename == winner.blob.stored_filename
+    assert db.session.get(DocumentBlob, sha256).ref_count == 2
+    assert not os.path.exists(path)
+    assert os.path.exists(document_file_path(winner))
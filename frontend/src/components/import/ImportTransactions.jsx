@@ -87,6 +87,29 @@ const standardizeAmountString = (rawValue) => {
     return amountStr.replace(/[^0-9.-]/g, '');
 };
 
+// Hex SHA-256 of a string or an ArrayBuffer (Web Crypto is only there in secure contexts)
+const sha256Hex = async (data) => {
+    const bytes = typeof data === 'string' ? new TextEncoder().encode(data) : data;
+    const digest = await crypto.subtle.digest('SHA-256', bytes);
+    return Array.from(new Uint8Array(digest), (byte) => byte.toString(16).padStart(2, '0')).join('');
+};
+
+// Idempotency keys are kept by the server for good, so they come from the content:
+// the hash of the file (of the parsed rows when there is no file) plus the row's
+// position and a hash of its date, amount and description. A retry of the same file
+// sends the same keys; another file, even with the same name and size, never does.
+// Returns null where hashing is unavailable, and rows are then sent without keys.
+const buildIdempotencyKeys = async (sourceFile, rows) => {
+    if (!globalThis.crypto?.subtle) {
+        return null;
+    }
+    const contentHash = await sha256Hex(sourceFile ? await sourceFile.arrayBuffer() : JSON.stringify(rows));
+    return Promise.all(rows.map(async (tx, index) => {
+        const rowHash = await sha256Hex(JSON.stringify([tx.Date, tx.Amount, tx.Description]));
+        return `${contentHash}:${index}:${rowHash.slice(0, 32)}`;
+    }));
+};
+
 
 const MAX_PREVIEW_ROWS_IN_STEP2_TABLE = 1000;
 
@@ -348,7 +371,11 @@ export default function ImportTransactions({ }) {
     };
 
     const performImport = async () => {
-        const transactionsToImport = dataForStep3.data.filter(tx => !tx.isDuplicate);
+        // Keys are built over every row, duplicates included, so a retried import sends the same ones
+        const idempotencyKeys = await buildIdempotencyKeys(fileUpload.acceptedFiles[0], dataForStep3.data);
+        const transactionsToImport = dataForStep3.data
+            .map((tx, index) => ({ ...tx, idempotencyKey: idempotencyKeys ? idempotencyKeys[index] : undefined }))
+            .filter(tx => !tx.isDuplicate);
         if (transactionsToImport.length === 0) {
             console.log("All transactions to import are duplicates or there's no data.")
             toaster.create({
@@ -367,31 +394,33 @@ export default function ImportTransactions({ }) {
         let successCount = 0;
         let errorCount = 0;
 
-        for (const tx of transactionsToImport) {
-            try {
-                const payload = {
+        try {
+            // One request for the whole file; the server inserts it in a single DB transaction
+            const payload = {
+                transactions: transactionsToImport.map(tx => ({
                     date: tx.Date, // Assumes YYYY-MM-DD from parseDateToYYYYMMDD
                     amount: tx.Amount, // Assumes standardized string "xxxx.xx"
                     description: tx.Description,
+                    idempotency_key: tx.idempotencyKey,
                     // tag_ids: [] // Add tag_ids if you implement tagging at import
-                };
-                const response = await fetch(`${API_BASE_URL}/api/transactions/new`, {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify(payload)
-                });
-                if (response.ok) {
-                    successCount++;                    
-                } else {
-                    errorCount++;
-                    const errorData = await response.json();
-                    console.error(`Failed to import transaction: ${tx.Description}`, errorData.error);
-                    // Optionally show a toast for each error or a summary
-                }
-            } catch (e) {
-                errorCount++;
-                console.error(`Client error importing transaction: ${tx.Description}`, e);
+                })),
+            };
+            const response = await fetch(`${API_BASE_URL}/api/transactions/bulk`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(payload)
+            });
+            const result = await response.json();
+            if (response.ok) {
+                successCount = result.created;
+                errorCount = result.failed;
+            } else {
+                errorCount = transactionsToImport.length;
+                console.error("Failed to import transactions:", result.error, result.results || '');
             }
+        } catch (e) {
+            errorCount = transactionsToImport.length;
+            console.error("Client error importing transactions", e);
         }
         setIsLoading(false);
         setIsConfirmDialogOpen(false);
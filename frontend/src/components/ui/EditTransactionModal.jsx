@@ -215,41 +215,19 @@ export default function EditTransactionModal ({
                 throw new Error(updateData.error || updateData.description || `Failed to update transaction (status ${updateRes.status})`);
             }
             
-            // --- 2. Add New Tags ---
-            if (addedTags && addedTags.length > 0) {
-                for (const tagIdToAdd of addedTags) {
-                    if (typeof tagIdToAdd !== 'number' || tagIdToAdd === null || typeof tagIdToAdd === 'undefined') {
-                        console.warn("Skipping invalid tag ID found in addedTags:", tagIdToAdd);
-                        continue;
-                    }
-                    const addTagRes = await fetch(`${BASE_URL}/transactions/${transactionIdToUpdate}/tags`, {
-                        method: "POST",
-                        headers: { "Content-Type": "application/json", },
-                        body: JSON.stringify({ tag_id: tagIdToAdd }),
-                    });
-                    const addTagData = await addTagRes.json();
-                    if (!addTagRes.ok && addTagRes.status !== 409 && !(addTagData.message || addTagData.error || '').includes("already associated")) {
-                         throw new Error(addTagData.error || addTagData.description || `Failed to add tag ID ${tagIdToAdd} (status ${addTagRes.status})`);
-                    } else {
-                        console.log(`Tag ID ${tagIdToAdd} added or already associated.`);
-                    }
-                }
-                successMessage = "Transaction and tags updated successfully.";
-            }
-
-            // --- 3. Remove Tags ---
-            if (removedTags && removedTags.length > 0) {
-                for (const tagIdToRemove of removedTags) {
-                    if (typeof tagIdToRemove !== 'number' || tagIdToRemove === null || typeof tagIdToRemove === 'undefined') {
-                        console.warn("Skipping invalid tag ID found in removedTags:", tagIdToRemove);
-                        continue;
-                    }
-                    const removeTagRes = await fetch(`${BASE_URL}/transactions/${transactionIdToUpdate}/tags/${tagIdToRemove}`, { method: "DELETE" });
-                    if (!removeTagRes.ok && removeTagRes.status !== 404) {
-                        let errorData = {};
-                        try { errorData = await removeTagRes.json(); } catch (e) { /* Ignore */ }
-                        throw new Error(errorData.error || errorData.description || `Failed to remove tag ID ${tagIdToRemove} (status ${removeTagRes.status})`);
-                    }
+            // --- 2. Add and Remove Tags, in one request ---
+            const tagsToAdd = (addedTags ?? []).filter(id => typeof id === 'number');
+            const tagsToRemove = (removedTags ?? []).filter(id => typeof id === 'number');
+            if (tagsToAdd.length > 0 || tagsToRemove.length > 0) {
+                const tagsRes = await fetch(`${BASE_URL}/transactions/tags/bulk`, {
+                    method: "POST",
+                    headers: { "Content-Type": "application/json", },
+                    body: JSON.stringify({ transaction_ids: [transactionIdToUpdate], add: tagsToAdd, remove: tagsToRemove }),
+                });
+                if (!tagsRes.ok) {
+                    let errorData = {};
+                    try { errorData = await tagsRes.json(); } catch (e) { /* Ignore */ }
+                    throw new Error(errorData.error || errorData.description || `Failed to update tags (status ${tagsRes.status})`);
                 }
                 successMessage = "Transaction and tags updated successfully.";
             }
@@ -448,6 +426,7 @@ export default function EditTransactionModal ({
                                     <Stack direction={ "row" } gap="0" align="center">
                                         <Text fontSize="xs">Tags:</Text>
                                         <EditTransactionTagsModal
+                                            transactionId={formData.id}
                                             setTransacData={setFormData}
                                             existingTags={formData.tags}
                                             selectedTagIds={selectedTagIds}
@@ -533,7 +512,7 @@ export default function EditTransactionModal ({
                                                         <IconButton 
                                                             colorPalette="cyan"
                                                             as="a" // Render as anchor tag
-                                                            href={`${BASE_URL}/documents/${doc.id}/view`}
+                                                            href={`${BASE_URL}/documents/${doc.id}/view${doc.sha256 ? `?v=${doc.sha256}` : ''}`}
                                                             target="_blank" // Open in new tab
                                                             rel="noopener noreferrer"
                                                             size="2xs" 
@@ -546,7 +525,7 @@ export default function EditTransactionModal ({
                                                         <IconButton 
                                                             colorPalette="cyan"
                                                             as="a" // Render as anchor tag
-                                                            href={`${BASE_URL}/documents/${doc.id}/download`}
+                                                            href={`${BASE_URL}/documents/${doc.id}/download${doc.sha256 ? `?v=${doc.sha256}` : ''}`}
                                                             target="_blank" // Open in new tab
                                                             rel="noopener noreferrer"
                                                             size="2xs" 
@@ -10,6 +10,7 @@ import { ldbTagGroupsAtom, selectedTagGroupId, refreshTagGroupsAtom } from "../.
 
 
 export default function EditTransactionTagsModal ({
+    transactionId,    // Used to fetch tag suggestions; omitted for unsaved transactions
     setTransacData,   // Function to update the transaction object in parent state
     existingTags,     // Array of tag objects currently associated: [{id, name, color, ...}, ...]
     selectedTagIds,
@@ -31,6 +32,21 @@ export default function EditTransactionTagsModal ({
 
     const [isSaving, setIsSaving] = useState(false);
     const [saveError, setSaveError] = useState('');
+    const [suggestions, setSuggestions] = useState([]);
+
+    // Suggested tags learned from past tagging; failures just mean no suggestions
+    useEffect(() => {
+        if (!open || !transactionId) {
+            setSuggestions([]);
+            return;
+        }
+        let cancelled = false;
+        fetch(`${BASE_URL}/transactions/${transactionId}/tag-suggestions`)
+            .then(res => res.ok ? res.json() : { suggestions: [] })
+            .then(data => { if (!cancelled) setSuggestions(data.suggestions ?? []); })
+            .catch(() => { if (!cancelled) setSuggestions([]); });
+        return () => { cancelled = true; };
+    }, [open, transactionId]);
 
     // Helper function to get all tag objects from the groupsData structure
     const getAllTagsFromGroups = (groups) => {
@@ -214,6 +230,25 @@ export default function EditTransactionTagsModal ({
                                     </Flex>
                                 )}
 
+                                {!isLoading && suggestions.some(s => !selectedTagIds.has(s.tag_id)) && (
+                                    <HStack gap={2} wrap="wrap">
+                                        <Text fontSize="xs" color="gray.500">Suggested:</Text>
+                                        {suggestions.filter(s => !selectedTagIds.has(s.tag_id)).map(s => (
+                                            <Button
+                                                key={s.tag_id}
+                                                size="2xs"
+                                                variant="subtle"
+                                                colorPalette="cyan"
+                                                onClick={() => handleTagSelectionChange(s.tag_id, true)}
+                                                disabled={isSaving}
+                                                title={`${Math.round(s.confidence * 100)}% confidence`}
+                                            >
+                                                + {s.tag_name}
+                                            </Button>
+                                        ))}
+                                    </HStack>
+                                )}
+
                                 {!isLoading && groupsData.data && groupsData.data.length > 0 && (
                                     <VStack spacing={6} align="stretch" maxHeight="400px" overflowY="auto" pr={2}> {/* Added scroll */}
                                         {groupsData.data.map((tGroup) => (
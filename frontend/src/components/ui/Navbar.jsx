@@ -79,23 +79,45 @@ export default function Navbar() {
             duration: null, // Persistent
         });
 
+        const errorMessage = async (response, fallback) => {
+            try {
+                const errorData = await response.json();
+                return errorData.error || errorData.message || `Server error: ${response.statusText}`;
+            } catch (e) {
+                // If response is not JSON, use status text or a generic message
+                return `${fallback}: ${response.statusText || response.status}`;
+            }
+        };
+
         try {
-            const response = await fetch(`${BASE_URL}/backup/all`, {
-                method: 'GET',
+            // The archive is built by a background job; poll it, then download its result
+            const submitResponse = await fetch(`${BASE_URL}/jobs/backup`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({}),
                 // If your API requires authentication, add Authorization header here
                 // headers: { 'Authorization': `Bearer ${your_auth_token}` },
             });
+            if (!submitResponse.ok) {
+                throw new Error(await errorMessage(submitResponse, "Backup request failed"));
+            }
+            let job = await submitResponse.json();
 
-            if (!response.ok) {
-                let errorDetail = "Backup failed. Please try again.";
-                try {
-                    const errorData = await response.json();
-                    errorDetail = errorData.error || errorData.message || `Server error: ${response.statusText}`;
-                } catch (e) {
-                    // If response is not JSON, use status text or a generic message
-                    errorDetail = `Backup request failed: ${response.statusText || response.status}`;
+            while (job.status === 'queued' || job.status === 'running') {
+                await new Promise((resolve) => setTimeout(resolve, 1000));
+                const statusResponse = await fetch(`${BASE_URL}/jobs/${job.id}`);
+                if (!statusResponse.ok) {
+                    throw new Error(await errorMessage(statusResponse, "Could not follow the backup"));
                 }
-                throw new Error(errorDetail);
+                job = await statusResponse.json();
+            }
+            if (job.status !== 'succeeded') {
+                throw new Error(job.error || `Backup ${job.status}.`);
+            }
+
+            const response = await fetch(`${BASE_URL}/jobs/${job.id}/result`);
+            if (!response.ok) {
+                throw new Error(await errorMessage(response, "Backup download failed"));
             }
 
             const blob = await response.blob();
@@ -11,6 +11,7 @@ import {
     Stack,
     Spinner,
     Alert,
+    Checkbox,
     Theme
 } from "@chakra-ui/react";
 import { useAtom, useSetAtom } from "jotai";
@@ -20,6 +21,7 @@ import { BASE_URL } from "../../App"; // Assuming BASE_URL is correctly defined
 
 export default function SplitTransactionModal({ isOpen, onClose, transactionToSplit }) {
     const [numberOfSplits, setNumberOfSplits] = useState(2);
+    const [shareEqually, setShareEqually] = useState(true);
     const [isSaving, setIsSaving] = useState(false);
     const [errorMessage, setErrorMessage] = useState('');
     const refreshTransactions = useSetAtom(refreshTransactionsAtom);
@@ -49,7 +51,8 @@ export default function SplitTransactionModal({ isOpen, onClose, transactionToSp
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify({ num_children: numSplits }),
+                // With 'equal' the server allocates the amount to the children in the same commit
+                body: JSON.stringify(shareEqually ? { num_children: numSplits, allocation: 'equal' } : { num_children: numSplits }),
             });
 
             const data = await response.json();
@@ -91,6 +94,7 @@ export default function SplitTransactionModal({ isOpen, onClose, transactionToSp
     // Reset local state when the modal is closed externally or cancelled
     const handleClose = () => {
         setNumberOfSplits(2);
+        setShareEqually(true);
         setErrorMessage('');
         setIsSaving(false);
         onClose(); // Call the parent's onClose handler
@@ -145,6 +149,17 @@ export default function SplitTransactionModal({ isOpen, onClose, transactionToSp
                                         How many new transactions to create? (min 2)
                                     </Field.HelperText>
                                 </Field.Root>
+                                <Checkbox.Root
+                                    size="sm"
+                                    colorPalette="teal"
+                                    checked={shareEqually}
+                                    onCheckedChange={(e) => setShareEqually(!!e.checked)}
+                                    disabled={isSaving}
+                                >
+                                    <Checkbox.HiddenInput />
+                                    <Checkbox.Control />
+                                    <Checkbox.Label>Share the amount equally between them</Checkbox.Label>
+                                </Checkbox.Root>
                             </Stack>
                         </Dialog.Body>
                         <Dialog.Footer gap={3}>
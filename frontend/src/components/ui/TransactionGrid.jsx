@@ -1,13 +1,13 @@
 // .\frontend\src\components\ui\TransactionGrid.jsx
 
-import { useAtom, useAtomValue, useSetAtom } from "jotai";
+import { useAtom, useAtomValue } from "jotai";
 import {
     ldbTransactionsAtom,
     selectedTransaction as selectedTransactionAtom, // Rename imported atom
     ldbInitialBalanceAtom,
-    finalRunningBalanceAtom
+    ldbDailyBalancesAtom
 } from "../../context/atoms";
-import { useEffect, useState, useMemo, Fragment, useRef } from "react";
+import { useMemo, Fragment } from "react";
 import { BASE_URL } from "../../App";
 import { VStack, Spinner, Text, Flex, StackSeparator, Box, Spacer, HStack } from "@chakra-ui/react";
 import TransactionCard from "./TransactionCard";
@@ -51,8 +51,7 @@ export default function TransactionGrid ({
     const { state: transactionState, data: allTransactionsData } = useAtomValue(ldbTransactionsAtom);
     const [selectedTransac, setSelectedTransac] = useAtom(selectedTransactionAtom); // Use the renamed atom for state management
     const [initialBalanceData] = useAtom(ldbInitialBalanceAtom);
-    const setFinalBalance = useSetAtom(finalRunningBalanceAtom);
-    const lastSentBalanceRef = useRef(null);
+    const [dailyBalancesData] = useAtom(ldbDailyBalancesAtom);
 
     const isLoading = transactionState === 'loading';
     const isLoadingInitialBalance = initialBalanceData.state === 'loading';
@@ -68,157 +67,19 @@ export default function TransactionGrid ({
     };
 
 
-    // Memoize the chronologically sorted *full* transaction list for *total balance* calculation
-    // Also needed for parent amount calculation
-    const chronologicallySortedAllTransactions = useMemo(() => {
-        if (transactionState !== 'hasData' || !Array.isArray(allTransactionsData)) {
-            return [];
+    // End-of-day balances of the whole ledger come from the server (daily-balances endpoint),
+    // so the grid no longer rebuilds the chronological running balance on every render.
+    const balanceByDate = useMemo(() => {
+        const balances = new Map();
+        if (dailyBalancesData.state !== 'hasData' || !Array.isArray(dailyBalancesData.data?.days)) {
+            return balances;
         }
-        // Sort ascending (oldest first) for balance calculation consistency and parent-child grouping
-        // This sort includes the parent/child logic needed for chronological balance calculation too
-        return [...allTransactionsData].sort((a, b) => {
-            const dateA = new Date(a.date + 'T00:00:00Z').getTime(); // Ensure consistent UTC parsing
-            const dateB = new Date(b.date + 'T00:00:00Z').getTime();
-             if (dateA !== dateB) return dateA - dateB; // Primary: date ASC
-
-            // Secondary: Group parent and children together
-            const parentCoalesceIdA = a.parent_id ?? a.id;
-            const parentCoalesceIdB = b.parent_id ?? b.id;
-            if (parentCoalesceIdA !== parentCoalesceIdB) {
-                 // Use string comparison if IDs are not guaranteed numbers, or handle potential non-numeric IDs
-                return String(parentCoalesceIdA).localeCompare(String(parentCoalesceIdB));
-            }
-
-            // Tertiary: Sort parent before children
-            const isChildSortA = a.parent_id ? 1 : 0;
-            const isChildSortB = b.parent_id ? 1 : 0;
-            if (isChildSortA !== isChildSortB) {
-                return isChildSortA - isChildSortB;
-            }
-
-            // Quaternary: Consistent order for siblings/children (using ID)
-             // Use string comparison if IDs are not guaranteed numbers
-             return String(a.id).localeCompare(String(b.id));
-        });
-    }, [transactionState, allTransactionsData]);
-
-
-    // Memoize the chronologically grouped *full* transactions with *total running balance*
-    // This now uses the adjusted parent amounts for balance calculation.
-    const chronologicalGroupsWithTotalBalance = useMemo(() => {
-        if (initialBalanceData.state !== 'hasData' || !chronologicallySortedAllTransactions || !allTransactionsData) {
-             // Added check for allTransactionsData
-            return [];
-        }
-
-        // Create a map for quick lookup of children by parent ID
-        const childrenMap = new Map();
-        allTransactionsData.forEach(tx => {
-            if (tx.parent_id !== null) {
-                if (!childrenMap.has(tx.parent_id)) {
-                    childrenMap.set(tx.parent_id, []);
-                }
-                childrenMap.get(tx.parent_id).push(tx);
-            }
+        dailyBalancesData.data.days.forEach(day => {
+            const balance = parseFloat(day.balance);
+            balances.set(day.date, isNaN(balance) ? 0 : balance);
         });
-
-        // Adjust parent amounts first before grouping and balance calculation
-        const transactionsWithAdjustedAmounts = chronologicallySortedAllTransactions.map(tx => {
-            let effectiveAmount = 0;
-            const originalAmount = parseFloat(tx.amount || '0'); // Ensure parsing
-
-            if (tx.children_flag && tx.parent_id === null) { // Explicitly check parent_id is null
-                const children = childrenMap.get(tx.id) || [];
-                const sumOfChildrenAmounts = children.reduce((sum, child) => {
-                    const childAmount = parseFloat(child.amount || '0'); // Ensure parsing
-                    return sum + (isNaN(childAmount) ? 0 : childAmount);
-                }, 0);
-
-                effectiveAmount = isNaN(originalAmount) ? 0 : originalAmount - sumOfChildrenAmounts;
-            } else {
-                // Non-parents or children use their amount directly for balance calculation
-                effectiveAmount = isNaN(originalAmount) ? 0 : originalAmount;
-            }
-
-            return {
-                ...tx,
-                // Use the *effective* amount for balance calculations
-                _effectiveAmountForBalance: effectiveAmount,
-                // Keep original amount if needed elsewhere
-                _originalAmount: isNaN(originalAmount) ? 0 : originalAmount,
-            };
-        });
-
-
-        const groups = new Map();
-        transactionsWithAdjustedAmounts.forEach((transaction) => {
-            if (!transaction.date) return;
-            try {
-                 const dateKey = transaction.date;
-                 if (!dateKey || typeof dateKey !== 'string') {
-                    console.warn("Invalid date key for transaction:", transaction.id, dateKey);
-                    return;
-                 }
-
-                if (!groups.has(dateKey)) groups.set(dateKey, []);
-                groups.get(dateKey).push(transaction); // Push the transaction with adjusted amount info
-            } catch (e) {
-                console.error(`Error processing date for transaction ID ${transaction.id}:`, e);
-            }
-        });
-
-        // Sort by date ASC
-        const sortedDateKeys = Array.from(groups.keys()).sort((a, b) => new Date(a + 'T00:00:00Z').getTime() - new Date(b + 'T00:00:00Z').getTime());
-
-        let runningBalance = initialBalanceData.data;
-        const groupsWithBalance = sortedDateKeys.map(dateKey => {
-            const txs = groups.get(dateKey);
-            // Sum based on the *effective* amount for balance
-            const groupSum = txs.reduce((sum, tx) => sum + tx._effectiveAmountForBalance, 0);
-            const groupBalance = runningBalance + groupSum;
-            runningBalance = groupBalance; // Update running balance for the next group
-            return { date: dateKey, transactions: txs, groupSum, groupBalance };
-        });
-
-        return groupsWithBalance;
-
-    // Added allTransactionsData dependency for children finding and effective amount calc
-    }, [chronologicallySortedAllTransactions, initialBalanceData.state, initialBalanceData.data, allTransactionsData]);
-
-
-    // Effect to update the final running balance in the backend (based on *all* transactions using effective amounts)
-    useEffect(() => {
-        if (
-            chronologicalGroupsWithTotalBalance.length > 0 &&
-            initialBalanceData.state === 'hasData'
-        ) {
-            // Use the balance calculated with effective amounts
-            const finalBalance = chronologicalGroupsWithTotalBalance[chronologicalGroupsWithTotalBalance.length - 1].groupBalance;
-            // Only update if the value is different to avoid unnecessary writes
-            if (finalBalance !== lastSentBalanceRef.current) {
-                 console.log(`Updating final running balance (based on ALL transactions, effective amounts): ${finalBalance}`);
-                 setFinalBalance(finalBalance);
-                 lastSentBalanceRef.current = finalBalance;
-            }
-        } else if (
-            transactionState === 'hasData' && // Check transaction state too
-            initialBalanceData.state === 'hasData' &&
-            chronologicallySortedAllTransactions.length === 0 // Check based on sorted all transactions
-        ) {
-            // If there are no transactions, the final balance is just the initial balance
-            const finalBalance = initialBalanceData.data;
-             if (finalBalance !== lastSentBalanceRef.current) {
-                 console.log(`Updating final running balance (initial): ${finalBalance}`);
-                 setFinalBalance(finalBalance);
-                 lastSentBalanceRef.current = finalBalance;
-             }
-        }
-         // Clear ref if data becomes unavailable
-         else if (transactionState !== 'hasData' || initialBalanceData.state !== 'hasData') {
-             lastSentBalanceRef.current = null;
-         }
-         // chronologicallySortedAllTransactions depends on allTransactionsData, so it's covered
-    }, [chronologicalGroupsWithTotalBalance, transactionState, initialBalanceData.state, initialBalanceData.data, setFinalBalance]);
+        return balances;
+    }, [dailyBalancesData.state, dailyBalancesData.data]);
 
 
     // Memoize the *display* grouped transactions (based on filteredTransactions prop and sortOrder)
@@ -281,28 +142,6 @@ export default function TransactionGrid ({
              return sortOrder === 'asc' ? dateA - dateB : dateB - dateA;
          });
 
-         // 4. Calculate running balance for the *filtered set* using effective amounts
-         // Find starting balance for the filtered set based on chronological order
-         const earliestFilteredDate = [...sortedFiltered].sort((a,b) => new Date(a.date + 'T00:00:00Z').getTime() - new Date(b.date + 'T00:00:00Z').getTime())[0]?.date;
-         let runningBalanceFiltered = initialBalanceData.data; // Start with initial balance
-
-         // Get the chronologically sorted groups (always ASC date order)
-         const chronologicalTotalGroupsAsc = chronologicalGroupsWithTotalBalance; //.sort((a,b) => new Date(a.date + 'T00:00:00Z').getTime() - new Date(b.date + 'T00:00:00Z').getTime());
-
-         if (earliestFilteredDate && chronologicalTotalGroupsAsc.length > 0) {
-             let lastBalanceBeforeFiltered = initialBalanceData.data;
-             // Find the balance of the group *just before* the earliest filtered date
-             for (const group of chronologicalTotalGroupsAsc) {
-                 if (group.date < earliestFilteredDate) {
-                     lastBalanceBeforeFiltered = group.groupBalance;
-                 } else {
-                     // We've reached or passed the earliest date in the filtered set
-                     break;
-                 }
-             }
-             runningBalanceFiltered = lastBalanceBeforeFiltered;
-         }
-
          // Prepare children map for quick lookup
          const childrenMap = new Map();
          allTransactionsData.forEach(tx => {
@@ -347,19 +186,8 @@ export default function TransactionGrid ({
              // Calculate group sum using effective amounts
              const groupSum = processedTxs.reduce((sum, tx) => sum + tx._effectiveAmountForBalance, 0);
 
-             // Calculate running balance for the filtered set
-             // Note: If sorting DESC, the running balance calculation needs care.
-             // It's usually calculated chronologically (ASC). The display here needs to show the balance *at the end* of that day.
-             // We'll find the balance from the chronological calculation for this dateKey.
-             const chronoGroup = chronologicalTotalGroupsAsc.find(g => g.date === dateKey);
-             const groupBalance = chronoGroup ? chronoGroup.groupBalance : runningBalanceFiltered; // Use chronological balance if found
-
-             // Update the running balance *if* sorting ASC for the next iteration (though this isn't strictly needed as we fetch from chronoGroup)
-             if (sortOrder === 'asc') {
-                 runningBalanceFiltered += groupSum;
-             }
-             // If sorting DESC, the concept of "running balance" for the next displayed group is complex.
-             // Displaying the balance *at the end of the day* (from chronological calc) is consistent.
+             // Display the balance *at the end* of that day over the whole ledger, as computed by the server.
+             const groupBalance = balanceByDate.get(dateKey) ?? initialBalanceData.data;
 
              return {
                  date: dateKey,
@@ -372,7 +200,7 @@ export default function TransactionGrid ({
          return groupsWithFilteredBalance;
 
     // Dependencies updated to include all necessary data sources for calculations
-    }, [filteredTransactions, sortOrder, initialBalanceData.state, initialBalanceData.data, allTransactionsData, chronologicalGroupsWithTotalBalance]);
+    }, [filteredTransactions, sortOrder, initialBalanceData.state, initialBalanceData.data, allTransactionsData, balanceByDate]);
 
 
     // --- Render Logic ---
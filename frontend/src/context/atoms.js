@@ -83,6 +83,30 @@ export const transactionsAtom = atom(async (get) => {
 
 export const ldbTransactionsAtom = loadable(transactionsAtom);
 
+// Daily sums and end-of-day balances, computed by the server
+export const dailyBalancesAtom = atom(async (get) => {
+    get(refreshTransactionsAtom);
+    get(refreshInitialBalanceAtom);
+    try {
+        const res = await fetch(BASE_URL + "/transactions/daily-balances");
+        const data = await res.json();
+        if (!res.ok) {
+            throw new Error(data.error || "Failed to fetch daily balances");
+        };
+        if (!Array.isArray(data.days)) {
+            console.error("Fetched daily balances have no days array:", data);
+            return { days: [], final_balance: null };
+        };
+        return data;
+
+    } catch (error) {
+        console.error("Error fetching daily balances:", error);
+        return { days: [], final_balance: null };
+    };
+});
+
+export const ldbDailyBalancesAtom = loadable(dailyBalancesAtom);
+
 // Setected Transaction
 export const selectedTransaction = atom(null);
 export const isSelectedTransaction = atom((get) => get(selectedTransaction) !== null);
@@ -154,69 +178,34 @@ export const ldbInitialBalanceAtom = loadable(initialBalanceAtom);
 // --- Final Running Balance ---
 export const refreshFinalRunningBalanceAtom = atom(0);
 
-export const finalRunningBalanceAtom = atom(
-    // Read function
-    async (get) => {
-        get(refreshFinalRunningBalanceAtom); // Depend on its own refresh trigger
-        // Also depend on initial balance refresh, as initial balance affects final balance
-        get(refreshInitialBalanceAtom);
-        // Also depend on transaction refresh, as transactions affect final balance
-        get(refreshTransactionsAtom);
-
-        try {
-            // Fetch the specific setting
-            const res = await fetch(BASE_URL + "/settings/final_running_balance", { method: "GET" });
-            if (!res.ok) {
-                if (res.status === 404) {
-                    console.log("Final running balance setting not found, defaulting to 0.");
-                    return 0; // Return 0 directly
-                }
-                const errorData = await res.json().catch(() => ({ error: "Failed to parse error response" }));
-                throw new Error(errorData.error || errorData.description || `HTTP error! status: ${res.status}`);
-            }
-            const data = await res.json();
-            // Use parseFloat and handle potential NaN
-            const balance = parseFloat(data.value);
-            return isNaN(balance) ? 0 : balance;
-        } catch (error) {
-            console.error("Error fetching final running balance:", error);
-            return 0; // Fallback to 0 on any error
-        }
-    },
-    // Write function
-    async (get, set, newBalance) => {
-        // Only update if the new balance is a valid number
-        if (typeof newBalance !== 'number' || isNaN(newBalance)) {
-            console.warn("Attempted to save invalid final running balance:", newBalance);
-            return; // Or throw an error if preferred
-        }
-
-        try {
-            const response = await fetch(BASE_URL + '/settings/final_running_balance', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                // Ensure the value sent is a string representation of the number
-                body: JSON.stringify({ value: String(newBalance.toFixed(2)) }), // Send as string, formatted
-            });
+// Computed by the server from the daily balance table; it is read-only.
+export const finalRunningBalanceAtom = atom(async (get) => {
+    get(refreshFinalRunningBalanceAtom); // Depend on its own refresh trigger
+    // Also depend on initial balance refresh, as initial balance affects final balance
+    get(refreshInitialBalanceAtom);
+    // Also depend on transaction refresh, as transactions affect final balance
+    get(refreshTransactionsAtom);
 
-            if (!response.ok) {
-                const errorData = await response.json().catch(() => ({ error: "Failed to parse error response" }));
-                throw new Error(errorData.error || errorData.description || `HTTP error! status: ${response.status}`);
+    try {
+        // Fetch the specific setting
+        const res = await fetch(BASE_URL + "/settings/final_running_balance", { method: "GET" });
+        if (!res.ok) {
+            if (res.status === 404) {
+                console.log("Final running balance setting not found, defaulting to 0.");
+                return 0; // Return 0 directly
             }
-
-            // Refresh this atom on success
-            set(refreshFinalRunningBalanceAtom, c => c + 1);
-
-        } catch (error) {
-            console.error("Error saving final running balance via atom:", error);
-            // Decide if this error should be surfaced to the user (e.g., via toast)
-            // For now, we just log it, as it happens in the background from TransactionGrid
-            // throw error; // Re-throwing might cause issues if TransactionGrid doesn't catch it
+            const errorData = await res.json().catch(() => ({ error: "Failed to parse error response" }));
+            throw new Error(errorData.error || errorData.description || `HTTP error! status: ${res.status}`);
         }
+        const data = await res.json();
+        // Use parseFloat and handle potential NaN
+        const balance = parseFloat(data.value);
+        return isNaN(balance) ? 0 : balance;
+    } catch (error) {
+        console.error("Error fetching final running balance:", error);
+        return 0; // Fallback to 0 on any error
     }
-);
+});
 
 // Loadable version for UI states
 export const ldbFinalRunningBalanceAtom = loadable(finalRunningBalanceAtom);
\ No newline at end of file